@@ -0,0 +1,189 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from typing import Dict, Iterable, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+class DownloadError(requests.RequestException):
+    """Raised when a file could not be downloaded after all retries"""
+    pass
+
+class DownloadedFile(str):
+    """Path of a downloaded file that also carries the SHA-256 of its content"""
+
+    def __new__(cls, path: str, sha256: str):
+        instance = super().__new__(cls, path)
+        instance.sha256 = sha256
+        return instance
+
+class DownloadClient:
+    """
+    Pooled HTTP client for downloading generated images
+
+    One instance is shared by all threads of a process so connections to the
+    CDN are kept alive and reused instead of paying a TCP+TLS handshake per
+    image. Requests have connect/read timeouts, transient failures are retried
+    with exponential backoff and interrupted transfers resume with HTTP Range.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, connect_timeout: float = 5.0, read_timeout: float = 30.0, max_retries: int = 3,
+                 backoff_factor: float = 0.5, pool_size: int = 10):
+        """
+        Initialize download client
+
+        Args:
+            connect_timeout (float): Seconds to wait for a connection to be established
+            read_timeout (float): Seconds to wait for data on an open connection
+            max_retries (int): Retries of a failed download
+            backoff_factor (float): Base of the exponential backoff between retries in seconds
+            pool_size (int): Connections kept alive per host
+        """
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        # Retry failed connects and retryable statuses before any data is read;
+        # failures in the middle of a body are handled in download_to_file()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=Retry(
+            total=max_retries,
+            read=0,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=['GET', 'HEAD'],
+            raise_on_status=False
+        ))
+        self._adapter = adapter
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._lock = threading.Lock()
+        self._stats = {'downloads': 0, 'failed': 0, 'retries': 0, 'resumed': 0, 'bytes': 0}
+
+    def warmup(self, urls: Iterable[str]) -> None:
+        """
+        Open keep-alive connections to the given hosts so the first download skips the handshake
+
+        Args:
+            urls (Iterable[str]): URLs on the hosts to connect to
+        """
+        for url in urls:
+            try:
+                self.session.head(url, timeout=self.timeout, allow_redirects=False).close()
+                logger.info(f"Warmed up connection to {url}")
+            except requests.RequestException as e:
+                logger.warning(f"Could not warm up connection to {url}: {str(e)}")
+
+    def download_to_file(self, url: str, directory: Optional[str] = None, suffix: str = '') -> DownloadedFile:
+        """
+        Download a URL into a new temporary file, resuming after interruptions
+
+        The content is hashed while it is written, so storing it by hash needs
+        no second pass over the file.
+
+        Args:
+            url (str): URL to download
+            directory (Optional[str]): Directory of the temporary file, system temp dir when not set
+            suffix (str): Suffix of the temporary file name
+
+        Returns:
+            DownloadedFile: Path to the downloaded file, with the SHA-256 of its content
+
+        Raises:
+            DownloadError: If the download failed after all retries
+        """
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, mode='wb', dir=directory) as temp_file:
+            logger.info(f"Downloading {url} to temporary file: {temp_file.name}")
+            try:
+                digest = self._download(url, temp_file)
+            except BaseException:
+                temp_file.close()
+                os.unlink(temp_file.name)
+                with self._lock:
+                    self._stats['failed'] += 1
+                raise
+            return DownloadedFile(temp_file.name, digest)
+
+    def _download(self, url: str, file) -> str:
+        """Stream url into file, retrying with a Range request from the last received byte, returns its SHA-256"""
+        attempt = 0
+        hasher = hashlib.sha256()
+        while True:
+            received = file.tell()
+            headers = {'Range': f'bytes={received}-'} if received else {}
+            try:
+                with self.session.get(url, stream=True, timeout=self.timeout, headers=headers) as response:
+                    if received and response.status_code == 206:
+                        with self._lock:
+                            self._stats['resumed'] += 1
+                    elif received and response.status_code == 200:
+                        # Server ignored the Range header, start over
+                        file.seek(0)
+                        file.truncate()
+                        hasher = hashlib.sha256()
+                    response.raise_for_status()
+
+                    for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                        file.write(chunk)
+                        hasher.update(chunk)
+
+                with self._lock:
+                    self._stats['downloads'] += 1
+                    self._stats['bytes'] += file.tell()
+                return hasher.hexdigest()
+
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise DownloadError(f"Download of {url} failed after {self.max_retries} retries: {str(e)}") from e
+                delay = self.backoff_factor * (2 ** (attempt - 1))
+                logger.warning(f"Download of {url} interrupted at {file.tell()} bytes ({str(e)}), "
+                               f"retrying in {delay:.1f}s")
+                with self._lock:
+                    self._stats['retries'] += 1
+                time.sleep(delay)
+
+            except requests.HTTPError as e:
+                raise DownloadError(f"Download of {url} failed: {str(e)}") from e
+
+    def get_stats(self) -> Dict:
+        """
+        Get download and connection pool statistics
+
+        Returns:
+            Dict: Download counters, plus requests and opened connections (handshakes) per host
+        """
+        with self._lock:
+            stats = dict(self._stats)
+
+        hosts = {}
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'requests': pool.num_requests,
+                'connections_opened': pool.num_connections
+            }
+
+        requests_total = sum(host['requests'] for host in hosts.values())
+        connections_total = sum(host['connections_opened'] for host in hosts.values())
+        stats.update(
+            requests=requests_total,
+            connections_opened=connections_total,
+            connection_reuse_ratio=round(1 - connections_total / requests_total, 3) if requests_total else None,
+            hosts=hosts
+        )
+        return stats
@@ -1,7 +1,10 @@
 import litellm
 import logging
 import os
-from typing import Optional
+import hashlib
+from typing import Dict, Iterator, List, Optional
+from utils.cache import TieredCache
+from utils.language_detection import english_confidence
 
 # Define custom error classes for compatibility
 class AuthenticationError(Exception):
@@ -17,14 +20,41 @@ logger = logging.getLogger(__name__)
 class LLMClient:
     """Client for interacting with various LLM APIs via liteLLM"""
 
-    def __init__(self, api_key: str, model: Optional[str] = None):
+    TRANSLATION_SYSTEM_PROMPT = """You are a professional translator.
+            Your task is to translate the given text to English.
+            Focus on:
+            - Accurate translation while maintaining the original meaning
+            - Natural English phrasing
+            - Preserving any technical or specific terms
+            Respond only with the English translation, no explanations."""
+
+    IMPROVE_SYSTEM_PROMPT = """You are an expert at writing prompts for AI image generation.
+            Your task is to enhance the given prompt to create more detailed and visually appealing images.
+            Focus on:
+            - Adding more descriptive details
+            - Specifying art style and medium
+            - Including lighting and atmosphere details
+            - Maintaining the original intent
+            Respond only with the enhanced prompt, no explanations."""
+
+    # Cached translations are only reused with the same system prompt
+    TRANSLATION_PROMPT_VERSION = hashlib.sha256(TRANSLATION_SYSTEM_PROMPT.encode()).hexdigest()[:12]
+
+    def __init__(self, api_key: str, model: Optional[str] = None, translation_cache: Optional[TieredCache] = None,
+                 english_threshold: float = 0.5):
         """
         Initialize LLM client with API key and model
 
         Args:
             api_key (str): API key for the LLM provider (typically OpenAI)
             model (str, optional): Model to use (e.g., 'gpt-4', 'grok-beta', 'claude-3-opus')
+            translation_cache (TieredCache, optional): Cache of translations, disabled when not set
+            english_threshold (float): Confidence from which a prompt is considered English and
+                not translated, values above 1 always translate
         """
+        self.translation_cache = translation_cache
+        self.english_threshold = english_threshold
+
         # Set OpenAI API key for liteLLM (most common provider)
         os.environ["OPENAI_API_KEY"] = api_key
 
@@ -109,10 +139,26 @@ class LLMClient:
             logger.error(f"Error during {operation}: {str(e)}", exc_info=True)
             raise
 
+    def is_english(self, prompt: str) -> bool:
+        """
+        Check locally whether the prompt is confidently English and needs no translation
+
+        Args:
+            prompt (str): Prompt to check
+
+        Returns:
+            bool: True if the English confidence reaches english_threshold
+        """
+        confidence = english_confidence(prompt)
+        logger.debug(f"English confidence {confidence} for prompt: {prompt}")
+        return confidence >= self.english_threshold
+
     def translate_to_english(self, prompt: str) -> str:
         """
         Translate the prompt to English using the configured LLM
 
+        Prompts that are already English are returned unchanged without calling the LLM.
+
         Args:
             prompt (str): Original prompt to translate
 
@@ -124,19 +170,22 @@ class LLMClient:
             RateLimitError: If LLM rate limit is exceeded
             Exception: For other errors
         """
-        try:
-            system_message = """You are a professional translator.
-            Your task is to translate the given text to English.
-            Focus on:
-            - Accurate translation while maintaining the original meaning
-            - Natural English phrasing
-            - Preserving any technical or specific terms
-            Respond only with the English translation, no explanations."""
+        if self.is_english(prompt):
+            logger.info("Prompt is already English, skipping translation")
+            return prompt
 
+        cache_key = self._translation_cache_key(prompt)
+        if self.translation_cache is not None:
+            cached = self.translation_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Using cached translation: {cached}")
+                return cached
+
+        try:
             response = litellm.completion(
                 model=self.model,
                 messages=[
-                    {"role": "system", "content": system_message},
+                    {"role": "system", "content": self.TRANSLATION_SYSTEM_PROMPT},
                     {"role": "user", "content": f"Translate this text to English: {prompt}"}
                 ],
                 temperature=0.3,
@@ -146,11 +195,36 @@ class LLMClient:
             translated_prompt = response.choices[0].message.content.strip()
 
             logger.info(f"Translated prompt using {self.model}: {translated_prompt}")
-            return translated_prompt
 
         except Exception as e:
             self._handle_llm_error(e, "prompt translation")
 
+        if self.translation_cache is not None and translated_prompt:
+            self.translation_cache.set(cache_key, translated_prompt)
+        return translated_prompt
+
+    def _translation_cache_key(self, prompt: str) -> str:
+        """
+        Build the cache key of a translation
+
+        Prompts differing only in whitespace or letter case share the key.
+
+        Args:
+            prompt (str): Original prompt
+
+        Returns:
+            str: Key made of the LLM model, system prompt version and normalized prompt hash
+        """
+        normalized = ' '.join(prompt.split()).casefold()
+        digest = hashlib.sha256(normalized.encode()).hexdigest()
+        return f"{self.model}:{self.TRANSLATION_PROMPT_VERSION}:{digest}"
+
+    def get_cache_stats(self) -> Optional[Dict]:
+        """Get hit and miss counters of the translation cache, None when caching is disabled"""
+        if self.translation_cache is None:
+            return None
+        return self.translation_cache.get_stats()
+
     def improve_prompt(self, prompt: str) -> str:
         """
         Improve the image generation prompt using the configured LLM
@@ -167,21 +241,9 @@ class LLMClient:
             Exception: For other errors
         """
         try:
-            system_message = """You are an expert at writing prompts for AI image generation.
-            Your task is to enhance the given prompt to create more detailed and visually appealing images.
-            Focus on:
-            - Adding more descriptive details
-            - Specifying art style and medium
-            - Including lighting and atmosphere details
-            - Maintaining the original intent
-            Respond only with the enhanced prompt, no explanations."""
-
             response = litellm.completion(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_message},
-                    {"role": "user", "content": f"Enhance this image prompt: {prompt}"}
-                ],
+                messages=self._improve_messages(prompt),
                 temperature=0.7,
                 max_tokens=200
             )
@@ -193,3 +255,42 @@ class LLMClient:
 
         except Exception as e:
             self._handle_llm_error(e, "prompt improvement")
+
+    def improve_prompt_stream(self, prompt: str) -> Iterator[str]:
+        """
+        Improve the image generation prompt, yielding the text as the LLM generates it
+
+        Args:
+            prompt (str): Original prompt to improve
+
+        Yields:
+            str: Consecutive pieces of the improved prompt
+
+        Raises:
+            ValueError: If API key is missing or invalid
+            RateLimitError: If LLM rate limit is exceeded
+            Exception: For other errors
+        """
+        try:
+            response = litellm.completion(
+                model=self.model,
+                messages=self._improve_messages(prompt),
+                temperature=0.7,
+                max_tokens=200,
+                stream=True
+            )
+
+            for chunk in response:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+
+        except Exception as e:
+            self._handle_llm_error(e, "streaming prompt improvement")
+
+    def _improve_messages(self, prompt: str) -> List[Dict[str, str]]:
+        """Build the chat messages asking the LLM to enhance a prompt"""
+        return [
+            {"role": "system", "content": self.IMPROVE_SYSTEM_PROMPT},
+            {"role": "user", "content": f"Enhance this image prompt: {prompt}"}
+        ]
@@ -1,10 +1,16 @@
 import replicate
 import logging
 import requests
-from typing import Dict, Optional, Any
+from typing import Dict, List, Mapping, Optional, Any
 from replicate.exceptions import ModelError, ReplicateError
-import tempfile
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from replicate.version import Versions
+from api.download_client import DownloadClient
+import hmac
+import base64
+import hashlib
 
 logger = logging.getLogger(__name__)
 
@@ -13,8 +19,25 @@ class ReplicateClient:
 
     # SUPPORTED_MODELS dictionary is removed as models are now dynamic
 
-    def __init__(self, api_token: str):
-        """Initialize Replicate client"""
+    def __init__(self, api_token: str, webhook_secret: Optional[str] = None, max_parallel_downloads: int = 8,
+                 download_dir: Optional[str] = None, download_client: Optional[DownloadClient] = None):
+        """
+        Initialize Replicate client
+
+        Args:
+            api_token (str): Replicate API token.
+            webhook_secret (Optional[str]): Webhook signing secret, fetched from Replicate when not set.
+            max_parallel_downloads (int): Maximum number of outputs downloaded at once.
+            download_dir (Optional[str]): Directory for downloads, should be on the same
+                filesystem as the image storage so saving is a rename. System temp dir when not set.
+            download_client (Optional[DownloadClient]): Pooled HTTP client used for output downloads.
+        """
+        self._webhook_secret = webhook_secret
+        self.max_parallel_downloads = max_parallel_downloads
+        self.download_dir = download_dir
+        self.download_client = download_client or DownloadClient()
+        if download_dir:
+            os.makedirs(download_dir, exist_ok=True)
         # The replicate library automatically uses REPLICATE_API_TOKEN env var
         if not os.getenv('REPLICATE_API_TOKEN'):
             logger.warning("REPLICATE_API_TOKEN environment variable not set.")
@@ -30,16 +53,12 @@ class ReplicateClient:
             input_params (Dict[str, Any]): Dictionary of parameters specific to the model.
 
         Returns:
-            Dict: Response containing the path to the generated image file and metadata.
+            Dict: Response containing the paths to the generated image files and metadata.
         """
         # Model validation is now handled in app.py before calling this client
+        image_url = None
         try:
-            # Ensure prompt is included in input parameters
-            input_params['prompt'] = prompt
-
-            # Generate seed if not provided, some models might require it or handle it differently
-            if 'seed' not in input_params:
-                input_params['seed'] = self._generate_seed()
+            self._prepare_input(prompt, input_params)
 
             # Log API parameters
             logger.info(f"Calling Replicate API for model '{model_id}' with input: {input_params}")
@@ -57,34 +76,23 @@ class ReplicateClient:
                 logger.error(f"Replicate API returned empty output for model {model_id}.")
                 raise ValueError("Replicate API returned no output.")
 
-            # Assuming the output is a list of URLs, take the first one
-            # Adjust if the model returns a single URL or different structure
-            image_url = output[0] if isinstance(output, list) else output
-            logger.info(f"Received image URL: {image_url}")
-
-            # Download the image from the URL
-            response = requests.get(image_url, stream=True)
-            response.raise_for_status() # Raise an exception for bad status codes
-
-            # Create temporary file
-            # Create temporary file to store the downloaded image
-            # Using 'wb' mode for binary writing
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.webp', mode='wb') as temp_file:
-                logger.info(f"Downloading image to temporary file: {temp_file.name}")
-                for chunk in response.iter_content(chunk_size=8192):
-                    temp_file.write(chunk)
-                temp_file.flush() # Ensure all data is written
-
-                # Return the path to the temporary file
-                return {
-                    'status': 'success',
-                    'image_path': temp_file.name, # Return the path, not URL
-                    'metadata': {
-                        'model_id': model_id,
-                        'prompt': prompt, # Original prompt before translation
-                        'input_parameters': input_params # Store all used parameters
-                    }
+            # Models with num_outputs return several URLs, keep all of them
+            image_urls = self.get_output_urls(output)
+            image_url = image_urls[0]
+            logger.info(f"Received image URLs: {image_urls}")
+
+            # Return the paths to the downloaded temporary files
+            image_paths = self.download_images(image_urls)
+            return {
+                'status': 'success',
+                'image_path': image_paths[0], # Return the path, not URL
+                'image_paths': image_paths,
+                'metadata': {
+                    'model_id': model_id,
+                    'prompt': prompt, # Original prompt before translation
+                    'input_parameters': input_params # Store all used parameters
                 }
+            }
 
         except ModelError as e:
             logger.error(f"Replicate ModelError for model {model_id}: {str(e)}", exc_info=True)
@@ -102,28 +110,197 @@ class ReplicateClient:
             logger.error(f"Unexpected error generating image with model {model_id}: {str(e)}", exc_info=True)
             raise # Re-raise any other unexpected errors
 
+    def create_prediction(self, prompt: str, model_id: str, input_params: Dict[str, Any], webhook_url: str) -> Dict:
+        """
+        Start a prediction without waiting for it; Replicate calls the webhook when it completes.
+
+        Args:
+            prompt (str): Image generation prompt.
+            model_id (str): The full identifier of the Replicate model, optionally with ":version".
+            input_params (Dict[str, Any]): Dictionary of parameters specific to the model.
+            webhook_url (str): Public URL Replicate will POST the finished prediction to.
+
+        Returns:
+            Dict: ID and status of the created prediction.
+        """
+        self._prepare_input(prompt, input_params)
+        logger.info(f"Creating Replicate prediction for model '{model_id}' with input: {input_params}")
+
+        try:
+            model, _, version = model_id.partition(':')
+            target = {'version': version} if version else {'model': model}
+            prediction = replicate.predictions.create(
+                input=input_params,
+                webhook=webhook_url,
+                webhook_events_filter=['completed'],
+                **target
+            )
+        except ReplicateError as e:
+            logger.error(f"Replicate API error creating prediction for model {model_id}: {str(e)}", exc_info=True)
+            raise
+
+        logger.info(f"Created prediction {prediction.id} for model '{model_id}' (status: {prediction.status})")
+        return {'prediction_id': prediction.id, 'status': prediction.status}
+
+    def wait_for_prediction(self, prediction_id: str) -> Dict:
+        """
+        Poll a prediction until it finishes (fallback when its webhook never arrived).
+
+        Args:
+            prediction_id (str): ID of the prediction.
+
+        Returns:
+            Dict: Final status, output and error of the prediction.
+        """
+        prediction = replicate.predictions.get(prediction_id)
+        prediction.wait()
+        logger.info(f"Prediction {prediction_id} finished with status: {prediction.status}")
+        return {'status': prediction.status, 'output': prediction.output, 'error': prediction.error}
+
+    def get_output_urls(self, output: Any) -> List[str]:
+        """Normalize prediction output (URL, FileOutput or a list of them) to a list of URLs"""
+        items = output if isinstance(output, list) else [output]
+        return [str(getattr(item, 'url', item)) for item in items if item]
+
+    def download_images(self, image_urls: List[str]) -> List[str]:
+        """
+        Download several output images in parallel.
+
+        Args:
+            image_urls (List[str]): URLs of the generated images.
+
+        Returns:
+            List[str]: Paths to the temporary files in the order of the URLs.
+        """
+        if len(image_urls) == 1:
+            return [self.download_image(image_urls[0])]
+
+        with ThreadPoolExecutor(max_workers=min(len(image_urls), self.max_parallel_downloads)) as executor:
+            futures = [executor.submit(self.download_image, url) for url in image_urls]
+            try:
+                return [future.result() for future in futures]
+            except Exception:
+                # Don't leave the successful downloads behind
+                for future in futures:
+                    if future.done() and not future.exception():
+                        try:
+                            os.unlink(future.result())
+                        except OSError:
+                            pass
+                raise
+
+    def download_image(self, image_url: str) -> str:
+        """
+        Download an output image to a temporary file.
+
+        Args:
+            image_url (str): URL of the generated image.
+
+        Returns:
+            str: Path to the temporary file.
+
+        Raises:
+            DownloadError: If the download failed after all retries.
+        """
+        # Stream the image straight to disk over a pooled keep-alive connection
+        return self.download_client.download_to_file(image_url, self.download_dir, suffix='.webp')
+
+    def get_webhook_secret(self) -> str:
+        """Get the signing secret of the account's webhooks (cached after the first call)"""
+        if not self._webhook_secret:
+            self._webhook_secret = replicate.webhooks.default.secret().key
+        return self._webhook_secret
+
+    def verify_webhook(self, headers: Mapping[str, str], body: bytes, tolerance: int = 300) -> bool:
+        """
+        Verify the signature Replicate attaches to webhook requests.
+
+        Args:
+            headers (Mapping[str, str]): Request headers (webhook-id, webhook-timestamp, webhook-signature).
+            body (bytes): Raw request body.
+            tolerance (int): Maximum age of the webhook in seconds.
+
+        Returns:
+            bool: True if the webhook is authentic and fresh.
+        """
+        webhook_id = headers.get('webhook-id')
+        timestamp = headers.get('webhook-timestamp')
+        signatures = headers.get('webhook-signature')
+        if not webhook_id or not timestamp or not signatures:
+            return False
+
+        try:
+            if abs(time.time() - int(timestamp)) > tolerance:
+                logger.warning(f"Rejected stale webhook {webhook_id}")
+                return False
+            secret = self.get_webhook_secret()
+            key = base64.b64decode(secret.split('_', 1)[-1])
+        except (ValueError, ReplicateError) as e:
+            logger.error(f"Cannot verify webhook {webhook_id}: {str(e)}")
+            return False
+
+        signed_content = f"{webhook_id}.{timestamp}.".encode() + body
+        expected = base64.b64encode(hmac.new(key, signed_content, hashlib.sha256).digest()).decode()
+        # Header holds space-separated "version,signature" pairs
+        return any(
+            hmac.compare_digest(expected, signature.split(',', 1)[-1])
+            for signature in signatures.split(' ')
+        )
+
+    def _prepare_input(self, prompt: str, input_params: Dict[str, Any]) -> None:
+        """Add the prompt and a seed to the model input"""
+        # Ensure prompt is included in input parameters
+        input_params['prompt'] = prompt
+
+        # Generate seed if not provided, some models might require it or handle it differently
+        if 'seed' not in input_params:
+            input_params['seed'] = self._generate_seed()
+
     def _generate_seed(self) -> int:
         """Generate a random seed for image generation"""
         return int.from_bytes(os.urandom(4), byteorder='big') % 1000000000
 
     # _get_dimensions method is removed as dimensions are now part of input_params
 
+    def resolve_version(self, model_id: str) -> Optional[str]:
+        """
+        Resolve the latest version id of a model.
+
+        Args:
+            model_id (str): The identifier of the Replicate model without a version.
+
+        Returns:
+            Optional[str]: The latest version id, or None if the model has no version or the lookup fails.
+        """
+        try:
+            version = replicate.models.get(model_id).latest_version
+            return version.id if version else None
+        except ReplicateError as e:
+            logger.error(f"Replicate API error resolving version of model {model_id}: {str(e)}", exc_info=True)
+            return None
+
     def get_model_details(self, model_id: str) -> Optional[Dict]:
         """
         Fetch model details (specifically input schema) from Replicate API.
 
         Args:
-            model_id (str): The full identifier of the Replicate model (e.g., "owner/model-name").
+            model_id (str): The full identifier of the Replicate model (e.g., "owner/model-name"),
+                optionally with a version ("owner/model-name:version").
 
         Returns:
             Optional[Dict]: The OpenAPI schema for the model's input parameters, or None if fetching fails.
         """
         try:
             logger.info(f"Fetching model details for: {model_id}")
-            # Get the model object
-            model = replicate.models.get(model_id)
-            # Get the latest version of the model
-            version = model.latest_version
+            model_name, _, version_id = model_id.partition(':')
+            if version_id:
+                # Pinned version, fetched directly without looking up the model
+                version = Versions(replicate.default_client, model_name).get(version_id)
+            else:
+                # Get the model object
+                model = replicate.models.get(model_id)
+                # Get the latest version of the model
+                version = model.latest_version
             if not version:
                 logger.error(f"No version found for model: {model_id}")
                 return None
@@ -0,0 +1,134 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+class ModelVersionResolver:
+    """
+    Pins configured models to concrete Replicate version ids
+
+    Models configured without a version would otherwise resolve "latest" on
+    every call and could switch versions in the middle of a session. Versions
+    are resolved once at startup and then on a refresh interval; between
+    refreshes every schema lookup and prediction uses the same pinned version.
+    """
+
+    # Seconds before a failed resolution is attempted again
+    RETRY_AFTER = 60
+
+    def __init__(self, resolve: Callable[[str], Optional[str]], refresh_interval: float = 3600,
+                 on_change: Optional[Callable[[str, str], None]] = None, max_workers: int = 4):
+        """
+        Initialize resolver
+
+        Args:
+            resolve (Callable[[str], Optional[str]]): Function returning the latest version id of a model, None on failure
+            refresh_interval (float): Seconds between refreshes of all pins
+            on_change (Optional[Callable[[str, str], None]]): Called with the model id and new pinned reference
+                when a refresh picks up a new version
+            max_workers (int): Models resolved in parallel
+        """
+        self.resolve = resolve
+        self.refresh_interval = refresh_interval
+        self.on_change = on_change
+        self.max_workers = max_workers
+        self._pins: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def pin(self, model_id: str) -> str:
+        """
+        Get the pinned reference of a model
+
+        Args:
+            model_id (str): Configured model id, with or without a version
+
+        Returns:
+            str: "owner/name:version", or the model id unchanged if it has a version
+                 already or its version could not be resolved
+        """
+        if ':' in model_id:
+            return model_id
+
+        with self._lock:
+            entry = self._pins.get(model_id)
+        if entry is None or (entry['version'] is None and time.time() - entry['resolved_at'] > self.RETRY_AFTER):
+            entry = self._resolve(model_id)
+
+        return f"{model_id}:{entry['version']}" if entry['version'] else model_id
+
+    def get_version(self, model_id: str) -> Optional[str]:
+        """Get the version id a model is pinned to, None if unresolved"""
+        ref = self.pin(model_id)
+        return ref.partition(':')[2] or None
+
+    def resolve_all(self, model_ids: Iterable[str]) -> Dict[str, str]:
+        """
+        Resolve the versions of all models concurrently
+
+        Args:
+            model_ids (Iterable[str]): Configured model ids
+
+        Returns:
+            Dict[str, str]: Pinned reference of every model
+        """
+        model_ids = list(model_ids)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(self._resolve, [m for m in model_ids if ':' not in m]))
+        return {model_id: self.pin(model_id) for model_id in model_ids}
+
+    def start(self, model_ids: Iterable[str]) -> None:
+        """Refresh the pins of the given models in a background thread every refresh_interval"""
+        model_ids = list(model_ids)
+
+        def run():
+            while not self._stop.wait(self.refresh_interval):
+                try:
+                    self.resolve_all(model_ids)
+                except Exception as e:
+                    logger.error(f"Error refreshing model versions: {str(e)}", exc_info=True)
+
+        self._thread = threading.Thread(target=run, name='model-version-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the background refresh"""
+        self._stop.set()
+
+    def get_pins(self) -> Dict[str, Optional[str]]:
+        """Get the currently pinned version of every resolved model"""
+        with self._lock:
+            return {model_id: entry['version'] for model_id, entry in self._pins.items()}
+
+    def clear(self) -> None:
+        """Forget all pins, they are resolved again on next use"""
+        with self._lock:
+            self._pins.clear()
+
+    def _resolve(self, model_id: str) -> Dict:
+        """Resolve the latest version of a model and update its pin"""
+        try:
+            version = self.resolve(model_id)
+        except Exception as e:
+            logger.error(f"Error resolving version of model {model_id}: {str(e)}", exc_info=True)
+            version = None
+
+        with self._lock:
+            previous = self._pins.get(model_id)
+            if version is None and previous and previous['version']:
+                # Keep the known version when Replicate is unreachable
+                return previous
+            entry = {'version': version, 'resolved_at': time.time()}
+            self._pins[model_id] = entry
+
+        if previous and previous['version'] and version != previous['version']:
+            logger.warning(f"Model {model_id} has a new version: {previous['version']} -> {version}")
+            if self.on_change:
+                self.on_change(model_id, f"{model_id}:{version}")
+        elif version and not previous:
+            logger.info(f"Pinned model {model_id} to version {version}")
+        return entry
@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, send_from_directory, render_template, send_file
+from flask import Flask, jsonify, request, send_from_directory, render_template, send_file, Response, stream_with_context, redirect
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -6,11 +6,21 @@ from pythonjsonlogger import jsonlogger
 from dotenv import load_dotenv
 import logging
 import os
+import json
+import time
+import mimetypes
+import hashlib
+import hmac
+import threading
 import warnings
+import click
 from functools import wraps
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 from flask import abort
 from logging.handlers import RotatingFileHandler
-from werkzeug.exceptions import HTTPException # Import HTTPException
+from werkzeug.exceptions import HTTPException, BadRequest # Import HTTPException
+from werkzeug.wsgi import FileWrapper
 
 # Suppress Pydantic V2 deprecation warnings from external libraries
 warnings.filterwarnings(
@@ -61,12 +71,60 @@ limiter = Limiter(
 # Load configuration
 app.config.update(
     REPLICATE_API_TOKEN=os.getenv('REPLICATE_API_TOKEN'),
+    SECRET_KEY=os.getenv('SECRET_KEY'), # Signs image transform URLs, the same in every worker
     LLM_API_KEY=os.getenv('OPENAI_API_KEY'),  # Keep OPENAI_API_KEY for backward compatibility
     LLM_MODEL=os.getenv('LLM_MODEL', 'gpt-4'),
     IMAGE_STORAGE_PATH=os.getenv('IMAGE_STORAGE_PATH', os.path.join(os.path.dirname(__file__), 'images')), # Use getenv with default
     METADATA_STORAGE_PATH=os.getenv('METADATA_STORAGE_PATH', os.path.join(os.path.dirname(__file__), 'metadata')), # Use getenv with default
+    STORAGE_SHARD_DEPTH=int(os.getenv('STORAGE_SHARD_DEPTH', 1)), # Subdirectory levels of images and metadata, 0 for flat directories
+    IMAGE_STORAGE_BACKEND=os.getenv('IMAGE_STORAGE_BACKEND', 'local'), # "local" or "s3" (S3-compatible object storage)
+    S3_BUCKET=os.getenv('S3_BUCKET'),
+    S3_PREFIX=os.getenv('S3_PREFIX', 'images/'), # Key prefix of the images in the bucket
+    S3_ENDPOINT_URL=os.getenv('S3_ENDPOINT_URL'), # MinIO, R2 and other S3-compatible services, AWS when not set
+    S3_REGION=os.getenv('S3_REGION'),
+    S3_PUBLIC_URL=os.getenv('S3_PUBLIC_URL'), # Public base URL of the bucket or its CDN, presigned URLs when not set
+    S3_PRESIGN_EXPIRES=int(os.getenv('S3_PRESIGN_EXPIRES', 3600)), # Seconds presigned image URLs are valid
+    S3_MULTIPART_CHUNK_SIZE=int(os.getenv('S3_MULTIPART_CHUNK_SIZE', 8 * 1024 * 1024)), # Part size of multipart uploads
+    IMAGE_CACHE_MAX_AGE=int(os.getenv('IMAGE_CACHE_MAX_AGE', 31536000)), # Seconds browsers and CDNs keep images and converted files, their names never change
+    IMAGE_RATE_LIMIT=os.getenv('IMAGE_RATE_LIMIT', '1200/minute'), # Image requests per client, separate from the API limits
+    IMAGE_SENDFILE=os.getenv('IMAGE_SENDFILE', ''), # "x-accel" (nginx) or "x-sendfile" (Apache, lighttpd) to let the web server send image bytes
+    IMAGE_ACCEL_PREFIX=os.getenv('IMAGE_ACCEL_PREFIX', '/protected-images/'), # Internal nginx location serving IMAGE_STORAGE_PATH
+    THUMBNAIL_WIDTHS=[int(w) for w in os.getenv('THUMBNAIL_WIDTHS', '256,512,1024').split(',') if w.strip()], # Widths of the gallery thumbnails
+    THUMBNAIL_QUALITY=int(os.getenv('THUMBNAIL_QUALITY', 80)), # WebP quality of the thumbnails
+    CONVERSION_WORKERS=int(os.getenv('CONVERSION_WORKERS', max(1, (os.cpu_count() or 1) // int(os.getenv('GUNICORN_WORKERS', 1))))), # Conversion processes per Gunicorn worker, 0 converts in the request thread
+    CONVERSION_QUEUE_SIZE=int(os.getenv('CONVERSION_QUEUE_SIZE', 8)), # Conversions waiting for a process before requests get 503
+    CONVERSION_TIMEOUT=float(os.getenv('CONVERSION_TIMEOUT', 30)), # Seconds one conversion may run
+    CONVERSION_MEMORY_LIMIT=int(os.getenv('CONVERSION_MEMORY_LIMIT', 1024 ** 3)), # Bytes a conversion process may allocate, 0 for no limit
+    TRANSFORM_MAX_DIMENSION=int(os.getenv('TRANSFORM_MAX_DIMENSION', 4096)), # Largest width or height of image transforms
+    CONVERSION_CACHE_MAX_BYTES=int(os.getenv('CONVERSION_CACHE_MAX_BYTES', 1024 ** 3)), # Disk space of converted downloads, least recently used are evicted; 0 streams every conversion from memory
+    CONVERSION_SPOOL_MAX_SIZE=int(os.getenv('CONVERSION_SPOOL_MAX_SIZE', 8 * 1024 * 1024)), # Bytes of a streamed conversion kept in memory before moving to an unnamed temp file
+    CONTENT_ADDRESSED_STORAGE=os.getenv('CONTENT_ADDRESSED_STORAGE', 'false').lower() == 'true', # Store identical images once, referenced by hard links
+    GALLERY_MAX_PER_PAGE=int(os.getenv('GALLERY_MAX_PER_PAGE', 100)), # Upper limit of per_page in /api/images
+    DATA_STORAGE_PATH=os.getenv('DATA_STORAGE_PATH', os.path.join(os.path.dirname(__file__), 'data')), # Job queue and other SQLite databases
+    JOB_WORKERS=int(os.getenv('JOB_WORKERS', 2)), # Generation worker threads per process
+    BATCH_MAX_SIZE=int(os.getenv('BATCH_MAX_SIZE', 8)), # Maximum number of variants in one batch
+    BATCH_CONCURRENCY=int(os.getenv('BATCH_CONCURRENCY', 4)), # Predictions of one batch running at once
+    DOWNLOAD_CONNECT_TIMEOUT=float(os.getenv('DOWNLOAD_CONNECT_TIMEOUT', 5)), # Seconds to connect to the output CDN
+    DOWNLOAD_READ_TIMEOUT=float(os.getenv('DOWNLOAD_READ_TIMEOUT', 30)), # Seconds without data before a download is retried
+    DOWNLOAD_MAX_RETRIES=int(os.getenv('DOWNLOAD_MAX_RETRIES', 3)), # Retries of a failed or interrupted download
+    DOWNLOAD_WARMUP_URLS=[url.strip() for url in os.getenv('DOWNLOAD_WARMUP_URLS', 'https://replicate.delivery').split(',') if url.strip()],
+    MODEL_SCHEMA_TTL=int(os.getenv('MODEL_SCHEMA_TTL', 3600)), # Seconds before a model schema is refreshed in the background
+    MODEL_SCHEMA_MAX_STALE=int(os.getenv('MODEL_SCHEMA_MAX_STALE', 7 * 24 * 3600)), # Seconds a stale schema may still be served
+    MODEL_SCHEMA_CACHE_SIZE=int(os.getenv('MODEL_SCHEMA_CACHE_SIZE', 256)), # Model schemas kept in the cache
+    MODEL_MANIFEST_MAX_AGE=int(os.getenv('MODEL_MANIFEST_MAX_AGE', 60)), # Seconds browsers use the model manifest before revalidating
+    MODEL_SCHEMA_PREWARM=os.getenv('MODEL_SCHEMA_PREWARM', 'true').lower() == 'true', # Pin versions and load schemas of REPLICATE_MODELS at startup
+    MODEL_VERSION_REFRESH_INTERVAL=int(os.getenv('MODEL_VERSION_REFRESH_INTERVAL', 3600)), # Seconds between checks for new model versions
+    TRANSLATION_SKIP_THRESHOLD=float(os.getenv('TRANSLATION_SKIP_THRESHOLD', 0.5)), # English confidence from which prompts are not translated
+    TRANSLATION_CACHE_TTL=int(os.getenv('TRANSLATION_CACHE_TTL', 30 * 24 * 3600)), # Seconds a cached translation is reused
+    TRANSLATION_CACHE_SIZE=int(os.getenv('TRANSLATION_CACHE_SIZE', 1024)), # Translations kept in memory per process
+    TRANSLATION_CACHE_MAX_ENTRIES=int(os.getenv('TRANSLATION_CACHE_MAX_ENTRIES', 100000)), # Translations kept in the shared cache
+    PUBLIC_BASE_URL=os.getenv('PUBLIC_BASE_URL', '').rstrip('/'), # Enables Replicate webhooks when set
+    REPLICATE_WEBHOOK_SECRET=os.getenv('REPLICATE_WEBHOOK_SECRET'), # Fetched from Replicate when not set
+    REPLICATE_WEBHOOK_TIMEOUT=int(os.getenv('REPLICATE_WEBHOOK_TIMEOUT', 600)), # Poll predictions whose webhook is overdue
     REPLICATE_MODELS=os.getenv('REPLICATE_MODELS', '').split(',') if os.getenv('REPLICATE_MODELS') else []
 )
+# Flask's send_file hands the path to the web server instead of the bytes
+app.config['USE_X_SENDFILE'] = app.config['IMAGE_SENDFILE'] == 'x-sendfile'
 
 # Validate required environment variables
 if not app.config['REPLICATE_API_TOKEN']:
@@ -78,23 +136,129 @@ if not app.config['REPLICATE_MODELS']:
 
 # Import API clients after environment variables are loaded
 from api.replicate_client import ReplicateClient
-from api.llm_client import LLMClient
+from api.llm_client import LLMClient, RateLimitError
 from utils.storage import ImageManager, MetadataManager
+from utils.metadata_index import MetadataIndex
+from utils.content_store import ContentStore
+from utils.conversion_cache import ConversionCache
+from utils.s3_storage import S3ImageManager
 from utils.image_converter import ImageConverter
+from utils.conversion_pool import ConversionPool, ConversionPoolFull, ConversionTimeout, ConversionWorkerLost
+from utils.thumbnails import ThumbnailGenerator
+from utils.image_info import read_image_info
+from api.download_client import DownloadClient, DownloadError
+from utils.cache import LRUCache, SQLiteCache, TieredCache, RefreshingCache
+from api.version_resolver import ModelVersionResolver
+from utils.model_schema import slim_input_schema, InputValidators, InputValidationError
+from utils.job_queue import JobQueue, JobWorkerPool, JobError
+from replicate.exceptions import ModelError, ReplicateError
 
 # Initialize clients and managers
-replicate_client = ReplicateClient(app.config['REPLICATE_API_TOKEN'])
-llm_client = LLMClient(app.config['LLM_API_KEY'], app.config['LLM_MODEL'])
-image_manager = ImageManager(app.config['IMAGE_STORAGE_PATH'])
-metadata_manager = MetadataManager(app.config['METADATA_STORAGE_PATH'])
-image_converter = ImageConverter()
+# Blobs live under the image directory, hard links cannot cross filesystems
+content_store = ContentStore(
+    os.path.join(app.config['DATA_STORAGE_PATH'], 'content.sqlite3'),
+    os.path.join(app.config['IMAGE_STORAGE_PATH'], '.blobs'), extension='.webp'
+) if app.config['CONTENT_ADDRESSED_STORAGE'] else None
+if app.config['IMAGE_STORAGE_BACKEND'] == 's3':
+    if content_store is not None:
+        raise ValueError("CONTENT_ADDRESSED_STORAGE requires IMAGE_STORAGE_BACKEND=local")
+    # IMAGE_STORAGE_PATH only holds downloads until they are uploaded
+    image_manager = S3ImageManager(
+        app.config['IMAGE_STORAGE_PATH'], app.config['S3_BUCKET'], prefix=app.config['S3_PREFIX'],
+        endpoint_url=app.config['S3_ENDPOINT_URL'], region=app.config['S3_REGION'],
+        public_url=app.config['S3_PUBLIC_URL'], presign_expires=app.config['S3_PRESIGN_EXPIRES'],
+        multipart_chunk_size=app.config['S3_MULTIPART_CHUNK_SIZE']
+    )
+elif app.config['IMAGE_STORAGE_BACKEND'] == 'local':
+    image_manager = ImageManager(app.config['IMAGE_STORAGE_PATH'], shard_depth=app.config['STORAGE_SHARD_DEPTH'],
+                                 content_store=content_store)
+else:
+    raise ValueError(f"Unknown IMAGE_STORAGE_BACKEND: {app.config['IMAGE_STORAGE_BACKEND']}")
+download_client = DownloadClient(
+    connect_timeout=app.config['DOWNLOAD_CONNECT_TIMEOUT'],
+    read_timeout=app.config['DOWNLOAD_READ_TIMEOUT'],
+    max_retries=app.config['DOWNLOAD_MAX_RETRIES']
+)
+# Outputs are downloaded next to the images so saving them is an atomic rename
+replicate_client = ReplicateClient(app.config['REPLICATE_API_TOKEN'], app.config['REPLICATE_WEBHOOK_SECRET'],
+                                   download_dir=image_manager.incoming_path, download_client=download_client)
+# Translations are cached per process and in SQLite shared by all workers
+translation_cache = TieredCache(
+    LRUCache(app.config['TRANSLATION_CACHE_SIZE'], ttl=app.config['TRANSLATION_CACHE_TTL']),
+    SQLiteCache(os.path.join(app.config['DATA_STORAGE_PATH'], 'cache.sqlite3'), 'translations',
+                max_entries=app.config['TRANSLATION_CACHE_MAX_ENTRIES'], ttl=app.config['TRANSLATION_CACHE_TTL'])
+)
+llm_client = LLMClient(app.config['LLM_API_KEY'], app.config['LLM_MODEL'], translation_cache=translation_cache,
+                       english_threshold=app.config['TRANSLATION_SKIP_THRESHOLD'])
+# Gallery listing reads the SQLite index kept in sync with the metadata files
+metadata_index = MetadataIndex(os.path.join(app.config['DATA_STORAGE_PATH'], 'metadata.sqlite3'))
+metadata_manager = MetadataManager(app.config['METADATA_STORAGE_PATH'], index=metadata_index,
+                                   shard_depth=app.config['STORAGE_SHARD_DEPTH'])
+# Conversions run in worker processes so they do not hold up the request threads
+conversion_pool = ConversionPool(
+    app.config['CONVERSION_WORKERS'], queue_size=app.config['CONVERSION_QUEUE_SIZE'],
+    timeout=app.config['CONVERSION_TIMEOUT'], memory_limit=app.config['CONVERSION_MEMORY_LIMIT']
+) if app.config['CONVERSION_WORKERS'] > 0 else None
+image_converter = ImageConverter(pool=conversion_pool, spool_max_size=app.config['CONVERSION_SPOOL_MAX_SIZE'])
+# Converted downloads are kept on disk and shared by all workers
+conversion_cache = ConversionCache(os.path.join(app.config['DATA_STORAGE_PATH'], 'conversions.sqlite3'),
+                                   os.path.join(app.config['DATA_STORAGE_PATH'], 'conversions'),
+                                   max_bytes=app.config['CONVERSION_CACHE_MAX_BYTES']
+                                   ) if app.config['CONVERSION_CACHE_MAX_BYTES'] > 0 else None
+thumbnail_generator = ThumbnailGenerator(app.config['THUMBNAIL_WIDTHS'], quality=app.config['THUMBNAIL_QUALITY'])
+job_queue = JobQueue(os.path.join(app.config['DATA_STORAGE_PATH'], 'jobs.sqlite3'),
+                     batch_concurrency=app.config['BATCH_CONCURRENCY'])
 
 # Ensure storage directories exist
 os.makedirs(app.config['IMAGE_STORAGE_PATH'], exist_ok=True)
 os.makedirs(app.config['METADATA_STORAGE_PATH'], exist_ok=True)
+os.makedirs(app.config['DATA_STORAGE_PATH'], exist_ok=True)
+image_manager.purge_incoming()
+# Index images saved before the index existed
+if metadata_index.count() == 0 and next(metadata_manager.iter_files('.json'), None) is not None:
+    metadata_manager.rebuild_index()
+
+# Open connections to the output CDN in the background so the first download skips the handshake
+if app.config['DOWNLOAD_WARMUP_URLS']:
+    threading.Thread(target=download_client.warmup, args=(app.config['DOWNLOAD_WARMUP_URLS'],),
+                     name='download-warmup', daemon=True).start()
 
 # --- Model Cache ---
-model_cache = {}
+# Schemas are shared by all workers and refreshed in the background once stale
+model_cache = RefreshingCache(
+    lambda model_id: replicate_client.get_model_details(model_id),
+    TieredCache(
+        LRUCache(app.config['MODEL_SCHEMA_CACHE_SIZE'], ttl=app.config['MODEL_SCHEMA_MAX_STALE']),
+        SQLiteCache(os.path.join(app.config['DATA_STORAGE_PATH'], 'cache.sqlite3'), 'model_schemas',
+                    max_entries=app.config['MODEL_SCHEMA_CACHE_SIZE'], ttl=app.config['MODEL_SCHEMA_MAX_STALE'])
+    ),
+    ttl=app.config['MODEL_SCHEMA_TTL'],
+    max_stale=app.config['MODEL_SCHEMA_MAX_STALE']
+)
+
+# --- Model Versions ---
+# Models configured without a version are pinned to their latest version, so
+# schemas and predictions use the same one until the next refresh
+version_resolver = ModelVersionResolver(
+    lambda model_id: replicate_client.resolve_version(model_id),
+    refresh_interval=app.config['MODEL_VERSION_REFRESH_INTERVAL'],
+    # Load the schema of a new version before the form asks for it
+    on_change=lambda model_id, model_ref: model_cache.prewarm([model_ref])
+)
+
+def prewarm_models():
+    """Pin versions of all configured models, then load their schemas concurrently"""
+    pins = version_resolver.resolve_all(app.config['REPLICATE_MODELS'])
+    model_cache.prewarm(pins.values())
+
+# Parameters are checked against the Input schema before any LLM or Replicate call
+input_validators = InputValidators()
+
+if app.config['MODEL_SCHEMA_PREWARM'] and app.config['REPLICATE_MODELS']:
+    threading.Thread(target=prewarm_models, name='model-prewarm', daemon=True).start()
+# Pins are refreshed whether or not they were resolved at startup, otherwise they never move
+if app.config['REPLICATE_MODELS'] and app.config['MODEL_VERSION_REFRESH_INTERVAL'] > 0:
+    version_resolver.start(app.config['REPLICATE_MODELS'])
 
 # --- Helper Decorator for Model Validation ---
 def require_model_id(f):
@@ -113,11 +277,35 @@ def require_model_id(f):
 def bad_request_error(error):
     """Bad request error handler"""
     logger.warning(f"Bad request: {str(error)}")
-    return jsonify({
+    body = {
         'error': 'Bad request',
         'message': str(error.description if hasattr(error, 'description') else error),
         'type': 'BadRequestError'
-    }), 400
+    }
+    # Parameter validation reports every invalid parameter
+    if getattr(error, 'errors', None):
+        body['errors'] = error.errors
+    return jsonify(body), 400
+
+@app.errorhandler(401)
+def unauthorized_error(error):
+    """Unauthorized error handler"""
+    logger.warning(f"Unauthorized: {str(error)}")
+    return jsonify({
+        'error': 'Unauthorized',
+        'message': str(error.description if hasattr(error, 'description') else error),
+        'type': 'UnauthorizedError'
+    }), 401
+
+@app.errorhandler(403)
+def forbidden_error(error):
+    """Forbidden error handler"""
+    logger.warning(f"Forbidden: {str(error)}")
+    return jsonify({
+        'error': 'Forbidden',
+        'message': str(error.description if hasattr(error, 'description') else error),
+        'type': 'ForbiddenError'
+    }), 403
 
 @app.errorhandler(404)
 def not_found_error(error):
@@ -150,6 +338,30 @@ def bad_gateway_error(error):
         'type': 'BadGatewayError'
     }), 502
 
+@app.errorhandler(503)
+def service_unavailable_error(error):
+    """Service unavailable error handler, tells the client when to retry"""
+    logger.warning(f"Service unavailable: {str(error)}")
+    response = jsonify({
+        'error': 'Service unavailable',
+        'message': str(error.description if hasattr(error, 'description') else error),
+        'type': 'ServiceUnavailableError'
+    })
+    response.status_code = 503
+    if getattr(error, 'retry_after', None):
+        response.retry_after = error.retry_after
+    return response
+
+@app.errorhandler(504)
+def gateway_timeout_error(error):
+    """Gateway timeout error handler"""
+    logger.error(f"Gateway timeout: {str(error)}")
+    return jsonify({
+        'error': 'Gateway timeout',
+        'message': str(error.description if hasattr(error, 'description') else error),
+        'type': 'GatewayTimeoutError'
+    }), 504
+
 @app.errorhandler(500)
 def internal_error(error):
     """Internal server error handler"""
@@ -191,6 +403,37 @@ def get_models():
     logger.info("Fetching list of configured models.")
     return jsonify({'models': app.config.get('REPLICATE_MODELS', [])})
 
+@app.route('/api/models/manifest', methods=['GET'])
+@limiter.limit("30/minute")
+def get_models_manifest():
+    """Return the slimmed input schemas of all configured models in one revalidatable response"""
+    try:
+        model_ids = app.config.get('REPLICATE_MODELS', [])
+        models = {}
+        for model_id in model_ids:
+            input_schema = slim_input_schema(model_cache.get(version_resolver.pin(model_id)))
+            if input_schema:
+                models[model_id] = {'input': input_schema}
+            else:
+                logger.error(f"Could not fetch details for model: {model_id}")
+        if model_ids and not models:
+            abort(502, description='Failed to fetch model details from Replicate')
+
+        body = json.dumps({'model_ids': model_ids, 'models': models}, sort_keys=True, separators=(',', ':'))
+        response = app.response_class(body, mimetype='application/json')
+        response.set_etag(hashlib.sha256(body.encode()).hexdigest())
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['MODEL_MANIFEST_MAX_AGE']
+        response.cache_control.must_revalidate = True
+        # Answers If-None-Match with 304 Not Modified
+        return response.make_conditional(request)
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        logger.error(f"Error building model manifest: {str(e)}", exc_info=True)
+        abort(500, description='Error building model manifest')
+
 @app.route('/api/models/<path:model_id>', methods=['GET'])
 @limiter.limit("30/minute")
 @require_model_id
@@ -198,15 +441,9 @@ def get_model_details_route(model_id):
     """Get details (parameters) for a specific Replicate model"""
     logger.info(f"Fetching details for model: {model_id}")
 
-    if model_id in model_cache:
-        logger.debug(f"Returning cached details for model: {model_id}")
-        return jsonify(model_cache[model_id])
-
     try:
-        model_details = replicate_client.get_model_details(model_id)
+        model_details = model_cache.get(version_resolver.pin(model_id))
         if model_details:
-            model_cache[model_id] = model_details
-            logger.info(f"Successfully fetched and cached details for model: {model_id}")
             return jsonify(model_details)
         else:
             logger.error(f"Could not fetch details for model: {model_id}")
@@ -220,11 +457,225 @@ def get_model_details_route(model_id):
         abort(500, description=f'Unexpected error fetching details for model {model_id}')
 
 
+# --- Parameter Validation ---
+def validate_parameters(model_id, parameters, variant=None):
+    """
+    Validate and coerce generation parameters against the model's Input schema
+
+    Args:
+        model_id (str): Configured model id
+        parameters (dict): Parameters of the request
+        variant (int, optional): Index of the batch variant, added to the reported errors
+
+    Returns:
+        dict: Coerced parameters, unchanged when the model's schema is not available
+
+    Raises:
+        BadRequest: If the parameters do not match the schema
+    """
+    model_ref = version_resolver.pin(model_id)
+    validator = input_validators.get(model_ref, model_cache.get(model_ref))
+    if validator is None:
+        # Replicate still validates the input when the prediction is created
+        logger.warning(f"No input schema of model {model_id}, parameters are not validated")
+        return parameters
+
+    try:
+        return validator(parameters)
+    except InputValidationError as e:
+        errors = [dict(error, variant=variant) for error in e.errors] if variant is not None else e.errors
+        error = BadRequest(description=f"Invalid parameters: {str(e)}")
+        error.errors = errors
+        raise error
+
+
+# --- Generation Jobs ---
+def run_generation_job(ctx):
+    """Translate the prompt, generate the image and save it with its metadata"""
+    payload = ctx.payload
+    prompt = payload['prompt']
+    model_id = payload['model_id']
+    parameters = payload.get('parameters', {})
+
+    try:
+        delivery = ctx.job.get('delivery')
+        if payload.get('prediction_id') and delivery and delivery['external_id'] == payload['prediction_id']:
+            # The webhook reported the prediction and queued the job again
+            ctx.queue.record_stage(ctx.job_id, 'generate',
+                                   delivery['received_at'] - payload.get('submitted_at', delivery['received_at']))
+            return finish_prediction(ctx.job_id, payload, delivery['data'], ctx.stage)
+
+        if payload.get('prediction_id'):
+            # The webhook of an earlier attempt never arrived, poll the prediction instead
+            with ctx.stage('generate'):
+                prediction = replicate_client.wait_for_prediction(payload['prediction_id'])
+            return finish_prediction(ctx.job_id, payload, prediction, ctx.stage)
+
+        # Jobs of a batch get the prompt already translated and the version pinned by the batch job
+        if payload.get('translated_prompt') is None:
+            payload = dict(payload, **translate_prompt(ctx, prompt))
+        translated_prompt = payload['translated_prompt']
+        if payload.get('model_ref') is None:
+            payload = dict(payload, model_ref=version_resolver.pin(model_id))
+        model_ref = payload['model_ref']
+
+        if app.config.get('PUBLIC_BASE_URL'):
+            with ctx.stage('submit'):
+                prediction = replicate_client.create_prediction(
+                    prompt=translated_prompt,
+                    model_id=model_ref,
+                    input_params=parameters,
+                    webhook_url=f"{app.config['PUBLIC_BASE_URL']}/api/webhooks/replicate?job_id={ctx.job_id}"
+                )
+            # Free the worker, the webhook finishes the job
+            ctx.suspend(prediction['prediction_id'], app.config['REPLICATE_WEBHOOK_TIMEOUT'], dict(
+                payload,
+                parameters=parameters,
+                prediction_id=prediction['prediction_id'],
+                submitted_at=time.time()
+            ))
+            return None
+
+        logger.info(f"Generating image with model '{model_ref}' and parameters: {parameters}")
+        with ctx.stage('generate'):
+            result = replicate_client.generate_image(
+                prompt=translated_prompt,
+                model_id=model_ref,
+                input_params=parameters
+            )
+
+        with ctx.stage('save'):
+            return save_generated_images(ctx.job_id, result.get('image_paths') or [result['image_path']],
+                                         result.get('metadata'), payload)
+
+    except (ModelError, ReplicateError) as e:
+        raise JobError(f"Replicate error: {str(e)}") from e
+    except DownloadError as e:
+        raise JobError('Error downloading generated image') from e
+    except (ValueError, RateLimitError) as e:
+        # Configuration and LLM rate limit errors carry user-facing messages
+        raise JobError(str(e)) from e
+
+def translate_prompt(ctx, prompt):
+    """Translate the prompt unless it is already English and record which happened"""
+    if llm_client.is_english(prompt):
+        return {'translated_prompt': prompt, 'translation_skipped': True}
+    with ctx.stage('translate'):
+        return {'translated_prompt': llm_client.translate_to_english(prompt), 'translation_skipped': False}
+
+def finish_prediction(job_id, payload, prediction, stage):
+    """Download the output of a finished prediction and save it"""
+    if prediction['status'] != 'succeeded':
+        raise JobError(f"Prediction {prediction['status']}: {prediction.get('error') or 'no output'}")
+
+    output_urls = replicate_client.get_output_urls(prediction.get('output'))
+    if not output_urls:
+        raise JobError('Replicate API returned no output.')
+
+    with stage('download'):
+        try:
+            image_paths = replicate_client.download_images(output_urls)
+        except DownloadError as e:
+            raise JobError('Error downloading generated image') from e
+    with stage('save'):
+        return save_generated_images(job_id, image_paths, {
+            'model_id': payload['model_id'],
+            'prompt': payload['translated_prompt'],
+            'input_parameters': payload.get('parameters', {}),
+            'prediction_id': payload['prediction_id']
+        }, payload)
+
+def create_variants(image_path):
+    """Create the gallery thumbnails of an image, none if it cannot be decoded (the original is shown)"""
+    try:
+        return thumbnail_generator.generate(image_path, image_manager.incoming_path)
+    except Exception as e:
+        logger.warning(f"Could not create thumbnails of {image_path}: {str(e)}")
+        return {}
+
+def describe_image(image_path, preview_path=None):
+    """Get dimensions, size, dominant color and placeholder of an image, none if it cannot be read"""
+    try:
+        return read_image_info(image_path, preview_path)
+    except Exception as e:
+        logger.warning(f"Could not read image info of {image_path}: {str(e)}")
+        return {}
+
+def save_generated_images(job_id, image_paths, metadata, payload):
+    """Move generated images into storage, each as its own gallery entry with metadata"""
+    if not isinstance(metadata, dict):
+         metadata = {}
+    metadata['original_prompt'] = payload['prompt']
+    metadata['translated_prompt'] = payload['translated_prompt']
+    metadata['translation_skipped'] = payload.get('translation_skipped', False)
+    metadata['model_id'] = payload['model_id']
+    metadata['model_version'] = payload.get('model_ref', '').partition(':')[2] or None
+    metadata['parameters'] = payload.get('parameters', {})
+    metadata['job_id'] = job_id
+    if payload.get('batch_id'):
+        metadata['batch_id'] = payload['batch_id']
+
+    images = []
+    for index, image_path in enumerate(image_paths):
+        image_metadata = dict(metadata)
+        if len(image_paths) > 1:
+            image_metadata['output_index'] = index
+
+        variants = create_variants(image_path)
+        # Read while the image is still on the local disk
+        image_metadata.update(describe_image(image_path, variants.get(ThumbnailGenerator.PLACEHOLDER)))
+        image_full_path = image_manager.save_image_from_file(image_path)
+        image_filename = os.path.basename(image_full_path)
+        image_metadata['variants'] = image_manager.save_variants(image_filename, variants)
+        metadata_manager.save_metadata(image_filename, image_metadata)
+        images.append({
+            'image_id': os.path.splitext(image_filename)[0],
+            'image_url': image_manager.get_image_url(image_filename)
+        })
+
+    return dict(images[0], images=images)
+
+def run_batch_job(ctx):
+    """Translate the prompt once and fan the batch out into generation jobs"""
+    payload = ctx.payload
+
+    # A reclaimed batch job may already have created its generation jobs
+    if job_queue.list_batch(ctx.job_id):
+        return {'batch_id': ctx.job_id}
+
+    try:
+        translation = translate_prompt(ctx, payload['prompt'])
+    except (ValueError, RateLimitError) as e:
+        raise JobError(str(e)) from e
+    # All variants of a batch use the same model version
+    model_ref = version_resolver.pin(payload['model_id'])
+
+    with ctx.stage('fan_out'):
+        job_queue.enqueue_many('generate', [{
+            'prompt': payload['prompt'],
+            **translation,
+            'model_id': payload['model_id'],
+            'model_ref': model_ref,
+            'parameters': parameters,
+            'batch_id': ctx.job_id
+        } for parameters in payload['variants']], batch_id=ctx.job_id)
+    job_worker_pool.notify()
+
+    return {'batch_id': ctx.job_id}
+
+job_worker_pool = JobWorkerPool(job_queue, {
+    'generate': run_generation_job,
+    'batch': run_batch_job
+}, workers=app.config['JOB_WORKERS'])
+if app.config['JOB_WORKERS'] > 0:
+    job_worker_pool.start()
+
+
 # Rate-limited endpoints
 @app.route('/api/generate-image', methods=['POST'])
 @limiter.limit("5/minute")
 def generate_image():
-    """Generate image endpoint with rate limiting"""
+    """Queue an image generation job with rate limiting"""
     try:
         data = request.get_json()
         if not data:
@@ -243,38 +694,216 @@ def generate_image():
         if model_id not in app.config.get('REPLICATE_MODELS', []):
             logger.warning(f"Generate image request for invalid model: {model_id}")
             abort(400, description=f"Model '{model_id}' not found or not configured.")
+        parameters = validate_parameters(model_id, parameters)
 
-        translated_prompt = llm_client.translate_to_english(prompt)
+        job_id = job_queue.enqueue('generate', {
+            'prompt': prompt,
+            'model_id': model_id,
+            'parameters': parameters
+        })
+        job_worker_pool.notify()
 
-        logger.info(f"Generating image with model '{model_id}' and parameters: {parameters}")
-        result = replicate_client.generate_image(
-            prompt=translated_prompt,
-            model_id=model_id,
-            input_params=parameters
-        )
+        return jsonify({
+            'status': 'queued',
+            'job_id': job_id,
+            'status_url': f'/api/jobs/{job_id}'
+        }), 202
 
-        if 'metadata' not in result or not isinstance(result['metadata'], dict):
-             result['metadata'] = {}
-        result['metadata']['original_prompt'] = prompt
-        result['metadata']['translated_prompt'] = translated_prompt
-        result['metadata']['model_id'] = model_id
-        result['metadata']['parameters'] = parameters
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        logger.error(f"Unexpected error queueing image generation: {str(e)}", exc_info=True)
+        abort(500, description='Unexpected error generating image')
 
-        image_full_path = image_manager.save_image_from_file(result['image_path'])
-        image_filename = os.path.basename(image_full_path)
-        metadata_filename = metadata_manager.save_metadata(image_filename, result['metadata'])
+@app.route('/api/generate-batch', methods=['POST'])
+@limiter.limit("2/minute")
+def generate_batch():
+    """Queue generation of several variants of one prompt with rate limiting"""
+    try:
+        data = request.get_json()
+        if not data:
+             abort(400, description="Invalid JSON payload")
+
+        prompt = data.get('prompt')
+        model_id = data.get('model_id')
+        parameters = data.get('parameters', {})
+
+        if not prompt:
+            abort(400, description="Prompt is required")
+        if not model_id:
+            abort(400, description="Model ID is required")
+        if model_id not in app.config.get('REPLICATE_MODELS', []):
+            abort(400, description=f"Model '{model_id}' not found or not configured.")
+
+        parameters = validate_parameters(model_id, parameters)
+
+        # Variants are parameter overrides; seeds and count are shortcuts for them
+        if 'variants' in data:
+            variants = data['variants']
+        elif 'seeds' in data:
+            if not isinstance(data['seeds'], list):
+                abort(400, description="Seeds must be a list")
+            variants = [{'seed': seed} for seed in data['seeds']]
+        else:
+            try:
+                count = int(data.get('count', 1))
+            except (TypeError, ValueError):
+                abort(400, description="Count must be a number")
+            # Checked before the variants are built, a huge count would allocate them all
+            if not 1 <= count <= app.config['BATCH_MAX_SIZE']:
+                abort(400, description=f"A batch must have between 1 and {app.config['BATCH_MAX_SIZE']} variants")
+            # Without a fixed seed each variant gets a random one
+            base_seed = parameters.get('seed')
+            if base_seed is not None:
+                try:
+                    base_seed = int(base_seed)
+                except (TypeError, ValueError):
+                    abort(400, description="Seed must be an integer")
+            variants = [{'seed': base_seed + index} if base_seed is not None else {} for index in range(count)]
+
+        if not isinstance(variants, list) or not all(isinstance(variant, dict) for variant in variants):
+            abort(400, description="Variants must be a list of parameter objects")
+        if not 1 <= len(variants) <= app.config['BATCH_MAX_SIZE']:
+            abort(400, description=f"A batch must have between 1 and {app.config['BATCH_MAX_SIZE']} variants")
+
+        variants = [
+            validate_parameters(model_id, dict(parameters, **variant), variant=index)
+            for index, variant in enumerate(variants)
+        ]
+
+        batch_id = job_queue.enqueue('batch', {
+            'prompt': prompt,
+            'model_id': model_id,
+            'variants': variants
+        })
+        job_worker_pool.notify()
 
         return jsonify({
-            'status': 'success',
-            'image_id': os.path.splitext(image_filename)[0],
-            'image_url': f'/images/{image_filename}'
+            'status': 'queued',
+            'batch_id': batch_id,
+            'size': len(variants),
+            'status_url': f'/api/batches/{batch_id}'
+        }), 202
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        logger.error(f"Unexpected error queueing batch generation: {str(e)}", exc_info=True)
+        abort(500, description='Unexpected error generating images')
+
+@app.route('/api/batches/<batch_id>', methods=['GET'])
+@limiter.limit("120/minute")
+def get_batch_status(batch_id):
+    """Get aggregated status and images of a batch"""
+    try:
+        batch = job_queue.get(batch_id)
+        if batch is None or batch['kind'] != 'batch':
+            abort(404, description='Batch not found')
+
+        jobs = job_queue.list_batch(batch_id)
+        finished = [job for job in jobs if job['status'] in (JobQueue.SUCCEEDED, JobQueue.FAILED)]
+        succeeded = [job for job in finished if job['status'] == JobQueue.SUCCEEDED]
+
+        if batch['status'] != JobQueue.SUCCEEDED:
+            # Batch job itself is still queued, translating or has failed
+            status = batch['status']
+        elif len(finished) < len(jobs):
+            status = JobQueue.RUNNING
+        elif len(succeeded) == len(jobs):
+            status = JobQueue.SUCCEEDED
+        elif succeeded:
+            status = 'partial'
+        else:
+            status = JobQueue.FAILED
+
+        return jsonify({
+            'batch_id': batch_id,
+            'status': status,
+            'error': batch['error'],
+            'size': len(batch['payload']['variants']),
+            'completed': len(succeeded),
+            'failed': len(finished) - len(succeeded),
+            'timings': batch['timings'],
+            'images': [image for job in succeeded for image in job['result']['images']],
+            'jobs': [{'job_id': job['job_id'], 'status': job['status'], 'error': job['error']} for job in jobs]
         })
 
     except Exception as e:
         if isinstance(e, HTTPException):
             raise e
-        logger.error(f"Unexpected error generating image: {str(e)}", exc_info=True)
-        abort(500, description='Unexpected error generating image')
+        logger.error(f"Error getting batch status: {str(e)}", exc_info=True)
+        abort(500, description='Error getting batch status')
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@limiter.limit("120/minute")
+def get_job_status(job_id):
+    """Get status, stage timings and result of a generation job"""
+    try:
+        job = job_queue.get(job_id)
+        if job is None:
+            abort(404, description='Job not found')
+
+        return jsonify({
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'queue_position': job.get('queue_position'),
+            'timings': job['timings'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at'],
+            'result': job['result'],
+            'error': job['error']
+        })
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        logger.error(f"Error getting job status: {str(e)}", exc_info=True)
+        abort(500, description='Error getting job status')
+
+@app.route('/api/webhooks/replicate', methods=['POST'])
+@limiter.exempt
+def replicate_webhook():
+    """Finish a generation job when Replicate reports its prediction as completed"""
+    body = request.get_data()
+    if not replicate_client.verify_webhook(request.headers, body):
+        logger.warning("Rejected Replicate webhook with invalid signature")
+        abort(401, description='Invalid webhook signature')
+
+    prediction = request.get_json(silent=True) or {}
+    job_id = request.args.get('job_id')
+    prediction_id = prediction.get('id')
+    if not job_id or not prediction_id:
+        abort(400, description='Missing job or prediction ID')
+
+    # Only record the prediction and answer right away, a job worker downloads and saves the images
+    if not job_queue.deliver(job_id, prediction_id, prediction):
+        # Unknown job or duplicate delivery of an already handled webhook
+        logger.info(f"Ignoring webhook for prediction {prediction_id} (job {job_id})")
+        return jsonify({'status': 'ignored'})
+
+    job_worker_pool.notify()
+    return jsonify({'status': 'ok'})
+
+@app.route('/api/metrics', methods=['GET'])
+@limiter.limit("60/minute")
+def get_metrics():
+    """Get runtime metrics of the background subsystems"""
+    try:
+        return jsonify({
+            'jobs': job_queue.get_stats(),
+            'downloads': download_client.get_stats(),
+            'translation_cache': llm_client.get_cache_stats(),
+            'model_schema_cache': model_cache.get_stats(),
+            'model_versions': version_resolver.get_pins(),
+            'input_validators': input_validators.get_stats(),
+            'content_store': content_store.get_stats() if content_store else None,
+            'conversion_cache': conversion_cache.get_stats() if conversion_cache else None,
+            'conversion_pool': conversion_pool.get_stats() if conversion_pool else None
+        })
+    except Exception as e:
+        logger.error(f"Error getting metrics: {str(e)}", exc_info=True)
+        abort(500, description='Error getting metrics')
 
 
 @app.route('/api/improve-prompt', methods=['POST'])
@@ -308,16 +937,91 @@ def improve_prompt():
         logger.error(f"Error improving prompt: {str(e)}", exc_info=True)
         abort(500, description='Error improving prompt')
 
+@app.route('/api/improve-prompt/stream', methods=['POST'])
+@limiter.limit("10/minute")
+def improve_prompt_stream():
+    """Improve prompt and stream the result as Server-Sent Events with rate limiting"""
+    try:
+        data = request.get_json()
+        if not data:
+             abort(400, description="Invalid JSON payload")
+        prompt = data.get('prompt')
+
+        if not prompt:
+             abort(400, description="Prompt is required")
+
+        # Wait for the first piece so configuration errors still get a JSON response
+        tokens = llm_client.improve_prompt_stream(prompt)
+        first_token = next(tokens, '')
+
+    except ValueError as e:
+        # Handle authentication errors and other validation errors
+        logger.error(f"API key or validation error: {str(e)}", exc_info=True)
+        return jsonify({
+            'error': 'Configuration error',
+            'message': str(e),
+            'type': 'ConfigurationError'
+        }), 401  # Use 401 for authentication errors
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        logger.error(f"Error improving prompt: {str(e)}", exc_info=True)
+        abort(500, description='Error improving prompt')
+
+    def events():
+        improved_prompt = first_token
+        if first_token:
+            yield f"data: {json.dumps({'delta': first_token})}\n\n"
+        try:
+            for token in tokens:
+                improved_prompt += token
+                yield f"data: {json.dumps({'delta': token})}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming improved prompt: {str(e)}", exc_info=True)
+            yield f"event: error\ndata: {json.dumps({'message': 'Error improving prompt'})}\n\n"
+            return
+        logger.info(f"Streamed improved prompt: {improved_prompt.strip()}")
+        yield f"event: done\ndata: {json.dumps({'improved_prompt': improved_prompt.strip()})}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no' # Don't let nginx buffer the stream
+    })
+
+def add_image_urls(result):
+    """Add the URLs every image and its thumbnails are loaded from to a gallery listing"""
+    for image in result.get('images', []):
+        if image.get('image_filename'):
+            image['image_url'] = image_manager.get_image_url(image['image_filename'])
+        if image.get('variants'):
+            image['variant_urls'] = {name: image_manager.get_image_url(filename)
+                                     for name, filename in image['variants'].items()}
+    return result
+
 @app.route('/api/images', methods=['GET'])
 @limiter.limit("30/minute")
 def list_images():
-    """List images with pagination and rate limiting"""
+    """List images with cursor (or legacy page) pagination and rate limiting"""
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 12))
+        try:
+            per_page = int(request.args.get('per_page', 12))
+            page = int(request.args['page']) if 'page' in request.args else None
+        except ValueError:
+            abort(400, description="page and per_page must be numbers")
+        if per_page < 1 or (page is not None and page < 1):
+            abort(400, description="page and per_page must be positive")
+        per_page = min(per_page, app.config['GALLERY_MAX_PER_PAGE'])
+
+        if page is not None:
+            # Offset pagination for clients that still ask for page numbers
+            return jsonify(add_image_urls(metadata_manager.list_images(page, per_page)))
 
-        result = metadata_manager.list_images(page, per_page)
-        return jsonify(result)
+        try:
+            result = metadata_manager.list_images_after(request.args.get('cursor') or None, per_page)
+        except ValueError as e:
+            abort(400, description=str(e))
+        return jsonify(add_image_urls(result))
 
     except Exception as e:
         if isinstance(e, HTTPException):
@@ -325,6 +1029,34 @@ def list_images():
         logger.error(f"Error listing images: {str(e)}", exc_info=True)
         abort(500, description='Error listing images')
 
+@app.route('/api/images/search', methods=['GET'])
+@limiter.limit("30/minute")
+def search_images():
+    """Search images by prompt and model id with cursor pagination and rate limiting"""
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            abort(400, description="Search query is required")
+        try:
+            per_page = int(request.args.get('per_page', 12))
+        except ValueError:
+            abort(400, description="per_page must be a number")
+        if per_page < 1:
+            abort(400, description="per_page must be positive")
+        per_page = min(per_page, app.config['GALLERY_MAX_PER_PAGE'])
+
+        try:
+            result = metadata_manager.search_images(query, request.args.get('cursor') or None, per_page)
+        except ValueError as e:
+            abort(400, description=str(e))
+        return jsonify(add_image_urls(result))
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        logger.error(f"Error searching images: {str(e)}", exc_info=True)
+        abort(500, description='Error searching images')
+
 @app.route('/api/metadata/<image_id>', methods=['GET'])
 @limiter.limit("30/minute")
 def get_metadata(image_id):
@@ -349,8 +1081,12 @@ def delete_image(image_id):
         image_filename = f"{image_id}.webp"
         metadata_filename = f"{image_id}.json"
 
-        image_manager.delete_image(image_filename)
+        metadata = metadata_manager.get_metadata(metadata_filename)
+        variants = metadata.get('variants', {}).values() if isinstance(metadata, dict) else ()
+        image_manager.delete_image(image_filename, variants)
         metadata_manager.delete_metadata(metadata_filename)
+        if conversion_cache is not None:
+            conversion_cache.invalidate(image_id)
 
         return jsonify({'status': 'success'})
 
@@ -360,8 +1096,104 @@ def delete_image(image_id):
         logger.error(f"Error deleting image: {str(e)}", exc_info=True)
         abort(500, description='Error deleting image')
 
+def cache_immutable(response):
+    """Let browsers and CDNs keep a response without revalidating, for files whose name never changes"""
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['IMAGE_CACHE_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
+def send_buffer(buffer, mimetype, download_name, etag, as_attachment=True):
+    """
+    Send a spooled conversion with its Content-Length, closing it when the response ends
+
+    The WSGI server is handed a plain iterator; given the file itself it would
+    ask for the file descriptor to use sendfile, which moves the buffer to disk.
+    """
+    size = buffer.seek(0, os.SEEK_END)
+    buffer.seek(0)
+    response = Response(FileWrapper(buffer), mimetype=mimetype, direct_passthrough=True)
+    response.content_length = size
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline', filename=download_name)
+    response.set_etag(etag)
+    return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+def has_body(response):
+    """Only responses with a body count against rate limits, revalidations (304) are free"""
+    return response.status_code != 304
+
+def send_converted(image_id, format, options, run, mimetype, etag, as_attachment=True):
+    """
+    Send a conversion of an image from the conversion cache, or streamed when the cache is off
+
+    Args:
+        image_id (str): Id of the source image
+        format (str): Target format, the extension of the download name
+        options (dict): Conversion options, part of the cache key
+        run (Callable): Called with the source path and a destination path; with None instead of a path it returns a spooled buffer
+        mimetype (str): Media type of the result
+        etag (str): Strong ETag of the result, the same for every conversion with these options
+        as_attachment (bool): Download instead of displaying the result
+    """
+    # The conversion of an image never changes, a cached copy is confirmed without converting again
+    if request.if_none_match.contains_weak(etag):
+        not_modified = Response(status=304)
+        not_modified.set_etag(etag)
+        return cache_immutable(not_modified)
+
+    def convert(dest_path):
+        # Check if original image exists
+        with image_manager.open_image(f"{image_id}.webp") as image_path:
+            if image_path is None:
+                abort(404, description="Image not found")
+            return run(image_path, dest_path)
+
+    def get_converted():
+        try:
+            if conversion_cache is None:
+                # Without the disk cache the conversion is streamed from memory
+                return convert(None)
+            # Converted once, repeated downloads send the cached file
+            converted_path = conversion_cache.get(image_id, format, options, convert)
+            if converted_path is None:
+                abort(404, description="Image not found")
+            return converted_path
+        except ConversionPoolFull as e:
+            logger.warning(f"Conversion of {image_id} rejected: {str(e)}")
+            abort(503, description=str(e), retry_after=e.retry_after)
+        except ConversionWorkerLost as e:
+            logger.error(f"Conversion of {image_id} lost its worker: {str(e)}")
+            abort(503, description=str(e), retry_after=e.retry_after)
+        except ConversionTimeout as e:
+            logger.error(f"Conversion of {image_id} timed out: {str(e)}")
+            abort(504, description=str(e))
+        except ValueError as e:
+            logger.error(f"Image conversion failed for {image_id}: {str(e)}")
+            abort(500, description=f"Image conversion failed: {str(e)}")
+
+    download_name = f"{image_id}.{format}"
+    if conversion_cache is None:
+        return cache_immutable(send_buffer(get_converted(), mimetype, download_name, etag, as_attachment))
+
+    def send(converted_path):
+        return cache_immutable(send_file(
+            converted_path,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,
+            etag=etag
+        ))
+
+    try:
+        return send(get_converted())
+    except FileNotFoundError:
+        # Evicted by another worker between the lookup and opening the file, converted again
+        logger.info(f"Cached conversion of {image_id} evicted before it was sent, converting again")
+        return send(get_converted())
+
 @app.route('/api/convert/<image_id>/<format>')
-@limiter.limit("30/minute")
+@limiter.limit("30/minute", deduct_when=has_body)
 def convert_and_download_image(image_id, format):
     """Convert and download image in specified format"""
     try:
@@ -369,35 +1201,17 @@ def convert_and_download_image(image_id, format):
         if format not in ['jpg', 'png']:
             abort(400, description="Unsupported format. Use 'jpg' or 'png'")
 
-        # Check if original image exists
-        image_filename = f"{image_id}.webp"
-        image_path = os.path.join(app.config['IMAGE_STORAGE_PATH'], image_filename)
-
-        if not os.path.isfile(image_path):
-            abort(404, description="Image not found")
+        options = {'quality': 90} if format == 'jpg' else {}
 
-        # Convert image
-        try:
+        def run(image_path, dest_path):
+            if dest_path is None:
+                return image_converter.convert_to_buffer(image_path, format, **options)
             if format == 'jpg':
-                converted_path = image_converter.convert_to_jpg(image_path, quality=90)
-                mimetype = 'image/jpeg'
-                download_filename = f"{image_id}.jpg"
-            else:  # format == 'png'
-                converted_path = image_converter.convert_to_png(image_path)
-                mimetype = 'image/png'
-                download_filename = f"{image_id}.png"
-
-            # Send file and let cleanup handle removal
-            return send_file(
-                converted_path,
-                mimetype=mimetype,
-                as_attachment=True,
-                download_name=download_filename
-            )
+                return image_converter.convert_to_jpg(image_path, dest_path=dest_path, **options)
+            return image_converter.convert_to_png(image_path, dest_path=dest_path)
 
-        except ValueError as e:
-            logger.error(f"Image conversion failed for {image_id}: {str(e)}")
-            abort(500, description=f"Image conversion failed: {str(e)}")
+        mimetype = 'image/jpeg' if format == 'jpg' else 'image/png'
+        return send_converted(image_id, format, options, run, mimetype, etag=f"{image_id}-{format}")
 
     except Exception as e:
         if isinstance(e, HTTPException):
@@ -405,6 +1219,78 @@ def convert_and_download_image(image_id, format):
         logger.error(f"Error converting image {image_id}: {str(e)}", exc_info=True)
         abort(500, description='Error converting image')
 
+def transform_signature(image_id, params):
+    """Sign transform parameters with SECRET_KEY, only variants the server handed out are rendered"""
+    query = urlencode(sorted((key, str(value)) for key, value in params.items() if key != 'sig'))
+    message = f"{image_id}?{query}".encode()
+    return hmac.new(app.config['SECRET_KEY'].encode(), message, hashlib.sha256).hexdigest()[:32]
+
+def transform_url(image_id, **params):
+    """Signed URL of an image transform, parameters that are None are left out"""
+    params = {key: value for key, value in params.items() if value is not None}
+    params['sig'] = transform_signature(image_id, params)
+    return f"/api/transform/{image_id}?{urlencode(params)}"
+
+def parse_transform_params(params):
+    """Validate transform parameters, returns the arguments of ImageConverter.transform"""
+    unknown = set(params) - {'width', 'height', 'fit', 'format', 'quality'}
+    if unknown:
+        abort(400, description=f"Unknown transform parameters: {', '.join(sorted(unknown))}")
+
+    transform = {'format': params.get('format', 'webp'), 'fit': params.get('fit', 'contain')}
+    if not image_converter.supports_transform_format(transform['format']):
+        abort(400, description=f"Unsupported format: {transform['format']}")
+    if transform['fit'] not in ('contain', 'cover', 'fill'):
+        abort(400, description="fit must be 'contain', 'cover' or 'fill'")
+
+    limits = {'width': app.config['TRANSFORM_MAX_DIMENSION'], 'height': app.config['TRANSFORM_MAX_DIMENSION'],
+              'quality': 100}
+    for name, maximum in limits.items():
+        if name not in params:
+            continue
+        try:
+            value = int(params[name])
+        except ValueError:
+            abort(400, description=f"{name} must be a number")
+        if not 1 <= value <= maximum:
+            abort(400, description=f"{name} must be between 1 and {maximum}")
+        transform[name] = value
+
+    # PNG is lossless, a quality would only split its cache entries
+    if transform['format'] == 'png':
+        transform.pop('quality', None)
+    else:
+        transform.setdefault('quality', 85)
+    return transform
+
+@app.route('/api/transform/<image_id>')
+@limiter.limit(lambda: app.config['IMAGE_RATE_LIMIT'], deduct_when=has_body)
+def transform_image(image_id):
+    """Resize and convert an image with parameters signed by the server"""
+    try:
+        params = request.args.to_dict()
+        signature = params.pop('sig', '')
+        if not app.config['SECRET_KEY']:
+            abort(403, description="Image transforms require SECRET_KEY")
+        if not hmac.compare_digest(signature, transform_signature(image_id, params)):
+            abort(403, description="Invalid transform signature")
+
+        transform = parse_transform_params(params)
+        format = transform.pop('format')
+
+        def run(image_path, dest_path):
+            return image_converter.transform(image_path, format, dest_path=dest_path, **transform)
+
+        options_hash = hashlib.sha256(json.dumps([format, transform], sort_keys=True).encode()).hexdigest()[:16]
+        return send_converted(image_id, format, transform, run, image_converter.TRANSFORM_FORMATS[format][1],
+                              etag=f"{image_id}-{options_hash}", as_attachment=False)
+
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise e
+        logger.error(f"Error transforming image {image_id}: {str(e)}", exc_info=True)
+        abort(500, description='Error transforming image')
+
 @app.route('/api/temp-files-info', methods=['GET'])
 @limiter.limit("10/minute")
 def get_temp_files_info():
@@ -417,15 +1303,129 @@ def get_temp_files_info():
         abort(500, description='Error getting temp files info')
 
 @app.route('/images/<filename>')
-@limiter.limit("60/minute")
+@limiter.limit(lambda: app.config['IMAGE_RATE_LIMIT'], deduct_when=has_body)
 def serve_image(filename):
-    """Serve image files with rate limiting"""
-    safe_path = os.path.join(app.config['IMAGE_STORAGE_PATH'], filename)
-    if not os.path.isfile(safe_path):
+    """Serve image files with long-lived caching, conditional and range requests"""
+    if image_manager.direct_urls:
+        # Old links keep working, the image itself comes from the storage
+        return redirect(image_manager.get_image_url(filename))
+    image_path = image_manager.resolve_path(filename)
+    if image_path is None:
         abort(404, description="Image not found")
-    return send_from_directory(app.config['IMAGE_STORAGE_PATH'], filename)
+
+    if app.config['IMAGE_SENDFILE'] == 'x-accel':
+        # nginx sends the file from its internal location, including ETag, 304 and Range handling
+        relative_path = os.path.relpath(image_path, image_manager.storage_path).replace(os.sep, '/')
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{app.config['IMAGE_ACCEL_PREFIX'].rstrip('/')}/{relative_path}"
+        return cache_immutable(response)
+
+    # Strong ETag, 304 and 206 responses are handled by send_file
+    return cache_immutable(send_from_directory(os.path.dirname(image_path), filename, conditional=True, etag=True))
+
+# --- CLI Commands ---
+@app.cli.command('rebuild-metadata-index')
+def rebuild_metadata_index_command():
+    """Repopulate the gallery index from the metadata files"""
+    count = metadata_manager.rebuild_index()
+    click.echo(f"Indexed {count} images")
+
+@app.cli.command('migrate-storage-layout')
+@click.option('--workers', default=8, show_default=True, help='Files moved concurrently')
+def migrate_storage_layout_command(workers):
+    """Move images and metadata to the STORAGE_SHARD_DEPTH layout, safe to run while serving and to resume"""
+    for manager in (image_manager, metadata_manager):
+        counts = manager.migrate_layout(workers=workers)
+        click.echo(f"{manager.storage_path}: moved {counts['moved']}, removed {counts['stale']} stale, "
+                   f"failed {counts['failed']}")
+
+@app.cli.command('upload-images')
+@click.option('--workers', default=8, show_default=True, help='Files uploaded concurrently')
+def upload_images_command(workers):
+    """Copy the images of IMAGE_STORAGE_PATH into the S3 bucket, safe to resume"""
+    if not image_manager.direct_urls:
+        raise click.UsageError('Set IMAGE_STORAGE_BACKEND=s3 to upload images')
+    # Local images from any layout, their files are kept
+    local_images = ImageManager(app.config['IMAGE_STORAGE_PATH'], shard_depth=app.config['STORAGE_SHARD_DEPTH'])
+    counts = image_manager.upload_local_images(local_images, workers=workers)
+    click.echo(f"Uploaded {counts['uploaded']}, skipped {counts['skipped']} already stored, failed {counts['failed']}")
+
+@app.cli.command('transform-url')
+@click.argument('image_id')
+@click.option('--width', type=int, help='Maximum width')
+@click.option('--height', type=int, help='Maximum height')
+@click.option('--fit', type=click.Choice(['contain', 'cover', 'fill']), help='How the image fills width x height')
+@click.option('--format', 'format_', default='webp', show_default=True,
+              type=click.Choice(list(ImageConverter.TRANSFORM_FORMATS)))
+@click.option('--quality', type=int, help='Encoder quality, 85 when not set')
+def transform_url_command(image_id, width, height, fit, format_, quality):
+    """Print a signed URL of a resized image for embedding"""
+    if not app.config['SECRET_KEY']:
+        raise click.UsageError('Set SECRET_KEY to sign transform URLs')
+    click.echo(transform_url(image_id, width=width, height=height, fit=fit, format=format_, quality=quality))
+
+def backfill_images(workers, needs_update, update):
+    """
+    Update the metadata of existing images
+
+    Args:
+        workers (int): Images processed concurrently
+        needs_update (Callable[[Dict], bool]): Selects the images to update by their metadata
+        update (Callable[[str, str], Dict]): Returns the fields to set from the image filename and a local path
+
+    Returns:
+        Dict[str, int]: Number of updated, skipped, missing and failed images
+    """
+    def backfill(item):
+        _, path = item
+        with open(path, 'r') as f:
+            metadata = json.load(f)
+        image_filename = metadata.get('image_filename')
+        if not image_filename or not needs_update(metadata):
+            return 'skipped'
+        try:
+            with image_manager.open_image(image_filename) as image_path:
+                if image_path is None:
+                    return 'missing'
+                metadata_manager.update_metadata(image_filename, update(image_filename, image_path))
+            return 'updated'
+        except Exception as e:
+            logger.error(f"Error updating {image_filename}: {str(e)}")
+            return 'failed'
+
+    counts = {'updated': 0, 'skipped': 0, 'missing': 0, 'failed': 0}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(backfill, metadata_manager.iter_files('.json')):
+            counts[result] += 1
+    return counts
+
+@app.cli.command('generate-thumbnails')
+@click.option('--workers', default=4, show_default=True, help='Images processed concurrently')
+@click.option('--force', is_flag=True, help='Recreate thumbnails of images that have them')
+def generate_thumbnails_command(workers, force):
+    """Create the gallery thumbnails of existing images"""
+    def update(image_filename, image_path):
+        variants = thumbnail_generator.generate(image_path, image_manager.incoming_path)
+        return {'variants': image_manager.save_variants(image_filename, variants)}
+
+    counts = backfill_images(workers, lambda metadata: force or not metadata.get('variants'), update)
+    click.echo(f"Created thumbnails of {counts['updated']} images, skipped {counts['skipped']}, "
+               f"missing {counts['missing']}, failed {counts['failed']}")
+
+@app.cli.command('extract-image-info')
+@click.option('--workers', default=4, show_default=True, help='Images processed concurrently')
+def extract_image_info_command(workers):
+    """Add dimensions, file size, dominant color and placeholder to the metadata of existing images"""
+    def update(image_filename, image_path):
+        return read_image_info(image_path)
+
+    counts = backfill_images(workers, lambda metadata: 'lqip' not in metadata, update)
+    click.echo(f"Described {counts['updated']} images, skipped {counts['skipped']}, "
+               f"missing {counts['missing']}, failed {counts['failed']}")
 
 if __name__ == '__main__':
+    # Worker processes would import this script again, the development server converts in its threads
+    image_converter.pool = None
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('FLASK_ENV') == 'development'
@@ -167,10 +167,11 @@ except ImportError as e:
         exit 1
     }
 
-    echo "Creating necessary directories (images, metadata)..."
+    echo "Creating necessary directories (images, metadata, data)..."
     # Create directories as the original user
     sudo -u "$SUDO_USER" mkdir -p images
     sudo -u "$SUDO_USER" mkdir -p metadata
+    sudo -u "$SUDO_USER" mkdir -p data
 
     # Setup .env file if it doesn't exist
     if [ ! -f ".env" ]; then
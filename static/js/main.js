@@ -1,11 +1,12 @@
 // Import modules
 import { loadFormState, saveFormState, initializeStorageElements } from './modules/storage.js';
 import { showError, toggleLoading, initializeUIElements } from './modules/ui.js';
-import { loadGallery, initializeGalleryElements, getCurrentPage } from './modules/gallery.js';
+import { loadGallery, initializeGalleryElements, searchGallery } from './modules/gallery.js';
 import { applyParamValue, initializeFormGeneratorElements, parseRatio } from './modules/form-generator.js';
 import { loadModels, loadModelParams, generateImage, improvePrompt, deleteImage, downloadConvertedImage, initializeAPIClientElements } from './modules/api-client.js';
 import { openPhotoSwipeGallery, initializePhotoSwipeElements, isPhotoSwipeAvailable } from './modules/photoswipe-gallery.js';
 import { initializeAllMobileDropdownEnhancements } from './modules/mobile-dropdown.js';
+import { GALLERY_SEARCH_DELAY } from './modules/constants.js';
 
 // Global state
 let isGenerating = false;
@@ -19,7 +20,7 @@ const $generateBtn = $('#generateBtn');
 const $improveBtn = $('#improvePrompt');
 const $clearBtn = $('#clearPrompt');
 const $gallery = $('#imageGallery');
-const $pagination = $('#galleryPagination');
+const $gallerySentinel = $('#gallerySentinel');
 const $spinner = $('#spinnerOverlay');
 const errorModal = new bootstrap.Modal('#errorModal');
 const deleteModal = new bootstrap.Modal('#deleteModal');
@@ -28,7 +29,7 @@ const deleteModal = new bootstrap.Modal('#deleteModal');
 function initializeModules() {
     initializeStorageElements($prompt, $modelSelect);
     initializeUIElements($spinner, $generateBtn, $improveBtn, $clearBtn, errorModal);
-    initializeGalleryElements($gallery, $pagination);
+    initializeGalleryElements($gallery, $gallerySentinel);
     initializeFormGeneratorElements($modelParamsContainer);
     initializeAPIClientElements($prompt, $modelSelect, $modelParamsContainer);
     initializePhotoSwipeElements($gallery);
@@ -95,7 +96,7 @@ $(document).ready(async () => {
 
         saveFormState();
         isGenerating = true;
-        await generateImage(prompt, modelId, parameters);
+        await generateImage(prompt, modelId, parameters, parseInt($('#variantCount').val(), 10) || 1);
         isGenerating = false;
     });
 
@@ -122,13 +123,11 @@ $(document).ready(async () => {
         saveFormState();
     });
 
-    // Pagination clicks
-    $pagination.on('click', '.page-link', async (e) => {
-        e.preventDefault();
-        const page = $(e.currentTarget).data('page');
-        if (page && page !== getCurrentPage()) {
-            await loadGallery(page);
-        }
+    // Gallery search, run once typing pauses
+    let searchTimer = null;
+    $('#gallerySearch').on('input', (e) => {
+        clearTimeout(searchTimer);
+        searchTimer = setTimeout(() => searchGallery($(e.currentTarget).val()), GALLERY_SEARCH_DELAY);
     });
 
     // Delete functionality
@@ -1,9 +1,9 @@
 // API communication functions
 
 import { showError, toggleLoading, getRandomMessage } from './ui.js';
-import { GENERATE_MESSAGES, IMPROVE_MESSAGES } from './constants.js';
+import { GENERATE_MESSAGES, IMPROVE_MESSAGES, JOB_POLL_INTERVAL } from './constants.js';
 import { generateFormFields, handleAspectRatioChange } from './form-generator.js';
-import { loadGallery, getCurrentPage } from './gallery.js';
+import { loadGallery, removeImageCard } from './gallery.js';
 import { saveFormState } from './storage.js';
 
 // DOM Elements (will be initialized in main.js)
@@ -16,7 +16,10 @@ export function initializeAPIClientElements(promptElement, modelSelectElement, m
     $modelParamsContainer = modelParamsContainerElement;
 }
 
-// Load models from API and populate select
+// Input schemas of all models, loaded once from the manifest
+let modelManifest = null;
+
+// Load models from the manifest and populate select
 export async function loadModels() {
     if (!$modelSelect) {
         console.warn('Model select element not initialized');
@@ -24,19 +27,21 @@ export async function loadModels() {
     }
 
     try {
-        const response = await fetch('/api/models');
+        // The browser revalidates the manifest with its ETag and gets 304 when unchanged
+        const response = await fetch('/api/models/manifest');
         const data = await response.json();
-        if (!response.ok) throw new Error(data.error || 'Unknown error');
+        if (!response.ok) throw new Error(data.message || data.error || 'Unknown error');
+        modelManifest = data.models;
 
         $modelSelect.empty().append('<option value="" disabled selected>Select model...</option>');
-        if (data.models && data.models.length > 0) {
-            data.models.forEach(modelId => {
+        if (data.model_ids && data.model_ids.length > 0) {
+            data.model_ids.forEach(modelId => {
                 // Display a user-friendly name if possible
                 const displayName = modelId.split('/').pop().replace(/-/g, ' ').replace(/_/g, ' ');
                 $modelSelect.append(`<option value="${modelId}">${displayName}</option>`);
             });
             $modelSelect.prop('disabled', false);
-            return data.models;
+            return data.model_ids;
         } else {
             $modelSelect.append('<option value="" disabled>No models configured</option>');
             $modelSelect.prop('disabled', true);
@@ -50,7 +55,18 @@ export async function loadModels() {
     }
 }
 
-// Load model parameters from API
+// Render the parameter form of a model
+function showModelParams(inputSchema) {
+    generateFormFields(inputSchema);
+
+    // If aspect ratio selector was added, attach listener and trigger initial calculation
+    if ($('#aspectRatioSelect').length > 0 && inputSchema) {
+        $modelParamsContainer.off('change', '#aspectRatioSelect').on('change', '#aspectRatioSelect', () => handleAspectRatioChange(inputSchema));
+        handleAspectRatioChange(inputSchema); // Initial calculation for default ratio
+    }
+}
+
+// Load model parameters, from the manifest without a request when available
 export async function loadModelParams(modelId) {
     if (!modelId || !$modelParamsContainer) {
         if ($modelParamsContainer) {
@@ -59,6 +75,12 @@ export async function loadModelParams(modelId) {
         return;
     }
 
+    if (modelManifest && modelManifest[modelId]) {
+        showModelParams(modelManifest[modelId].input);
+        return;
+    }
+
+    // The model was missing from the manifest (e.g. temporarily unavailable), ask for it directly
     toggleLoading(true, 'Loading parameters...');
     $modelParamsContainer.html('<p class="text-muted">Loading parameters...</p>');
 
@@ -74,14 +96,7 @@ export async function loadModelParams(modelId) {
         }
 
         // The response itself should be the schema's 'components.schemas.Input' part
-        const inputSchema = data?.components?.schemas?.Input;
-        generateFormFields(inputSchema);
-
-        // If aspect ratio selector was added, attach listener and trigger initial calculation
-        if ($('#aspectRatioSelect').length > 0 && inputSchema) {
-            $modelParamsContainer.off('change', '#aspectRatioSelect').on('change', '#aspectRatioSelect', () => handleAspectRatioChange(inputSchema));
-            handleAspectRatioChange(inputSchema); // Initial calculation for default ratio
-        }
+        showModelParams(data?.components?.schemas?.Input);
 
     } catch (error) {
         console.error("Error loading model parameters:", error);
@@ -92,8 +107,8 @@ export async function loadModelParams(modelId) {
     }
 }
 
-// Generate image using dynamic parameters
-export async function generateImage(prompt, modelId, parameters) {
+// Generate image using dynamic parameters, several variants are sent as one batch
+export async function generateImage(prompt, modelId, parameters, variantCount = 1) {
     try {
         toggleLoading(true, getRandomMessage(GENERATE_MESSAGES));
 
@@ -108,9 +123,13 @@ export async function generateImage(prompt, modelId, parameters) {
              payload.parameters.aspect_ratio = "custom";
         }
 
+        if (variantCount > 1) {
+            payload.count = variantCount;
+        }
+
         console.log("Sending generation request:", payload);
 
-        const response = await fetch('/api/generate-image', {
+        const response = await fetch(variantCount > 1 ? '/api/generate-batch' : '/api/generate-image', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -120,12 +139,18 @@ export async function generateImage(prompt, modelId, parameters) {
 
         const data = await response.json();
         if (!response.ok) {
-            const errorMsg = data?.error || data?.message || `Error ${response.status}`;
+            // Invalid parameters are listed one by one
+            const errorMsg = data?.errors
+                ? data.errors.map(error => `${error.parameter} ${error.message}`).join(', ')
+                : data?.error || data?.message || `Error ${response.status}`;
             throw new Error(errorMsg);
         }
 
+        // Generation runs as a background job (or batch of jobs), wait until it finishes
+        await waitForJob(data.status_url);
+
         toggleLoading(false);
-        loadGallery(1); // Reload first page to show the new image
+        loadGallery(); // Reload from the newest image to show the new one
 
     } catch (error) {
         toggleLoading(false);
@@ -134,7 +159,28 @@ export async function generateImage(prompt, modelId, parameters) {
     }
 }
 
-// Improve prompt
+// Poll a background job or batch until it succeeds or fails
+async function waitForJob(statusUrl) {
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
+
+        const response = await fetch(statusUrl);
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job?.message || job?.error || `Error ${response.status}`);
+        }
+
+        // A batch where only some variants failed still produced images
+        if (job.status === 'succeeded' || job.status === 'partial') {
+            return job.result || job;
+        }
+        if (job.status === 'failed') {
+            throw new Error(job.error || 'Generation failed');
+        }
+    }
+}
+
+// Improve prompt, the improved text is streamed into the prompt textarea as it is generated
 export async function improvePrompt(prompt) {
     if (!$prompt) {
         console.warn('Prompt element not initialized');
@@ -144,16 +190,17 @@ export async function improvePrompt(prompt) {
     try {
         toggleLoading(true, getRandomMessage(IMPROVE_MESSAGES));
 
-        const response = await fetch('/api/improve-prompt', {
+        const response = await fetch('/api/improve-prompt/stream', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json'
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream'
             },
             body: JSON.stringify({ prompt })
         });
 
-        const data = await response.json();
         if (!response.ok) {
+            const data = await response.json();
             // Handle different error types
             if (response.status === 401 && data.type === 'ConfigurationError') {
                 throw new Error('API Configuration Error: ' + data.message);
@@ -162,7 +209,22 @@ export async function improvePrompt(prompt) {
             }
         }
 
-        $prompt.val(data.improved_prompt);
+        let improvedPrompt = '';
+        await readEventStream(response, (event, data) => {
+            if (event === 'error') {
+                throw new Error(data.message || 'Unknown error');
+            }
+            if (event === 'done') {
+                improvedPrompt = data.improved_prompt;
+            } else {
+                if (!improvedPrompt) {
+                    toggleLoading(false); // First token arrived, let the user watch the text grow
+                }
+                improvedPrompt += data.delta;
+            }
+            $prompt.val(improvedPrompt);
+        });
+
         saveFormState();
 
     } catch (error) {
@@ -173,6 +235,39 @@ export async function improvePrompt(prompt) {
     }
 }
 
+// Read a Server-Sent Events response, calling onEvent(eventName, parsedData) for every event
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line
+        let separatorIndex;
+        while ((separatorIndex = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, separatorIndex);
+            buffer = buffer.slice(separatorIndex + 2);
+
+            let event = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            if (data) {
+                onEvent(event, JSON.parse(data));
+            }
+        }
+    }
+}
+
 // Delete image
 export async function deleteImage(imageId) {
     try {
@@ -183,7 +278,7 @@ export async function deleteImage(imageId) {
         const data = await response.json();
         if (!response.ok) throw new Error(data.error);
 
-        loadGallery(getCurrentPage());
+        removeImageCard(imageId);
 
     } catch (error) {
         showError('Error deleting image: ' + error.message);
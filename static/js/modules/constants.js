@@ -1,5 +1,13 @@
 // Application constants and configuration
 
+// Gallery infinite scroll: images per request and distance from the bottom at which the next batch is shown
+export const GALLERY_BATCH_SIZE = 24;
+export const GALLERY_PREFETCH_MARGIN = '0px 0px 1200px 0px';
+// Milliseconds after the last keystroke before the gallery is searched
+export const GALLERY_SEARCH_DELAY = 300;
+// Rendered width of a gallery card (col-md-4 col-lg-3), picks the thumbnail from srcset
+export const GALLERY_IMAGE_SIZES = '(min-width: 992px) 25vw, (min-width: 768px) 33vw, 100vw';
+
 // Form state management
 export const STORAGE_KEY = 'replicate-ai-form';
 
@@ -44,6 +52,9 @@ export const IMPROVE_MESSAGES = [
     "I really can't do this..."
 ];
 
+// Interval between generation job status checks (ms)
+export const JOB_POLL_INTERVAL = 1500;
+
 // Touch navigation constants
 export const SWIPE_THRESHOLD = 50; // Minimum distance for a swipe
 
@@ -1,38 +1,50 @@
 // Gallery management functions
 
 import { showError } from './ui.js';
+import { GALLERY_BATCH_SIZE, GALLERY_PREFETCH_MARGIN, GALLERY_IMAGE_SIZES } from './constants.js';
 
 // DOM Elements (will be initialized in main.js)
-let $gallery, $pagination;
+let $gallery, $sentinel;
 
 // Global state
-let currentPage = 1;
+let searchQuery = '';
+let nextCursor = null;
+let nextBatch = null; // Promise of the prefetched next batch
+let isLoading = false;
+let observer = null;
 
 // Initialize DOM references
-export function initializeGalleryElements(galleryElement, paginationElement) {
+export function initializeGalleryElements(galleryElement, sentinelElement) {
     $gallery = galleryElement;
-    $pagination = paginationElement;
-}
-
-// Set current page
-export function setCurrentPage(page) {
-    currentPage = page;
-}
-
-// Get current page
-export function getCurrentPage() {
-    return currentPage;
+    $sentinel = sentinelElement;
 }
 
 // Create image card
 export function createImageCard(image) {
     const imageId = image.image_filename.replace(/\.(webp|png)$/, '');
+    // Direct or presigned URL of the storage, the application route for local storage
+    const imageUrl = image.image_url || `/images/${image.image_filename}`;
+    // Thumbnails by width, the original stays in src for PhotoSwipe and older entries
+    const variants = image.variant_urls || {};
+    const candidates = Object.keys(variants)
+        .filter(name => /^\d+$/.test(name))
+        .map(width => `${variants[width]} ${width}w`);
+    if (candidates.length && image.width) {
+        // High-density screens may pick the original
+        candidates.push(`${imageUrl} ${image.width}w`);
+    }
+    const srcsetAttributes = candidates.length ? `srcset="${candidates.join(', ')}" sizes="${GALLERY_IMAGE_SIZES}"` : '';
+    // Inline placeholder first, it needs no request
+    const backgroundUrl = image.lqip || variants.blur || imageUrl;
+    const cardStyle = image.dominant_color ? `style="background-color: ${image.dominant_color}"` : '';
+    // Known dimensions let PhotoSwipe open without downloading the images first
+    const sizeAttributes = image.width && image.height ? `data-width="${image.width}" data-height="${image.height}"` : '';
 
     return `
         <div class="col-md-4 col-lg-3 mb-4">
-            <div class="card image-card">
-                <div class="ambient-background" style="background-image: url('/images/${image.image_filename}')"></div>
-                <img src="/images/${image.image_filename}" class="card-img-top" alt="Generated image">
+            <div class="card image-card" ${cardStyle}>
+                <div class="ambient-background" style="background-image: url('${backgroundUrl}')"></div>
+                <img src="${imageUrl}" ${srcsetAttributes} ${sizeAttributes} class="card-img-top" alt="Generated image" decoding="async">
                 <div class="overlay">
                     <div class="d-flex justify-content-between">
                         <button class="btn btn-sm btn-outline-light copy-settings" data-image-id="${image.image_filename}" title="Copy settings">
@@ -43,7 +55,7 @@ export function createImageCard(image) {
                                 <i class="fas fa-download"></i>
                             </button>
                             <ul class="dropdown-menu dropdown-menu-end">
-                                <li><a class="dropdown-item download-original" href="/images/${image.image_filename}" download="${imageId}.webp">
+                                <li><a class="dropdown-item download-original" href="${imageUrl}" download="${imageId}.webp">
                                     <i class="fas fa-file-image me-2"></i><span>WebP (Original)</span>
                                 </a></li>
                                 <li><a class="dropdown-item download-converted" href="#" data-image-id="${imageId}" data-format="jpg">
@@ -64,62 +76,95 @@ export function createImageCard(image) {
     `;
 }
 
-// Create pagination
-export function createPagination(totalPages) {
-    let html = '';
-
-    // Previous button
-    html += `
-        <li class="page-item ${currentPage === 1 ? 'disabled' : ''}">
-            <a class="page-link" href="#" data-page="${currentPage - 1}">
-                <i class="fas fa-chevron-left"></i>
-            </a>
-        </li>
-    `;
+// Fetch one batch of images (or search results) following the cursor
+async function fetchBatch(cursor) {
+    const params = new URLSearchParams({ per_page: GALLERY_BATCH_SIZE });
+    if (cursor) params.set('cursor', cursor);
+    if (searchQuery) params.set('q', searchQuery);
+
+    const response = await fetch(`${searchQuery ? '/api/images/search' : '/api/images'}?${params}`);
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error);
+    return data;
+}
+
+// Append a batch and start fetching the one after it
+function appendBatch(data) {
+    $gallery.append(data.images.map(createImageCard).join(''));
+    nextCursor = data.next_cursor;
+    nextBatch = nextCursor ? fetchBatch(nextCursor) : null;
+    // A failed prefetch is retried by loadMore()
+    if (nextBatch) nextBatch.catch(() => {});
+    // Without a next page there is nothing left to observe
+    $sentinel.toggleClass('d-none', !nextCursor);
+}
+
+// Load the next batch when the sentinel below the gallery comes near the viewport
+export async function loadMore() {
+    if (isLoading || !nextCursor) return;
+
+    isLoading = true;
+    try {
+        // Usually the batch has been prefetched already
+        const query = searchQuery;
+        const batch = nextBatch || fetchBatch(nextCursor);
+        nextBatch = null;
+        const data = await batch;
+        if (query === searchQuery) appendBatch(data);
+    } catch (error) {
+        showError('Error loading gallery: ' + error.message);
+    } finally {
+        isLoading = false;
+    }
 
-    // Page numbers
-    for (let i = 1; i <= totalPages; i++) {
-        html += `
-            <li class="page-item ${currentPage === i ? 'active' : ''}">
-                <a class="page-link" href="#" data-page="${i}">${i}</a>
-            </li>
-        `;
+    // Observing again reports the sentinel if it is still near the viewport
+    if (observer && nextCursor) {
+        observer.unobserve($sentinel[0]);
+        observer.observe($sentinel[0]);
     }
+}
 
-    // Next button
-    html += `
-        <li class="page-item ${currentPage === totalPages ? 'disabled' : ''}">
-            <a class="page-link" href="#" data-page="${currentPage + 1}">
-                <i class="fas fa-chevron-right"></i>
-            </a>
-        </li>
-    `;
+// Observe the sentinel, starting the load well before the user reaches the bottom
+function observeSentinel() {
+    if (observer || !('IntersectionObserver' in window)) return;
 
-    return html;
+    observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) loadMore();
+    }, { rootMargin: GALLERY_PREFETCH_MARGIN });
+    observer.observe($sentinel[0]);
 }
 
-// Load gallery images
-export async function loadGallery(page = 1) {
-    if (!$gallery || !$pagination) {
+// Load gallery from the newest image
+export async function loadGallery() {
+    if (!$gallery || !$sentinel) {
         console.warn('Gallery elements not initialized');
         return;
     }
 
     try {
-        const response = await fetch(`/api/images?page=${page}`);
-        const data = await response.json();
-
-        if (!response.ok) throw new Error(data.error);
+        const query = searchQuery;
+        const data = await fetchBatch(null);
+        // A newer search started meanwhile, its results win
+        if (query !== searchQuery) return;
 
         $gallery.empty();
-        data.images.forEach(image => {
-            $gallery.append(createImageCard(image));
-        });
-
-        setCurrentPage(page);
-        $pagination.html(createPagination(data.total_pages));
+        appendBatch(data);
+        observeSentinel();
 
     } catch (error) {
         showError('Error loading gallery: ' + error.message);
     }
 }
+
+// Show only images matching the query, all images when it is empty
+export function searchGallery(query) {
+    query = query.trim();
+    if (query === searchQuery) return;
+    searchQuery = query;
+    return loadGallery();
+}
+
+// Remove a deleted image without reloading the gallery
+export function removeImageCard(imageId) {
+    $gallery.find(`.delete-image[data-image-id^="${imageId}."]`).closest('.col-md-4').remove();
+}
@@ -48,15 +48,24 @@ export async function openPhotoSwipeGallery(clickedImageSrc) {
             clickedIndex = index;
         }
 
-        // Create promise to get image dimensions
-        const imagePromise = getImageDimensions(src).then(dimensions => ({
-            src: src,
-            width: dimensions.width,
-            height: dimensions.height,
-            alt: alt
-        }));
-
-        imagePromises.push(imagePromise);
+        // Thumbnail already shown in the card, displayed while the original loads
+        const msrc = this.currentSrc || src;
+        const width = Number($img.data('width'));
+        const height = Number($img.data('height'));
+
+        if (width && height) {
+            // Dimensions from the metadata, nothing to download before opening
+            imagePromises.push(Promise.resolve({ src, msrc, width, height, alt }));
+        } else {
+            // Older images without stored dimensions
+            imagePromises.push(getImageDimensions(src).then(dimensions => ({
+                src: src,
+                msrc: msrc,
+                width: dimensions.width,
+                height: dimensions.height,
+                alt: alt
+            })));
+        }
     });
 
     if (imagePromises.length === 0) {
@@ -65,7 +74,7 @@ export async function openPhotoSwipeGallery(clickedImageSrc) {
     }
 
     try {
-        // Wait for all image dimensions to be loaded
+        // Resolves at once unless some images have no stored dimensions
         const resolvedImages = await Promise.all(imagePromises);
 
         // Create PhotoSwipe options
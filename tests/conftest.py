@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+# Keep job queue and other SQLite databases of test runs out of the repository,
+# otherwise jobs left over from one run would be picked up by the next one
+os.environ.setdefault('DATA_STORAGE_PATH', tempfile.mkdtemp(prefix="repl_test_data_"))
+
+# Tests must not open connections to the Replicate CDN
+os.environ.setdefault('DOWNLOAD_WARMUP_URLS', '')
+
+# Model schemas are loaded on demand with the Replicate client mocked by the tests
+os.environ.setdefault('MODEL_SCHEMA_PREWARM', 'false')
+
+# LiteLLM would fetch its model cost map in a background thread on import
+os.environ.setdefault('LITELLM_LOCAL_MODEL_COST_MAP', 'True')
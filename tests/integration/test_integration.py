@@ -34,6 +34,12 @@ def integration_client():
         "REPLICATE_MODELS": current_models,
         "IMAGE_STORAGE_PATH": temp_image_dir,
         "METADATA_STORAGE_PATH": temp_metadata_dir,
+        # The environment is cleared, so the test settings of conftest.py are passed again;
+        # otherwise importing the app prewarms schemas through the mocked client
+        "DATA_STORAGE_PATH": os.environ['DATA_STORAGE_PATH'],
+        "DOWNLOAD_WARMUP_URLS": "",
+        "MODEL_SCHEMA_PREWARM": "false",
+        "LITELLM_LOCAL_MODEL_COST_MAP": os.environ['LITELLM_LOCAL_MODEL_COST_MAP'],
     }
     # Patch env variables BEFORE importing app
     with patch.dict(os.environ, env_vars, clear=True):
@@ -137,13 +143,23 @@ def test_full_flow_dynamic_params(integration_client):
         }
         response_generate = test_client.post('/api/generate-image', json=request_data)
 
-        # --- Step 5: Verify response and API calls ---
-        assert response_generate.status_code == 200
+        # --- Step 5: Wait for the generation job and verify API calls ---
+        assert response_generate.status_code == 202
         generate_data = json.loads(response_generate.data)
-        assert generate_data['status'] == 'success'
-        assert 'image_id' in generate_data
-        image_id = generate_data['image_id']
-        assert generate_data['image_url'] == f'/images/{image_id}.webp'
+        assert generate_data['status'] == 'queued'
+        job_id = generate_data['job_id']
+
+        job_data = None
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            job_data = json.loads(test_client.get(f'/api/jobs/{job_id}').data)
+            if job_data['status'] in ('succeeded', 'failed'):
+                break
+            time.sleep(0.1)
+        assert job_data['status'] == 'succeeded', job_data
+        assert 'image_id' in job_data['result']
+        image_id = job_data['result']['image_id']
+        assert job_data['result']['image_url'] == f'/images/{image_id}.webp'
 
         mocks["translate_to_english"].assert_called_once_with(original_prompt)
         mocks["generate_image"].assert_called_once_with(
@@ -0,0 +1,190 @@
+import pytest
+import io
+import json
+import os
+import time
+import base64
+import hashlib
+import hmac
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+import replicate
+import requests
+from PIL import Image
+from werkzeug.serving import make_server
+
+# Input schema of the fake model, parameters are validated without asking Replicate
+MOCK_MODEL_SCHEMA = {
+    "openapi_schema": {
+        "components": {"schemas": {"Input": {"type": "object", "properties": {
+            "prompt": {"type": "string"},
+            "seed": {"type": "integer"},
+        }}}}
+    }
+}
+
+WEBHOOK_SECRET = "whsec_" + base64.b64encode(b"fake-replicate-secret").decode()
+
+
+class FakeReplicateHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the Replicate API that calls the webhook back"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.created.append(body)
+
+        prediction = {
+            "id": f"pred-{len(self.server.created)}",
+            "model": "owner/model",
+            "version": "v1",
+            "status": "starting",
+            "input": body["input"],
+            "urls": {},
+        }
+        self._send_json(201, prediction)
+
+        # Finish the prediction shortly after, like Replicate would
+        threading.Timer(0.3, self.server.call_webhook, args=(body["webhook"], prediction)).start()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/webp')
+        self.send_header('Content-Length', str(len(self.server.image_bytes)))
+        self.end_headers()
+        self.wfile.write(self.server.image_bytes)
+
+    def _send_json(self, status, data):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class FakeReplicateServer(ThreadingHTTPServer):
+    """Fake Replicate API server signing its webhooks with WEBHOOK_SECRET"""
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeReplicateHandler)
+        self.created = []
+        self.base_url = f"http://127.0.0.1:{self.server_port}"
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 48), color='blue').save(buffer, 'WEBP')
+        self.image_bytes = buffer.getvalue()
+
+    def call_webhook(self, webhook_url, prediction):
+        body = json.dumps(dict(
+            prediction, status="succeeded", output=[f"{self.base_url}/output.webp"]
+        )).encode()
+        webhook_id, timestamp = f"msg_{prediction['id']}", str(int(time.time()))
+        key = base64.b64decode(WEBHOOK_SECRET.split('_', 1)[1])
+        signature = base64.b64encode(
+            hmac.new(key, f"{webhook_id}.{timestamp}.".encode() + body, hashlib.sha256).digest()
+        ).decode()
+        headers = {
+            'Content-Type': 'application/json',
+            'webhook-id': webhook_id,
+            'webhook-timestamp': timestamp,
+            'webhook-signature': f"v1,{signature}",
+        }
+        # Deliver twice: duplicates must be ignored
+        for _ in range(2):
+            requests.post(webhook_url, data=body, headers=headers, timeout=10)
+
+
+@pytest.fixture
+def webhook_env():
+    """Run the app on a live server with webhooks pointing to it and a fake Replicate API"""
+    from app import app as flask_app, model_cache, replicate_client, llm_client, image_manager, metadata_manager
+
+    temp_image_dir = tempfile.mkdtemp(prefix="repl_test_images_")
+    temp_metadata_dir = tempfile.mkdtemp(prefix="repl_test_metadata_")
+    old_paths = (image_manager.storage_path, metadata_manager.storage_path)
+    image_manager.__init__(temp_image_dir)
+    metadata_manager.__init__(temp_metadata_dir)
+
+    fake_replicate = FakeReplicateServer()
+    threading.Thread(target=fake_replicate.serve_forever, daemon=True).start()
+    app_server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=app_server.serve_forever, daemon=True).start()
+
+    fake_client = replicate.Client(api_token="fake-token", base_url=fake_replicate.base_url)
+    old_public_url = flask_app.config.get('PUBLIC_BASE_URL')
+    flask_app.config['PUBLIC_BASE_URL'] = f"http://127.0.0.1:{app_server.server_port}"
+
+    # Downloads go to the images of this test, not to the storage the app was imported with
+    with patch('api.replicate_client.replicate.predictions', fake_client.predictions), \
+         patch.object(replicate_client, '_webhook_secret', WEBHOOK_SECRET), \
+         patch.object(replicate_client, 'download_dir', image_manager.incoming_path), \
+         patch.object(replicate_client, 'resolve_version', return_value=None), \
+         patch.object(model_cache, 'get', return_value=MOCK_MODEL_SCHEMA), \
+         patch.object(llm_client, 'translate_to_english', return_value="A blue square"):
+        with flask_app.test_client() as test_client:
+            yield test_client, fake_replicate, temp_image_dir, temp_metadata_dir
+
+    flask_app.config['PUBLIC_BASE_URL'] = old_public_url
+    app_server.shutdown()
+    fake_replicate.shutdown()
+    image_manager.__init__(old_paths[0])
+    metadata_manager.__init__(old_paths[1])
+    shutil.rmtree(temp_image_dir, ignore_errors=True)
+    shutil.rmtree(temp_metadata_dir, ignore_errors=True)
+
+
+def test_generation_finished_by_webhook(webhook_env):
+    """
+    The worker creates the prediction and is released, then the fake Replicate
+    server calls the webhook which downloads the output and saves image and metadata.
+    """
+    test_client, fake_replicate, image_dir, metadata_dir = webhook_env
+    model_id = os.environ.get('REPLICATE_MODELS', 'owner/model').split(',')[0].strip()
+    from app import app as flask_app
+
+    with patch.dict(flask_app.config, {'REPLICATE_MODELS': [model_id]}):
+        response = test_client.post('/api/generate-image', json={
+            "prompt": "Modrý čtverec", "model_id": model_id, "parameters": {"seed": 42}
+        })
+    assert response.status_code == 202
+    job_id = json.loads(response.data)['job_id']
+
+    job = None
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        job = json.loads(test_client.get(f'/api/jobs/{job_id}').data)
+        if job['status'] in ('succeeded', 'failed'):
+            break
+        time.sleep(0.1)
+
+    assert job['status'] == 'succeeded', job
+    assert {'translate', 'submit', 'generate', 'download', 'save'} <= set(job['timings'])
+
+    # The prediction was created asynchronously with a webhook for this job
+    assert len(fake_replicate.created) == 1
+    created = fake_replicate.created[0]
+    assert created['webhook'].endswith(f"/api/webhooks/replicate?job_id={job_id}")
+    assert created['input'] == {'prompt': 'A blue square', 'seed': 42}
+
+    image_id = job['result']['image_id']
+    assert os.path.exists(os.path.join(image_dir, f"{image_id}.webp"))
+    with open(os.path.join(metadata_dir, f"{image_id}.json")) as f:
+        metadata = json.load(f)
+    assert metadata['prediction_id'] == 'pred-1'
+    assert metadata['original_prompt'] == "Modrý čtverec"
+    assert metadata['translated_prompt'] == "A blue square"
+
+
+def test_webhook_rejects_invalid_signature(webhook_env):
+    """Tests that unsigned webhook requests are rejected."""
+    test_client, _, _, _ = webhook_env
+    response = test_client.post('/api/webhooks/replicate?job_id=x', json={"id": "pred-1", "status": "succeeded"})
+    assert response.status_code == 401
+    data = json.loads(response.data)
+    assert data['type'] == 'UnauthorizedError'
@@ -1,5 +1,6 @@
 import pytest
 import json
+import time
 from unittest.mock import patch, MagicMock
 import os
 
@@ -16,6 +17,17 @@ MOCK_MODEL_SCHEMA = {
     "description": "Mock model description"
 }
 
+# Mock schema with constraints for parameter validation
+MOCK_VALIDATED_MODEL_SCHEMA = {
+    "openapi_schema": {
+        "components": {"schemas": {"Input": {"type": "object", "required": ["prompt"], "properties": {
+            "prompt": {"type": "string"},
+            "width": {"type": "integer", "minimum": 256, "maximum": 2048},
+            "output_format": {"type": "string", "enum": ["webp", "png"]}
+        }}}}
+    }
+}
+
 # Fixture for Flask test client with patching instance methods
 @pytest.fixture
 def client():
@@ -27,7 +39,7 @@ def client():
     # Patch env variables BEFORE importing app
     with patch.dict(os.environ, env_vars, clear=True):
         # Import app and its components HERE
-        from app import app as flask_app, model_cache, replicate_client, llm_client, image_manager, metadata_manager
+        from app import app as flask_app, model_cache, version_resolver, replicate_client, llm_client, image_manager, metadata_manager, limiter
 
         # Override config after app initialization
         flask_app.config['REPLICATE_MODELS'] = EXPECTED_RAW_MODELS_LIST
@@ -37,19 +49,25 @@ def client():
         flask_app.config['IMAGE_STORAGE_PATH'] = '/tmp/test_images'
         flask_app.config['METADATA_STORAGE_PATH'] = '/tmp/test_metadata'
 
-        # Clear cache before each test
+        # Clear cache and rate limit counters before each test
         model_cache.clear()
+        version_resolver.clear()
+        limiter.reset()
 
         flask_app.config.update({"TESTING": True})
 
         # Patch METHODS on imported INSTANCES
         with patch.object(replicate_client, 'get_model_details', autospec=True) as mock_get_details, \
+             patch.object(replicate_client, 'resolve_version', autospec=True, return_value=None) as mock_resolve_version, \
              patch.object(replicate_client, 'generate_image', autospec=True) as mock_generate_image, \
              patch.object(llm_client, 'translate_to_english', autospec=True) as mock_translate, \
              patch.object(llm_client, 'improve_prompt', autospec=True) as mock_improve, \
+             patch.object(llm_client, 'improve_prompt_stream', autospec=True) as mock_improve_stream, \
              patch.object(image_manager, 'save_image_from_file', autospec=True) as mock_save_image, \
              patch.object(metadata_manager, 'save_metadata', autospec=True) as mock_save_meta, \
              patch.object(metadata_manager, 'list_images', autospec=True) as mock_list_images, \
+             patch.object(metadata_manager, 'list_images_after', autospec=True) as mock_list_images_after, \
+             patch.object(metadata_manager, 'search_images', autospec=True) as mock_search_images, \
              patch.object(metadata_manager, 'get_metadata', autospec=True) as mock_get_meta, \
              patch.object(image_manager, 'delete_image', autospec=True) as mock_delete_image, \
              patch.object(metadata_manager, 'delete_metadata', autospec=True) as mock_delete_meta:
@@ -59,17 +77,33 @@ def client():
                 # Yield client and dictionary with mocked METHODS
                 yield test_client, {
                     "get_model_details": mock_get_details,
+                    "resolve_version": mock_resolve_version,
                     "generate_image": mock_generate_image,
                     "translate_to_english": mock_translate,
                     "improve_prompt": mock_improve,
+                    "improve_prompt_stream": mock_improve_stream,
                     "save_image_from_file": mock_save_image,
                     "save_metadata": mock_save_meta,
                     "list_images": mock_list_images,
+                    "list_images_after": mock_list_images_after,
+                    "search_images": mock_search_images,
                     "get_metadata": mock_get_meta,
                     "delete_image": mock_delete_image,
                     "delete_metadata": mock_delete_meta,
                 }
 
+def wait_for_job(test_client, job_id, timeout=10.0):
+    """Poll the job status endpoint until the job finishes."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = test_client.get(f'/api/jobs/{job_id}')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        if data['status'] in ('succeeded', 'failed'):
+            return data
+        time.sleep(0.1)
+    raise AssertionError(f"Job {job_id} did not finish within {timeout} seconds")
+
 # --- Tests for /api/models endpoint ---
 
 def test_get_models_success(client):
@@ -133,13 +167,54 @@ def test_get_model_details_endpoint_caching(client):
      assert data2 == MOCK_MODEL_SCHEMA
      assert mocks["get_model_details"].call_count == call_count_before
 
+# --- Tests for /api/models/manifest endpoint ---
+
+def test_get_models_manifest(client):
+    """Tests that all models' input schemas are returned in one response."""
+    test_client, mocks = client
+    mocks["get_model_details"].return_value = MOCK_MODEL_SCHEMA
+
+    response = test_client.get('/api/models/manifest')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['model_ids'] == EXPECTED_RAW_MODELS_LIST
+    assert set(data['models']) == set(EXPECTED_RAW_MODELS_LIST)
+    assert data['models'][EXPECTED_RAW_MODELS_LIST[0]]['input'] == {
+        "type": "object", "properties": {"prompt": {"type": "string"}}
+    }
+    assert 'description' not in data['models'][EXPECTED_RAW_MODELS_LIST[0]]
+    assert response.headers['ETag']
+    assert 'must-revalidate' in response.headers['Cache-Control']
+
+def test_get_models_manifest_not_modified(client):
+    """Tests that revalidation with the ETag returns 304 without a body."""
+    test_client, mocks = client
+    mocks["get_model_details"].return_value = MOCK_MODEL_SCHEMA
+    etag = test_client.get('/api/models/manifest').headers['ETag']
+
+    response = test_client.get('/api/models/manifest', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert mocks["get_model_details"].call_count == len(EXPECTED_RAW_MODELS_LIST)
+
+def test_get_models_manifest_skips_unavailable_models(client):
+    """Tests that a model whose schema cannot be fetched is left out."""
+    test_client, mocks = client
+    mocks["get_model_details"].side_effect = lambda model_id: (
+        None if model_id == EXPECTED_RAW_MODELS_LIST[1] else MOCK_MODEL_SCHEMA
+    )
+
+    data = json.loads(test_client.get('/api/models/manifest').data)
+    assert EXPECTED_RAW_MODELS_LIST[1] not in data['models']
+    assert EXPECTED_RAW_MODELS_LIST[0] in data['models']
+
 # --- Tests for /api/generate-image endpoint ---
 
 def test_generate_image_endpoint_success(client):
     """Tests successful image generation with dynamic parameters."""
     test_client, mocks = client
     model_id_to_test = EXPECTED_RAW_MODELS_LIST[0]
-    original_prompt = "Cat on the roof"
+    original_prompt = "Kočka na střeše"
     translated_prompt = "Cat on the roof"
     input_parameters = {"negative_prompt": "dog", "width": 1024, "height": 768}
     # Use the path returned from ImageManager (which is mocked)
@@ -160,11 +235,16 @@ def test_generate_image_endpoint_success(client):
     }
     response = test_client.post('/api/generate-image', json=request_data)
 
-    assert response.status_code == 200
+    assert response.status_code == 202
     data = json.loads(response.data)
-    assert data['status'] == 'success'
-    assert data['image_id'] == 'mock_image'
-    assert data['image_url'] == f'/images/{mock_image_filename}'
+    assert data['status'] == 'queued'
+    assert data['status_url'] == f"/api/jobs/{data['job_id']}"
+
+    job = wait_for_job(test_client, data['job_id'])
+    assert job['status'] == 'succeeded'
+    assert job['result']['image_id'] == 'mock_image'
+    assert job['result']['image_url'] == f'/images/{mock_image_filename}'
+    assert set(job['timings']) >= {'queue_wait', 'translate', 'generate', 'save'}
 
     mocks["translate_to_english"].assert_called_once_with(original_prompt)
     mocks["generate_image"].assert_called_once_with(
@@ -181,6 +261,251 @@ def test_generate_image_endpoint_success(client):
     assert saved_metadata['translated_prompt'] == translated_prompt
     assert saved_metadata['model_id'] == model_id_to_test
     assert saved_metadata['parameters'] == input_parameters
+    assert saved_metadata['job_id'] == data['job_id']
+    assert saved_metadata['translation_skipped'] is False
+
+def test_generate_image_uses_pinned_model_version(client):
+    """Tests that a model configured without a version is generated with and recorded as its pinned version."""
+    test_client, mocks = client
+    model_id_to_test = EXPECTED_RAW_MODELS_LIST[2]
+    mocks["resolve_version"].return_value = "abc123"
+    mocks["generate_image"].return_value = {'status': 'success', 'image_paths': ["/tmp/pinned.webp"]}
+    mocks["save_image_from_file"].return_value = "/tmp/test_images/pinned.webp"
+    mocks["save_metadata"].return_value = "pinned.json"
+
+    response = test_client.post('/api/generate-image', json={
+        "prompt": "A red fox in the snow", "model_id": model_id_to_test, "parameters": {}
+    })
+    job = wait_for_job(test_client, json.loads(response.data)['job_id'])
+
+    assert job['status'] == 'succeeded'
+    assert mocks["generate_image"].call_args.kwargs['model_id'] == f"{model_id_to_test}:abc123"
+    saved_metadata = mocks["save_metadata"].call_args[0][1]
+    assert saved_metadata['model_id'] == model_id_to_test
+    assert saved_metadata['model_version'] == "abc123"
+
+    metrics = json.loads(test_client.get('/api/metrics').data)
+    assert metrics['model_versions'] == {model_id_to_test: "abc123"}
+
+def test_generate_image_invalid_parameters(client):
+    """Tests that parameters not matching the model's schema are rejected before translation."""
+    test_client, mocks = client
+    mocks["get_model_details"].return_value = MOCK_VALIDATED_MODEL_SCHEMA
+
+    response = test_client.post('/api/generate-image', json={
+        "prompt": "Kočka", "model_id": EXPECTED_RAW_MODELS_LIST[0],
+        "parameters": {"width": 5000, "output_format": "gif"}
+    })
+
+    assert response.status_code == 400
+    data = json.loads(response.data)
+    assert sorted(data['errors'], key=lambda error: error['parameter']) == [
+        {"parameter": "output_format", "message": "must be one of webp, png"},
+        {"parameter": "width", "message": "must be at most 2048"},
+    ]
+    mocks["translate_to_english"].assert_not_called()
+    mocks["generate_image"].assert_not_called()
+
+def test_generate_image_coerces_parameters(client):
+    """Tests that parameters are coerced to the schema's types before the job is queued."""
+    test_client, mocks = client
+    mocks["get_model_details"].return_value = MOCK_VALIDATED_MODEL_SCHEMA
+    mocks["generate_image"].return_value = {'status': 'success', 'image_paths': ["/tmp/coerced.webp"]}
+    mocks["save_image_from_file"].return_value = "/tmp/test_images/coerced.webp"
+    mocks["save_metadata"].return_value = "coerced.json"
+
+    response = test_client.post('/api/generate-image', json={
+        "prompt": "A red fox", "model_id": EXPECTED_RAW_MODELS_LIST[0], "parameters": {"width": "512"}
+    })
+    job = wait_for_job(test_client, json.loads(response.data)['job_id'])
+
+    assert job['status'] == 'succeeded'
+    assert mocks["generate_image"].call_args.kwargs['input_params'] == {"width": 512}
+
+def test_generate_batch_reports_invalid_variant(client):
+    """Tests that the failing variant of a batch is named in the errors."""
+    test_client, mocks = client
+    mocks["get_model_details"].return_value = MOCK_VALIDATED_MODEL_SCHEMA
+
+    response = test_client.post('/api/generate-batch', json={
+        "prompt": "Liška", "model_id": EXPECTED_RAW_MODELS_LIST[0],
+        "variants": [{"width": 512}, {"width": 8}]
+    })
+
+    assert response.status_code == 400
+    assert json.loads(response.data)['errors'] == [
+        {"parameter": "width", "message": "must be at least 256", "variant": 1}
+    ]
+
+def test_rebuild_metadata_index_command(client):
+    """Tests the CLI command repopulating the gallery index."""
+    from app import app as flask_app, metadata_manager
+    with patch.object(metadata_manager, 'rebuild_index', autospec=True, return_value=3) as mock_rebuild:
+        result = flask_app.test_cli_runner().invoke(args=['rebuild-metadata-index'])
+
+    assert result.exit_code == 0
+    assert "Indexed 3 images" in result.output
+    mock_rebuild.assert_called_once_with()
+
+def test_generate_image_skips_translation_of_english_prompt(client):
+    """Tests that an English prompt is used as-is without calling the LLM."""
+    test_client, mocks = client
+    mocks["generate_image"].return_value = {
+        'status': 'success', 'image_path': "/tmp/some_temp_replicate_file.webp", 'metadata': {}
+    }
+    mocks["save_image_from_file"].return_value = "/tmp/test_images/english.webp"
+
+    response = test_client.post('/api/generate-image', json={
+        "prompt": "A red fox in the snow", "model_id": EXPECTED_RAW_MODELS_LIST[0], "parameters": {}
+    })
+    job = wait_for_job(test_client, json.loads(response.data)['job_id'])
+
+    assert job['status'] == 'succeeded'
+    assert 'translate' not in job['timings']
+    mocks["translate_to_english"].assert_not_called()
+    assert mocks["generate_image"].call_args.kwargs['prompt'] == "A red fox in the snow"
+    saved_metadata = mocks["save_metadata"].call_args[0][1]
+    assert saved_metadata['translated_prompt'] == "A red fox in the snow"
+    assert saved_metadata['translation_skipped'] is True
+
+def test_generate_image_job_failure(client):
+    """Tests that a failing generation marks the job as failed with a message."""
+    test_client, mocks = client
+    mocks["translate_to_english"].side_effect = ValueError("LLM API key is missing or invalid.")
+
+    response = test_client.post('/api/generate-image', json={
+        "prompt": "Nějaký prompt", "model_id": EXPECTED_RAW_MODELS_LIST[0], "parameters": {}
+    })
+    assert response.status_code == 202
+
+    job = wait_for_job(test_client, json.loads(response.data)['job_id'])
+    assert job['status'] == 'failed'
+    assert 'LLM API key is missing or invalid' in job['error']
+    mocks["generate_image"].assert_not_called()
+    mocks["save_metadata"].assert_not_called()
+
+def test_get_job_status_not_found(client):
+    """Tests for 404 error if the job does not exist."""
+    test_client, _ = client
+    response = test_client.get('/api/jobs/non-existent-job')
+    assert response.status_code == 404
+    data = json.loads(response.data)
+    assert data['message'] == 'Job not found'
+
+def test_metrics_include_job_queue(client):
+    """Tests that queue depth is exposed in metrics."""
+    test_client, _ = client
+    response = test_client.get('/api/metrics')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert 'queue_depth' in data['jobs']
+    assert 'avg_stage_seconds' in data['jobs']
+
+def wait_for_batch(test_client, batch_id, timeout=10.0):
+    """Poll the batch status endpoint until all its jobs finish."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        response = test_client.get(f'/api/batches/{batch_id}')
+        assert response.status_code == 200
+        data = json.loads(response.data)
+        if data['status'] in ('succeeded', 'failed', 'partial'):
+            return data
+        time.sleep(0.1)
+    raise AssertionError(f"Batch {batch_id} did not finish within {timeout} seconds")
+
+def test_generate_batch_success(client):
+    """Tests that a batch translates once and generates one job per seed."""
+    test_client, mocks = client
+    model_id_to_test = EXPECTED_RAW_MODELS_LIST[0]
+    mocks["translate_to_english"].return_value = "A red fox"
+    mocks["generate_image"].return_value = {
+        'status': 'success', 'image_path': "/tmp/some_temp_replicate_file.webp", 'metadata': {}
+    }
+    mocks["save_image_from_file"].side_effect = [f"/tmp/test_images/image_{i}.webp" for i in range(3)]
+
+    response = test_client.post('/api/generate-batch', json={
+        "prompt": "Liška", "model_id": model_id_to_test, "parameters": {"seed": 10, "width": 512}, "count": 3
+    })
+    assert response.status_code == 202
+    data = json.loads(response.data)
+    assert data['size'] == 3
+    assert data['status_url'] == f"/api/batches/{data['batch_id']}"
+
+    batch = wait_for_batch(test_client, data['batch_id'])
+    assert batch['status'] == 'succeeded'
+    assert batch['completed'] == 3
+    assert len(batch['jobs']) == 3
+    assert sorted(image['image_id'] for image in batch['images']) == ['image_0', 'image_1', 'image_2']
+
+    mocks["translate_to_english"].assert_called_once_with("Liška")
+    seeds = sorted(call.kwargs['input_params']['seed'] for call in mocks["generate_image"].call_args_list)
+    assert seeds == [10, 11, 12]
+    for call in mocks["generate_image"].call_args_list:
+        assert call.kwargs['prompt'] == "A red fox"
+        assert call.kwargs['input_params']['width'] == 512
+    for call in mocks["save_metadata"].call_args_list:
+        assert call[0][1]['batch_id'] == data['batch_id']
+
+def test_generate_batch_saves_every_output(client):
+    """Tests that all outputs of a multi-output prediction are saved."""
+    test_client, mocks = client
+    mocks["translate_to_english"].return_value = "Two cats"
+    mocks["generate_image"].return_value = {
+        'status': 'success', 'image_path': "/tmp/out_0.webp",
+        'image_paths': ["/tmp/out_0.webp", "/tmp/out_1.webp"], 'metadata': {}
+    }
+    mocks["save_image_from_file"].side_effect = ["/tmp/test_images/a.webp", "/tmp/test_images/b.webp"]
+
+    response = test_client.post('/api/generate-image', json={
+        "prompt": "Two cats", "model_id": EXPECTED_RAW_MODELS_LIST[0], "parameters": {"num_outputs": 2}
+    })
+    job = wait_for_job(test_client, json.loads(response.data)['job_id'])
+
+    assert job['status'] == 'succeeded'
+    assert [image['image_id'] for image in job['result']['images']] == ['a', 'b']
+    saved = [call[0][1]['output_index'] for call in mocks["save_metadata"].call_args_list]
+    assert saved == [0, 1]
+
+def test_generate_batch_too_large(client):
+    """Tests for 400 error if the batch exceeds BATCH_MAX_SIZE."""
+    test_client, _ = client
+    from app import app as flask_app
+    response = test_client.post('/api/generate-batch', json={
+        "prompt": "Prompt", "model_id": EXPECTED_RAW_MODELS_LIST[0],
+        "count": flask_app.config['BATCH_MAX_SIZE'] + 1
+    })
+    assert response.status_code == 400
+    assert 'variants' in json.loads(response.data)['message']
+
+def test_generate_batch_seeds_not_a_list(client):
+    """Tests for 400 error if the seeds of a batch are not a list."""
+    test_client, _ = client
+    response = test_client.post('/api/generate-batch', json={
+        "prompt": "Prompt", "model_id": EXPECTED_RAW_MODELS_LIST[0], "seeds": 5
+    })
+    assert response.status_code == 400
+    assert 'Seeds' in json.loads(response.data)['message']
+
+def test_generate_batch_rejects_count_and_seed_before_building_variants(client):
+    """Tests for 400 errors on a huge count and a seed that is not a number without a schema."""
+    test_client, mocks = client
+    mocks["get_model_details"].return_value = None
+    huge = test_client.post('/api/generate-batch', json={
+        "prompt": "Prompt", "model_id": EXPECTED_RAW_MODELS_LIST[0], "count": 10 ** 9
+    })
+    bad_seed = test_client.post('/api/generate-batch', json={
+        "prompt": "Prompt", "model_id": EXPECTED_RAW_MODELS_LIST[0], "parameters": {"seed": "abc"}, "count": 2
+    })
+
+    assert huge.status_code == 400
+    assert 'variants' in json.loads(huge.data)['message']
+    assert bad_seed.status_code == 400
+
+def test_get_batch_status_not_found(client):
+    """Tests for 404 error if the batch does not exist."""
+    test_client, _ = client
+    response = test_client.get('/api/batches/non-existent-batch')
+    assert response.status_code == 404
 
 def test_generate_image_endpoint_missing_prompt(client):
     """Tests for 400 error if 'prompt' is missing."""
@@ -236,4 +561,181 @@ def test_generate_image_endpoint_invalid_model_id(client):
     mocks["generate_image"].assert_not_called()
 
 
+# --- Tests for /api/improve-prompt endpoints ---
+
+def test_improve_prompt_endpoint_success(client):
+    """Tests that the non-streaming endpoint keeps returning the whole prompt."""
+    test_client, mocks = client
+    mocks["improve_prompt"].return_value = "A fluffy cat on a red roof, golden hour"
+    response = test_client.post('/api/improve-prompt', json={"prompt": "cat on roof"})
+    assert response.status_code == 200
+    assert json.loads(response.data) == {'improved_prompt': "A fluffy cat on a red roof, golden hour"}
+
+def test_improve_prompt_stream_success(client):
+    """Tests that improved prompt tokens are relayed as Server-Sent Events."""
+    test_client, mocks = client
+    mocks["improve_prompt_stream"].return_value = iter(["A fluffy", " cat on", " a red roof "])
+
+    response = test_client.post('/api/improve-prompt/stream', json={"prompt": "cat on roof"})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    events = response.get_data(as_text=True).strip().split('\n\n')
+    deltas = [json.loads(event[len('data: '):])['delta'] for event in events[:-1]]
+    assert deltas == ["A fluffy", " cat on", " a red roof "]
+    assert events[-1].startswith('event: done\n')
+    assert json.loads(events[-1].split('data: ', 1)[1]) == {'improved_prompt': "A fluffy cat on a red roof"}
+    mocks["improve_prompt_stream"].assert_called_once_with("cat on roof")
+
+def test_improve_prompt_stream_configuration_error(client):
+    """Tests that errors before the first token are returned as JSON."""
+    test_client, mocks = client
+    mocks["improve_prompt_stream"].side_effect = ValueError("LLM API key is missing or invalid.")
+
+    response = test_client.post('/api/improve-prompt/stream', json={"prompt": "cat on roof"})
+    assert response.status_code == 401
+    assert json.loads(response.data)['type'] == 'ConfigurationError'
+
+def test_improve_prompt_stream_error_mid_stream(client):
+    """Tests that a failure during streaming is reported as an error event."""
+    test_client, mocks = client
+    def tokens():
+        yield "A fluffy"
+        raise RuntimeError("connection lost")
+    mocks["improve_prompt_stream"].return_value = tokens()
+
+    response = test_client.post('/api/improve-prompt/stream', json={"prompt": "cat on roof"})
+    body = response.get_data(as_text=True)
+    assert 'event: error' in body
+    assert 'event: done' not in body
+
+
+# --- Tests for /api/images endpoint ---
+
+def test_list_images_cursor_pagination(client):
+    """Tests that the gallery is listed by cursor with per_page capped."""
+    test_client, mocks = client
+    mocks["list_images_after"].return_value = {'images': [{'image_filename': 'a.webp'}], 'next_cursor': 'abc'}
+
+    response = test_client.get('/api/images?cursor=xyz&per_page=5000')
+
+    assert response.status_code == 200
+    assert json.loads(response.data) == {
+        'images': [{'image_filename': 'a.webp', 'image_url': '/images/a.webp'}], 'next_cursor': 'abc'
+    }
+    mocks["list_images_after"].assert_called_once_with('xyz', 100)
+    mocks["list_images"].assert_not_called()
+
+def test_list_images_legacy_page(client):
+    """Tests that page numbers still select offset pagination."""
+    test_client, mocks = client
+    mocks["list_images"].return_value = {'images': [], 'total_pages': 0}
+
+    response = test_client.get('/api/images?page=2&per_page=6')
+
+    assert response.status_code == 200
+    mocks["list_images"].assert_called_once_with(2, 6)
+
+def test_list_images_invalid_cursor(client):
+    """Tests that malformed cursors and page sizes are rejected with 400."""
+    test_client, mocks = client
+    mocks["list_images_after"].side_effect = ValueError("Invalid cursor")
+
+    assert test_client.get('/api/images?cursor=garbage').status_code == 400
+    assert test_client.get('/api/images?per_page=many').status_code == 400
+    assert test_client.get('/api/images?per_page=0').status_code == 400
+
+def test_search_images(client):
+    """Tests that the search endpoint passes the query, cursor and capped page size."""
+    test_client, mocks = client
+    mocks["search_images"].return_value = {'images': [{'image_filename': 'cat.webp'}], 'next_cursor': None}
+
+    response = test_client.get('/api/images/search?q=kočka%20roof&cursor=abc&per_page=500')
+
+    assert response.status_code == 200
+    assert json.loads(response.data)['images'] == [{'image_filename': 'cat.webp', 'image_url': '/images/cat.webp'}]
+    mocks["search_images"].assert_called_once_with('kočka roof', 'abc', 100)
+
+def test_image_urls_from_object_storage(client):
+    """Tests that listings point at the storage and the image route redirects there."""
+    from app import image_manager
+    test_client, mocks = client
+    mocks["list_images_after"].return_value = {'images': [{'image_filename': 'a.webp'}], 'next_cursor': None}
+    presigned = 'https://s3.example.com/gallery/images/a.webp?X-Amz-Signature=abc'
+
+    with patch.object(image_manager, 'direct_urls', True), \
+         patch.object(image_manager, 'get_image_url', autospec=True, return_value=presigned):
+        listing = test_client.get('/api/images')
+        response = test_client.get('/images/a.webp')
+
+    assert json.loads(listing.data)['images'][0]['image_url'] == presigned
+    assert response.status_code == 302
+    assert response.headers['Location'] == presigned
+
+def test_list_images_variant_urls(client):
+    """Tests that listings return the URLs of the thumbnails."""
+    test_client, mocks = client
+    mocks["list_images_after"].return_value = {'images': [{
+        'image_filename': 'a.webp', 'variants': {'256': 'a_256.webp', 'blur': 'a_blur.webp'}
+    }], 'next_cursor': None}
+
+    image = json.loads(test_client.get('/api/images').data)['images'][0]
+
+    assert image['variant_urls'] == {'256': '/images/a_256.webp', 'blur': '/images/a_blur.webp'}
+
+def test_generate_thumbnails_command(client, tmp_path):
+    """Tests that the backfill creates thumbnails of images without them and keeps the gallery order."""
+    from PIL import Image
+    from app import app as flask_app
+    from utils.storage import ImageManager, MetadataManager
+    images = ImageManager(str(tmp_path / 'images'))
+    metadata = MetadataManager(str(tmp_path / 'metadata'))
+    Image.new('RGB', (600, 400), 'red').save(os.path.join(images.storage_path, 'a.webp'), 'WEBP')
+    metadata.save_metadata('a.webp', {'original_prompt': 'a'})
+    metadata.save_metadata('gone.webp', {'original_prompt': 'gone'})
+    timestamp = metadata.get_metadata('a.json')['timestamp']
+
+    with patch('app.image_manager', images), patch('app.metadata_manager', metadata):
+        result = flask_app.test_cli_runner().invoke(args=['generate-thumbnails', '--workers', '2'])
+        again = flask_app.test_cli_runner().invoke(args=['generate-thumbnails'])
+
+    assert result.exit_code == 0
+    assert "Created thumbnails of 1 images, skipped 0, missing 1, failed 0" in result.output
+    assert "Created thumbnails of 0 images, skipped 1, missing 1" in again.output
+    updated = metadata.get_metadata('a.json')
+    assert updated['variants'] == {'256': 'a_256.webp', '512': 'a_512.webp', 'blur': 'a_blur.webp'}
+    assert updated['timestamp'] == timestamp
+    assert os.path.exists(os.path.join(images.storage_path, 'a_256.webp'))
+
+def test_extract_image_info_command(client, tmp_path):
+    """Tests that the backfill adds dimensions and placeholders to images without them."""
+    from PIL import Image
+    from app import app as flask_app
+    from utils.storage import ImageManager, MetadataManager
+    images = ImageManager(str(tmp_path / 'images'))
+    metadata = MetadataManager(str(tmp_path / 'metadata'))
+    Image.new('RGB', (300, 200), 'red').save(os.path.join(images.storage_path, 'a.webp'), 'WEBP')
+    metadata.save_metadata('a.webp', {'original_prompt': 'a'})
+
+    with patch('app.image_manager', images), patch('app.metadata_manager', metadata):
+        result = flask_app.test_cli_runner().invoke(args=['extract-image-info'])
+        again = flask_app.test_cli_runner().invoke(args=['extract-image-info'])
+
+    assert "Described 1 images, skipped 0, missing 0, failed 0" in result.output
+    assert "Described 0 images, skipped 1" in again.output
+    updated = metadata.get_metadata('a.json')
+    assert (updated['width'], updated['height']) == (300, 200)
+    assert updated['dominant_color'].startswith('#ff')
+    assert updated['lqip'].startswith('data:image/webp;base64,')
+
+def test_search_images_requires_query(client):
+    """Tests that an empty query or invalid cursor is rejected with 400."""
+    test_client, mocks = client
+    mocks["search_images"].side_effect = ValueError("Invalid cursor")
+
+    assert test_client.get('/api/images/search?q=%20').status_code == 400
+    assert test_client.get('/api/images/search?q=cat&cursor=bad').status_code == 400
+
+
 # --- Tests for parsing REPLICATE_MODELS (covered by /api/models test) ---
\ No newline at end of file
@@ -0,0 +1,177 @@
+import pytest
+import time
+import threading
+from unittest.mock import patch
+from utils.cache import LRUCache, SQLiteCache, TieredCache, RefreshingCache
+
+
+class TestLRUCache:
+    """Test cases for LRUCache"""
+
+    def test_evicts_least_recently_used(self):
+        """Test that the entry not used for the longest time is evicted"""
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        assert cache.get('a') == 1
+        assert cache.get('b') is None
+        assert cache.get('c') == 3
+
+    def test_entries_expire(self):
+        """Test that entries are not returned after their TTL"""
+        cache = LRUCache(ttl=60)
+        cache.set('a', 1)
+        with patch('utils.cache.time.time', return_value=time.time() + 120):
+            assert cache.get('a') is None
+        assert len(cache) == 0
+
+
+class TestSQLiteCache:
+    """Test cases for SQLiteCache"""
+
+    @pytest.fixture
+    def db_path(self, tmp_path):
+        return str(tmp_path / 'cache.sqlite3')
+
+    def test_namespaces_are_separate(self, db_path):
+        """Test that caches in one database do not see each other's entries"""
+        first = SQLiteCache(db_path, 'first')
+        second = SQLiteCache(db_path, 'second')
+        first.set('key', {'value': 1})
+
+        assert first.get('key') == {'value': 1}
+        assert second.get('key') is None
+
+    def test_expired_entries_are_ignored_and_pruned(self, db_path):
+        """Test TTL handling of the shared tier"""
+        cache = SQLiteCache(db_path, 'test', ttl=60)
+        cache.set('key', 'value')
+        with patch('utils.cache.time.time', return_value=time.time() + 120):
+            assert cache.get('key') is None
+            assert cache.prune() == 1
+        assert len(cache) == 0
+
+    def test_size_eviction_removes_oldest(self, db_path):
+        """Test that pruning keeps only max_entries newest entries"""
+        cache = SQLiteCache(db_path, 'test', max_entries=3)
+        for i in range(5):
+            cache.set(f'key{i}', i)
+
+        assert cache.prune() == 2
+        assert cache.get('key0') is None
+        assert cache.get('key1') is None
+        assert cache.get('key4') == 4
+
+
+class TestTieredCache:
+    """Test cases for TieredCache"""
+
+    def test_shared_hit_fills_local_tier(self, tmp_path):
+        """Test that values found in the shared tier are copied to the local one"""
+        shared = SQLiteCache(str(tmp_path / 'cache.sqlite3'), 'test')
+        shared.set('key', 'value')
+        cache = TieredCache(LRUCache(), shared)
+
+        assert cache.get('key') == 'value'
+        assert cache.get('key') == 'value'
+        assert cache.get('missing') is None
+
+        stats = cache.get_stats()
+        assert stats['shared_hits'] == 1
+        assert stats['local_hits'] == 1
+        assert stats['misses'] == 1
+        assert stats['hit_ratio'] == pytest.approx(0.667)
+
+
+class TestRefreshingCache:
+    """Test cases for RefreshingCache"""
+
+    @pytest.fixture
+    def make_cache(self, tmp_path):
+        """Create caches sharing one SQLite tier, like Gunicorn workers do"""
+        db_path = str(tmp_path / 'cache.sqlite3')
+        def make(loader, ttl=60, max_stale=3600):
+            tiers = TieredCache(LRUCache(), SQLiteCache(db_path, 'schemas'))
+            return RefreshingCache(loader, tiers, ttl=ttl, max_stale=max_stale)
+        return make
+
+    def test_loads_once_and_shares_with_other_workers(self, make_cache):
+        """Test that a loaded value is reused by the same and other processes"""
+        calls = []
+        loader = lambda key: calls.append(key) or {'schema': key}
+        cache = make_cache(loader)
+
+        assert cache.get('owner/model') == {'schema': 'owner/model'}
+        assert cache.get('owner/model') == {'schema': 'owner/model'}
+        assert make_cache(loader).get('owner/model') == {'schema': 'owner/model'}
+        assert calls == ['owner/model']
+
+    def test_stale_value_is_served_while_refreshing(self, make_cache):
+        """Test stale-while-revalidate"""
+        versions = iter(['v1', 'v2'])
+        refreshed = threading.Event()
+        def loader(key):
+            value = next(versions)
+            if value == 'v2':
+                refreshed.set()
+            return value
+        cache = make_cache(loader, ttl=60)
+        assert cache.get('key') == 'v1'
+
+        with patch('utils.cache.time.time', return_value=time.time() + 120):
+            assert cache.get('key') == 'v1'
+            assert refreshed.wait(5)
+            cache._executor.shutdown(wait=True)
+            assert cache.get('key') == 'v2'
+        assert cache.get_stats()['stale_served'] == 1
+
+    def test_failed_refresh_keeps_stale_value(self, make_cache):
+        """Test that a loader failure does not drop the stale value"""
+        values = iter(['v1', None])
+        cache = make_cache(lambda key: next(values), ttl=60)
+        cache.get('key')
+
+        with patch('utils.cache.time.time', return_value=time.time() + 120):
+            assert cache.refresh('key') is None
+            assert cache.get('key') == 'v1'
+        assert cache.get_stats()['load_failures'] == 1
+
+    def test_values_expire_after_max_stale(self, make_cache):
+        """Test that values older than max_stale are loaded again synchronously"""
+        values = iter(['v1', 'v2'])
+        cache = make_cache(lambda key: next(values), ttl=60, max_stale=600)
+        cache.get('key')
+
+        with patch('utils.cache.time.time', return_value=time.time() + 1200):
+            assert cache.get('key') == 'v2'
+
+    def test_concurrent_misses_are_coalesced(self, make_cache):
+        """Test that parallel requests for a missing key load it once"""
+        calls = []
+        def loader(key):
+            calls.append(key)
+            time.sleep(0.2)
+            return 'value'
+        cache = make_cache(loader)
+
+        threads = [threading.Thread(target=cache.get, args=('key',)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert calls == ['key']
+
+    def test_prewarm_loads_concurrently(self, make_cache):
+        """Test that prewarming loads all keys in parallel"""
+        def loader(key):
+            time.sleep(0.2)
+            return None if key == 'broken' else key
+        cache = make_cache(loader)
+
+        started = time.time()
+        assert cache.prewarm(['a', 'b', 'c', 'broken']) == 3
+        assert time.time() - started < 0.6
+        assert cache.get_stats()['loads'] == 4
@@ -0,0 +1,121 @@
+import pytest
+import os
+import time
+import threading
+from utils.conversion_cache import ConversionCache
+
+
+class TestConversionCache:
+    """Test cases for ConversionCache"""
+
+    @pytest.fixture
+    def cache(self, tmp_path):
+        """Create a cache with room for two 100 byte files"""
+        return ConversionCache(str(tmp_path / 'conversions.sqlite3'), str(tmp_path / 'conversions'), max_bytes=250)
+
+    def _writer(self, data=b'x' * 100, calls=None):
+        def convert(dest_path):
+            if calls is not None:
+                calls.append(dest_path)
+            with open(dest_path, 'wb') as f:
+                f.write(data)
+        return convert
+
+    def test_converts_once_per_key(self, cache):
+        """Test that a conversion is reused and that options are part of the key"""
+        calls = []
+
+        path = cache.get('image', 'jpg', {'quality': 90}, self._writer(calls=calls))
+        again = cache.get('image', 'jpg', {'quality': 90}, self._writer(calls=calls))
+        other = cache.get('image', 'jpg', {'quality': 50}, self._writer(calls=calls))
+
+        assert path == again != other
+        assert path.endswith('.jpg')
+        assert len(calls) == 2
+        stats = cache.get_stats()
+        assert (stats['hits'], stats['misses'], stats['entries'], stats['size_bytes']) == (1, 2, 2, 200)
+
+    def test_evicts_least_recently_used(self, cache):
+        """Test that the oldest entries are removed when the cache is over its size"""
+        cache.TOUCH_INTERVAL = 0
+        first = cache.get('a', 'png', {}, self._writer())
+        second = cache.get('b', 'png', {}, self._writer())
+        time.sleep(0.01)
+        cache.get('a', 'png', {}, self._writer())
+        third = cache.get('c', 'png', {}, self._writer())
+
+        assert os.path.exists(first) and os.path.exists(third)
+        assert not os.path.exists(second)
+        assert cache.get_stats()['evictions'] == 1
+
+    def test_concurrent_requests_coalesced(self, cache):
+        """Test that requests for the same conversion wait for the first one"""
+        calls = []
+        started = threading.Event()
+
+        def slow_convert(dest_path):
+            calls.append(dest_path)
+            started.set()
+            time.sleep(0.2)
+            self._writer()(dest_path)
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get('image', 'jpg', {}, slow_convert)))
+                   for _ in range(4)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert len(set(results)) == 1
+        assert cache.get_stats()['coalesced'] == 3
+
+    def test_invalidate_removes_conversions(self, cache):
+        """Test that all conversions of an image are removed with it"""
+        jpg = cache.get('image', 'jpg', {'quality': 90}, self._writer())
+        png = cache.get('image', 'png', {}, self._writer())
+        kept = cache.get('other', 'png', {}, self._writer(b'y'))
+
+        assert cache.invalidate('image') == 2
+        assert not os.path.exists(jpg) and not os.path.exists(png)
+        assert os.path.exists(kept)
+        assert cache.invalidate('image') == 0
+
+    def test_invalidate_during_conversion(self, cache):
+        """Test that a conversion finishing after its image was invalidated is not cached"""
+        def convert(dest_path):
+            self._writer()(dest_path)
+            cache.invalidate('image')
+
+        assert cache.get('image', 'jpg', {}, convert) is None
+        assert cache.get_stats()['entries'] == 0
+        assert [name for name in os.listdir(cache.cache_dir) if not name.startswith('.')] == []
+        # Converted again after the invalidation, the image is cached as usual
+        assert cache.get('image', 'jpg', {}, self._writer()) is not None
+        assert cache.get_stats()['entries'] == 1
+
+    def test_failed_conversion_leaves_nothing(self, cache):
+        """Test that a failed conversion is not cached and its partial file removed"""
+        def failing(dest_path):
+            with open(dest_path, 'wb') as f:
+                f.write(b'partial')
+            raise ValueError('Conversion failed')
+
+        with pytest.raises(ValueError):
+            cache.get('image', 'jpg', {}, failing)
+
+        assert [name for name in os.listdir(cache.cache_dir) if not name.startswith('.')] == []
+        assert cache.get_stats()['entries'] == 0
+
+    def test_missing_file_converted_again(self, cache):
+        """Test that an entry whose file was removed is converted again"""
+        calls = []
+        path = cache.get('image', 'jpg', {}, self._writer(calls=calls))
+        os.remove(path)
+
+        assert cache.get('image', 'jpg', {}, self._writer(calls=calls)) == path
+        assert os.path.exists(path)
+        assert len(calls) == 2
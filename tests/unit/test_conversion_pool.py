@@ -0,0 +1,136 @@
+import pytest
+import os
+import time
+import signal
+import threading
+from PIL import Image
+from utils.conversion_pool import ConversionPool, ConversionPoolFull, ConversionTimeout, ConversionWorkerLost
+from utils.image_converter import ImageConverter
+
+
+def _pid():
+    return os.getpid()
+
+def _sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+def _sleep_past_alarm(seconds):
+    # Like a job stuck in native code, the alarm of the timeout never fires
+    signal.setitimer(signal.ITIMER_REAL, 0)
+    return _sleep(seconds)
+
+def _allocate(size):
+    return len(bytearray(size))
+
+def _fail():
+    raise ValueError('broken image')
+
+def _crash():
+    os._exit(1)
+
+
+class TestConversionPool:
+    """Test cases for ConversionPool"""
+
+    @pytest.fixture
+    def pool(self):
+        """Create a pool with one worker and no queue"""
+        pool = ConversionPool(1, queue_size=0, timeout=5, memory_limit=64 * 1024 * 1024)
+        yield pool
+        pool.shutdown()
+
+    def test_runs_in_worker_process(self, pool):
+        """Test that jobs run in another process and their timings are recorded"""
+        assert pool.run(_pid) != os.getpid()
+        assert pool.run(_sleep, 0.1) == 0.1
+
+        stats = pool.get_stats()
+        assert stats['completed'] == 2
+        assert stats['in_flight'] == 0
+        assert stats['encode_max_seconds'] >= 0.1
+        assert stats['queue_wait_avg_seconds'] >= 0
+
+    def test_rejects_when_saturated(self, pool):
+        """Test that jobs beyond the workers and queue are rejected with a retry hint"""
+        pool.run(_pid)  # Start the worker
+        busy = threading.Thread(target=pool.run, args=(_sleep, 0.5))
+        busy.start()
+        time.sleep(0.1)
+
+        with pytest.raises(ConversionPoolFull) as exc_info:
+            pool.run(_pid)
+        busy.join()
+
+        assert exc_info.value.retry_after >= 1
+        assert pool.get_stats()['rejected'] == 1
+        assert pool.run(_pid)
+
+    def test_timeout_and_memory_limit(self, pool):
+        """Test that a job is stopped after the timeout and cannot allocate over the limit"""
+        pool.timeout = 0.3
+        with pytest.raises(ConversionTimeout):
+            pool.run(_sleep, 5)
+
+        with pytest.raises(MemoryError):
+            pool.run(_allocate, 256 * 1024 * 1024)
+        assert pool.run(_allocate, 1024 * 1024) == 1024 * 1024
+
+        stats = pool.get_stats()
+        assert (stats['timeouts'], stats['failed']) == (1, 1)
+
+    def test_worker_crash_restarts_pool(self, pool):
+        """Test that a killed worker is reported with a retry hint and later jobs get a new worker"""
+        with pytest.raises(ConversionWorkerLost) as exc_info:
+            pool.run(_crash)
+
+        assert exc_info.value.retry_after >= 1
+        assert pool.run(_pid)
+        assert pool.get_stats()['in_flight'] == 0
+
+    def test_slot_held_until_abandoned_job_ends(self, pool):
+        """Test that a job the caller stopped waiting for keeps its slot until it finishes"""
+        pool.TIMEOUT_GRACE = 0
+        pool.timeout = 0.2
+        with pytest.raises(ConversionTimeout):
+            pool.run(_sleep_past_alarm, 1)
+
+        with pytest.raises(ConversionPoolFull):
+            pool.run(_pid)
+        time.sleep(1)
+        assert pool.run(_pid)
+
+    def test_errors_reach_caller(self, pool):
+        """Test that exceptions raised by the job are raised to the caller"""
+        with pytest.raises(ValueError, match='broken image'):
+            pool.run(_fail)
+
+    def test_converter_uses_pool(self, pool, tmp_path):
+        """Test that ImageConverter converts in the pool"""
+        source = str(tmp_path / 'image.webp')
+        Image.new('RGBA', (64, 64), (255, 0, 0, 128)).save(source, 'WEBP')
+        converter = ImageConverter(temp_dir=str(tmp_path / 'temp'), pool=pool)
+
+        path = converter.convert_to_png(source)
+
+        with Image.open(path) as img:
+            assert img.format == 'PNG' and img.mode == 'RGB'
+        assert pool.get_stats()['completed'] == 1
+
+        with converter.convert_to_buffer(source, 'jpg') as buffer:
+            with Image.open(buffer) as img:
+                assert img.format == 'JPEG'
+        assert pool.get_stats()['completed'] == 2
+
+    def test_pool_buffer_is_unlinked_file(self, pool, tmp_path):
+        """Test that a buffer converted in the pool is the worker's output file, already unlinked"""
+        source = str(tmp_path / 'image.webp')
+        Image.new('RGB', (64, 64), 'blue').save(source, 'WEBP')
+        temp_dir = str(tmp_path / 'temp')
+        converter = ImageConverter(temp_dir=temp_dir, pool=pool)
+
+        with converter.convert_to_buffer(source, 'png') as buffer:
+            assert os.fstat(buffer.fileno()).st_nlink == 0
+            assert os.listdir(temp_dir) == []
+            with Image.open(buffer) as img:
+                assert img.format == 'PNG'
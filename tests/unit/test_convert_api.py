@@ -1,10 +1,12 @@
 import pytest
+import io
 import os
 import tempfile
 import json
 from unittest.mock import patch, MagicMock
 from PIL import Image
-from app import app
+from app import app, image_manager, image_converter, conversion_cache, transform_url
+from utils.conversion_pool import ConversionPoolFull, ConversionTimeout, ConversionWorkerLost
 
 
 class TestConvertAPI:
@@ -32,7 +34,7 @@ class TestConvertAPI:
         img = Image.new('RGB', (100, 100), color='red')
 
         # Save to the images directory
-        image_path = os.path.join(app.config['IMAGE_STORAGE_PATH'], f"{sample_image_id}.webp")
+        image_path = os.path.join(image_manager.storage_path, f"{sample_image_id}.webp")
         os.makedirs(os.path.dirname(image_path), exist_ok=True)
         img.save(image_path, 'WEBP')
 
@@ -41,6 +43,7 @@ class TestConvertAPI:
         # Cleanup
         if os.path.exists(image_path):
             os.remove(image_path)
+        conversion_cache.invalidate(sample_image_id)
 
     def test_convert_to_jpg_success(self, client, sample_image_id, create_test_image):
         """Test successful conversion to JPEG"""
@@ -127,6 +130,51 @@ class TestConvertAPI:
         assert data['error'] == 'Internal server error'
         assert data['type'] == 'InternalServerError'
 
+    def test_convert_streamed_without_cache(self, client, sample_image_id, create_test_image):
+        """Test that without the disk cache conversions are streamed with their length and leave no files"""
+        temp_files_before = set(os.listdir(image_converter.temp_dir))
+
+        with patch('app.conversion_cache', None):
+            response = client.get(f'/api/convert/{sample_image_id}/png')
+            partial = client.get(f'/api/convert/{sample_image_id}/png', headers={'Range': 'bytes=0-9'})
+
+        assert response.status_code == 200
+        assert response.headers['Content-Length'] == str(len(response.data))
+        assert f'{sample_image_id}.png' in response.headers['Content-Disposition']
+        assert 'immutable' in response.headers['Cache-Control']
+        with Image.open(io.BytesIO(response.data)) as img:
+            assert img.format == 'PNG'
+        assert partial.status_code == 206
+        assert partial.data == response.data[:10]
+        response.close()
+        partial.close()
+        assert set(os.listdir(image_converter.temp_dir)) == temp_files_before
+
+    @patch('app.image_converter.convert_to_jpg')
+    def test_convert_rejected_when_pool_full(self, mock_convert, client, sample_image_id, create_test_image):
+        """Test that a saturated conversion pool answers 503 with Retry-After"""
+        mock_convert.side_effect = ConversionPoolFull(7)
+
+        response = client.get(f'/api/convert/{sample_image_id}/jpg')
+
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '7'
+        data = json.loads(response.data)
+        assert data['type'] == 'ServiceUnavailableError'
+
+    @patch('app.image_converter.convert_to_jpg')
+    def test_convert_pool_failures(self, mock_convert, client, sample_image_id, create_test_image):
+        """Test that a lost worker answers 503 with Retry-After and a timeout 504"""
+        mock_convert.side_effect = ConversionWorkerLost(3)
+        lost = client.get(f'/api/convert/{sample_image_id}/jpg')
+        mock_convert.side_effect = ConversionTimeout('Conversion timed out')
+        timed_out = client.get(f'/api/convert/{sample_image_id}/jpg')
+
+        assert lost.status_code == 503
+        assert lost.headers['Retry-After'] == '3'
+        assert timed_out.status_code == 504
+        assert json.loads(timed_out.data)['type'] == 'GatewayTimeoutError'
+
     def test_rate_limiting_convert_endpoint(self, client, sample_image_id, create_test_image):
         """Test rate limiting on convert endpoint (basic test)"""
         # This test just verifies the endpoint responds normally
@@ -173,3 +221,189 @@ class TestConvertAPI:
             assert response.status_code == 404
             data = json.loads(response.data)
             assert data['type'] == 'NotFoundError'
+
+    def test_serve_and_convert_sharded_image(self, client):
+        """Test that images in the sharded layout are served and converted by name"""
+        image_id = "ab12cd34-0000-4000-8000-000000000000"
+        image_path = image_manager._get_full_path(f"{image_id}.webp")
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        Image.new('RGB', (10, 10), color='blue').save(image_path, 'WEBP')
+        try:
+            response = client.get(f'/images/{image_id}.webp')
+            assert response.status_code == 200
+            response.close()
+            assert client.get(f'/api/convert/{image_id}/png').status_code == 200
+        finally:
+            os.remove(image_path)
+
+    def test_serve_image_caching_and_ranges(self, client, sample_image_id, create_test_image):
+        """Test that images are cached as immutable and support conditional and range requests"""
+        response = client.get(f'/images/{sample_image_id}.webp')
+        body = response.data
+        etag = response.headers['ETag']
+
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+        assert 'max-age=31536000' in response.headers['Cache-Control']
+        assert not etag.startswith('W/')
+
+        not_modified = client.get(f'/images/{sample_image_id}.webp', headers={'If-None-Match': etag})
+        assert not_modified.status_code == 304
+        assert 'immutable' in not_modified.headers['Cache-Control']
+
+        partial = client.get(f'/images/{sample_image_id}.webp', headers={'Range': 'bytes=0-9'})
+        assert partial.status_code == 206
+        assert partial.data == body[:10]
+        assert partial.headers['Content-Range'] == f"bytes 0-9/{len(body)}"
+        for r in (response, not_modified, partial):
+            r.close()
+
+    def test_serve_image_x_accel_redirect(self, client, sample_image_id, create_test_image):
+        """Test that nginx is told to send the file when X-Accel-Redirect is enabled"""
+        with patch.dict(app.config, {'IMAGE_SENDFILE': 'x-accel', 'IMAGE_ACCEL_PREFIX': '/protected-images/'}):
+            response = client.get(f'/images/{sample_image_id}.webp')
+
+        assert response.status_code == 200
+        assert response.data == b''
+        assert response.headers['X-Accel-Redirect'] == f"/protected-images/{sample_image_id}.webp"
+        assert response.mimetype == 'image/webp'
+        assert 'immutable' in response.headers['Cache-Control']
+
+    def test_serve_image_not_limited_by_api_limits(self, client, sample_image_id, create_test_image):
+        """Test that a gallery scroll does not exhaust the image rate limit"""
+        for _ in range(80):
+            response = client.get(f'/images/{sample_image_id}.webp')
+            assert response.status_code == 200
+            response.close()
+
+    @patch('app.image_converter.convert_to_jpg')
+    def test_convert_not_modified_skips_conversion(self, mock_convert, client, sample_image_id, create_test_image):
+        """Test that a cached conversion is confirmed with 304 without converting again"""
+        mock_convert.side_effect = lambda path, quality, dest_path: Image.open(path).convert('RGB').save(
+            dest_path, 'JPEG') or dest_path
+
+        response = client.get(f'/api/convert/{sample_image_id}/jpg')
+        etag = response.headers['ETag']
+        response.close()
+        assert 'immutable' in response.headers['Cache-Control']
+
+        not_modified = client.get(f'/api/convert/{sample_image_id}/jpg', headers={'If-None-Match': etag})
+        assert not_modified.status_code == 304
+        assert not_modified.headers['ETag'] == etag
+        assert mock_convert.call_count == 1
+
+    @patch('app.image_converter.convert_to_jpg')
+    def test_repeated_download_served_from_cache(self, mock_convert, client, sample_image_id, create_test_image):
+        """Test that an image is converted once and later downloads send the cached file"""
+        mock_convert.side_effect = lambda path, quality, dest_path: Image.open(path).convert('RGB').save(
+            dest_path, 'JPEG') or dest_path
+
+        first = client.get(f'/api/convert/{sample_image_id}/jpg')
+        second = client.get(f'/api/convert/{sample_image_id}/jpg')
+
+        assert first.status_code == second.status_code == 200
+        assert first.data == second.data
+        assert mock_convert.call_count == 1
+        first.close()
+        second.close()
+
+    def test_conversion_evicted_before_send_converted_again(self, client, sample_image_id, create_test_image, tmp_path):
+        """Test that a cached file removed by another worker before it is sent is converted again"""
+        real_get = conversion_cache.get
+        lookups = []
+        def get(*args):
+            lookups.append(args)
+            # The first lookup returns a file evicted right after it
+            return str(tmp_path / 'evicted.png') if len(lookups) == 1 else real_get(*args)
+
+        with patch.object(conversion_cache, 'get', side_effect=get):
+            response = client.get(f'/api/convert/{sample_image_id}/png')
+
+        assert response.status_code == 200
+        assert len(lookups) == 2
+        with Image.open(io.BytesIO(response.data)) as img:
+            assert img.format == 'PNG'
+        response.close()
+
+    def test_delete_invalidates_cached_conversion(self, client, sample_image_id, create_test_image):
+        """Test that deleting an image removes its cached conversions"""
+        client.get(f'/api/convert/{sample_image_id}/png').close()
+        assert conversion_cache.get_stats()['entries'] >= 1
+        with patch('app.metadata_manager.get_metadata', return_value={'error': 'Metadata not found'}), \
+                patch('app.metadata_manager.delete_metadata'):
+            assert client.delete(f'/api/image/{sample_image_id}').status_code == 200
+
+        assert conversion_cache.invalidate(sample_image_id) == 0
+        assert client.get(f'/api/convert/{sample_image_id}/png').status_code == 404
+
+
+class TestTransformAPI:
+    """Test cases for the signed image transform endpoint"""
+
+    @pytest.fixture
+    def client(self):
+        """Create test client with a secret for signing"""
+        app.config['TESTING'] = True
+        with patch.dict(app.config, {'SECRET_KEY': 'test-secret'}):
+            with app.test_client() as client:
+                yield client
+
+    @pytest.fixture
+    def image_id(self):
+        """Create a test image, its conversions are removed with it"""
+        image_id = "5b0c2f9e-7d1a-4c3b-9e8f-0a1b2c3d4e5f"
+        image_path = os.path.join(image_manager.storage_path, f"{image_id}.webp")
+        Image.new('RGB', (400, 200), color='red').save(image_path, 'WEBP')
+        yield image_id
+        os.remove(image_path)
+        conversion_cache.invalidate(image_id)
+
+    def test_signed_transform(self, client, image_id):
+        """Test that a signed transform is resized, converted and shown inline"""
+        url = transform_url(image_id, width=100, format='jpg', quality=70)
+
+        response = client.get(url)
+
+        assert response.status_code == 200
+        assert response.mimetype == 'image/jpeg'
+        assert response.headers['Content-Disposition'].startswith('inline')
+        assert 'immutable' in response.headers['Cache-Control']
+        with Image.open(io.BytesIO(response.data)) as img:
+            assert (img.format, img.size) == ('JPEG', (100, 50))
+        response.close()
+
+    def test_unsigned_or_tampered_rejected(self, client, image_id):
+        """Test that only URLs signed by the server are rendered"""
+        url = transform_url(image_id, width=100)
+
+        assert client.get(f'/api/transform/{image_id}?width=100').status_code == 403
+        assert client.get(url.replace('width=100', 'width=101')).status_code == 403
+        with patch.dict(app.config, {'SECRET_KEY': None}):
+            response = client.get(url)
+        assert response.status_code == 403
+        assert json.loads(response.data)['type'] == 'ForbiddenError'
+
+    def test_invalid_parameters(self, client, image_id):
+        """Test that signed but invalid parameters are rejected"""
+        for params in ({'width': 0}, {'width': 'wide'}, {'fit': 'stretch'}, {'format': 'gif'}, {'blur': 5}):
+            response = client.get(transform_url(image_id, **params))
+            assert response.status_code == 400, params
+
+        assert client.get(transform_url('missing-id', width=10)).status_code == 404
+
+    def test_transform_cached(self, client, image_id):
+        """Test that a transform is rendered once and then sent from the cache or confirmed with 304"""
+        url = transform_url(image_id, width=64, height=64, fit='cover')
+
+        with patch.object(image_converter, 'transform', wraps=image_converter.transform) as transform:
+            first = client.get(url)
+            second = client.get(url)
+            not_modified = client.get(url, headers={'If-None-Match': first.headers['ETag']})
+
+        assert first.status_code == second.status_code == 200
+        assert first.mimetype == 'image/webp'
+        assert first.data == second.data
+        assert not_modified.status_code == 304
+        assert transform.call_count == 1
+        first.close()
+        second.close()
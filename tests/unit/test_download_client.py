@@ -0,0 +1,121 @@
+import pytest
+import os
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from api.download_client import DownloadClient, DownloadError
+
+IMAGE_BYTES = os.urandom(200 * 1024)
+
+
+class FlakyCDNHandler(BaseHTTPRequestHandler):
+    """Serves IMAGE_BYTES over keep-alive connections, optionally dropping the first transfer"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.headers.get('Range'))
+
+        if self.path == '/missing':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and server.supports_range:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(IMAGE_BYTES) - 1}/{len(IMAGE_BYTES)}')
+        else:
+            self.send_response(200)
+        body = IMAGE_BYTES[start:]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if server.drops > 0:
+            # Send half of the body and cut the connection
+            server.drops -= 1
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class TestDownloadClient:
+    """Test cases for DownloadClient"""
+
+    @pytest.fixture
+    def cdn(self):
+        """Run a local CDN stand-in"""
+        server = ThreadingHTTPServer(('127.0.0.1', 0), FlakyCDNHandler)
+        server.requests, server.drops, server.supports_range = [], 0, True
+        server.url = f"http://127.0.0.1:{server.server_port}"
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        yield server
+        server.shutdown()
+
+    @pytest.fixture
+    def client(self):
+        """Create a client with fast retries"""
+        return DownloadClient(connect_timeout=2, read_timeout=2, max_retries=2, backoff_factor=0.01)
+
+    def test_connections_are_reused(self, cdn, client, tmp_path):
+        """Test that consecutive downloads share one keep-alive connection"""
+        for _ in range(3):
+            path = client.download_to_file(f"{cdn.url}/out.webp", str(tmp_path), suffix='.webp')
+            with open(path, 'rb') as f:
+                assert f.read() == IMAGE_BYTES
+
+        stats = client.get_stats()
+        assert stats['downloads'] == 3
+        assert stats['requests'] == 3
+        assert stats['connections_opened'] == 1
+
+    def test_interrupted_download_resumes_with_range(self, cdn, client, tmp_path):
+        """Test that a dropped transfer continues from the last received byte"""
+        cdn.drops = 1
+        path = client.download_to_file(f"{cdn.url}/out.webp", str(tmp_path))
+
+        with open(path, 'rb') as f:
+            assert f.read() == IMAGE_BYTES
+        assert cdn.requests[0] is None
+        resumed_from = int(cdn.requests[1].split('=')[1].rstrip('-'))
+        assert 0 < resumed_from <= len(IMAGE_BYTES) // 2
+        stats = client.get_stats()
+        assert stats['retries'] == 1
+        assert stats['resumed'] == 1
+        # The digest covers both parts of the transfer
+        assert path.sha256 == hashlib.sha256(IMAGE_BYTES).hexdigest()
+
+    def test_restart_when_range_is_not_supported(self, cdn, client, tmp_path):
+        """Test that the file is rewritten when the server ignores Range"""
+        cdn.drops, cdn.supports_range = 1, False
+        path = client.download_to_file(f"{cdn.url}/out.webp", str(tmp_path))
+
+        with open(path, 'rb') as f:
+            assert f.read() == IMAGE_BYTES
+        assert client.get_stats()['resumed'] == 0
+        assert path.sha256 == hashlib.sha256(IMAGE_BYTES).hexdigest()
+
+    def test_gives_up_after_max_retries(self, cdn, client, tmp_path):
+        """Test that persistent failures raise DownloadError and leave no file"""
+        cdn.drops = 10
+        with pytest.raises(DownloadError):
+            client.download_to_file(f"{cdn.url}/out.webp", str(tmp_path))
+
+        assert os.listdir(tmp_path) == []
+        assert len(cdn.requests) == 3
+        assert client.get_stats()['failed'] == 1
+
+    def test_http_error_is_not_retried(self, cdn, client, tmp_path):
+        """Test that a missing file fails immediately"""
+        with pytest.raises(DownloadError):
+            client.download_to_file(f"{cdn.url}/missing", str(tmp_path))
+        assert len(cdn.requests) == 1
@@ -118,6 +118,19 @@ class TestImageConverter:
         
         info = converter.get_temp_file_info()
         assert info['total_files'] == 0
+
+    def test_cleanup_stale_partial_files(self, converter, temp_dir):
+        """Test that pool output files left by a killed request process are removed once old"""
+        old_time = time.time() - 10
+        stale = os.path.join(temp_dir, f'{ImageConverter.PARTIAL_PREFIX}abc.partial')
+        other = os.path.join(temp_dir, 'other.partial')
+        for path in (stale, other):
+            open(path, 'wb').close()
+            os.utime(path, (old_time, old_time))
+
+        assert converter.cleanup_old_files() == 1
+        assert not os.path.exists(stale)
+        assert os.path.exists(other)
     
     def test_get_temp_file_info(self, converter, sample_webp_image):
         """Test getting temporary file information"""
@@ -166,3 +179,77 @@ class TestImageConverter:
         
         with pytest.raises(ValueError, match="Image conversion to PNG failed"):
             converter.convert_to_png(sample_webp_image)
+
+    def test_convert_to_buffer_in_memory(self, converter, sample_webp_image, temp_dir):
+        """Test that a small conversion stays in memory and nothing is written to disk"""
+        files_before = set(os.listdir(temp_dir))
+
+        with converter.convert_to_buffer(sample_webp_image, 'jpg', quality=80) as buffer:
+            assert not buffer._rolled
+            with Image.open(buffer) as img:
+                assert img.format == 'JPEG'
+
+        assert set(os.listdir(temp_dir)) == files_before
+        assert converter.get_temp_file_info()['total_files'] == 0
+
+    def test_convert_to_buffer_spills_without_leaving_files(self, temp_dir, sample_webp_image):
+        """Test that a large conversion moves to an unnamed file that disappears with the buffer"""
+        converter = ImageConverter(temp_dir=temp_dir, spool_max_size=64)
+        files_before = set(os.listdir(temp_dir))
+
+        with converter.convert_to_buffer(sample_webp_image, 'png') as buffer:
+            assert buffer._rolled
+            assert set(os.listdir(temp_dir)) == files_before
+            with Image.open(buffer) as img:
+                assert img.format == 'PNG'
+
+        with pytest.raises(ValueError, match="Unsupported format"):
+            converter.convert_to_buffer(sample_webp_image, 'gif')
+
+    @pytest.mark.parametrize('fit, width, height, expected', [
+        ('contain', 50, 50, (50, 25)),
+        ('contain', 400, None, (200, 100)),
+        ('cover', 50, 50, (50, 50)),
+        ('cover', 300, 50, (200, 50)),
+        ('fill', 30, 60, (30, 60)),
+    ])
+    def test_transform_sizes(self, converter, temp_dir, fit, width, height, expected):
+        """Test the fit modes, images are only upscaled by fill"""
+        source = os.path.join(temp_dir, 'wide.webp')
+        Image.new('RGB', (200, 100), 'blue').save(source, 'WEBP')
+        dest = os.path.join(temp_dir, 'result.webp')
+
+        converter.transform(source, 'webp', width=width, height=height, fit=fit, dest_path=dest)
+
+        with Image.open(dest) as img:
+            assert img.format == 'WEBP'
+            assert img.size == expected
+
+    def test_transform_formats_and_transparency(self, converter, temp_dir):
+        """Test that transparency is kept where the format has it and flattened for JPEG"""
+        source = os.path.join(temp_dir, 'alpha.webp')
+        Image.new('RGBA', (80, 80), (255, 0, 0, 128)).save(source, 'WEBP')
+
+        with converter.transform(source, 'png', width=40) as buffer:
+            with Image.open(buffer) as img:
+                assert (img.format, img.mode, img.size) == ('PNG', 'RGBA', (40, 40))
+        with converter.transform(source, 'jpg', width=40, quality=60) as buffer:
+            with Image.open(buffer) as img:
+                assert (img.format, img.mode) == ('JPEG', 'RGB')
+
+        assert converter.supports_transform_format('avif') == ('AVIF' in Image.SAVE)
+        with pytest.raises(ValueError, match="Unsupported format"):
+            converter.transform(source, 'gif')
+
+    def test_transform_decodes_jpeg_in_draft_mode(self, converter, temp_dir):
+        """Test that downscaled JPEG sources are decoded at a reduced scale"""
+        source = os.path.join(temp_dir, 'large.jpg')
+        Image.new('RGB', (2048, 2048), 'green').save(source, 'JPEG')
+
+        with patch.object(Image.Image, 'resize', autospec=True, side_effect=Image.Image.resize) as resize:
+            with converter.transform(source, 'webp', width=256) as buffer:
+                with Image.open(buffer) as img:
+                    assert img.size == (256, 256)
+
+        # The 1/8 scale draft already has the requested size
+        resize.assert_not_called()
@@ -0,0 +1,55 @@
+import pytest
+import io
+import os
+import base64
+from unittest.mock import patch
+from PIL import Image
+from utils.image_info import read_image_info
+
+
+class TestReadImageInfo:
+    """Test cases for read_image_info"""
+
+    @pytest.fixture
+    def image_path(self, tmp_path):
+        """Create a mostly blue image with a red stripe"""
+        img = Image.new('RGB', (640, 480), (20, 40, 200))
+        img.paste((220, 10, 10), (0, 0, 640, 60))
+        path = str(tmp_path / 'image.webp')
+        img.save(path, 'WEBP', lossless=True)
+        return path
+
+    def test_describes_image(self, image_path):
+        """Test dimensions, size, dominant color and the inline placeholder"""
+        info = read_image_info(image_path)
+
+        assert info['width'] == 640
+        assert info['height'] == 480
+        assert info['file_size'] == os.path.getsize(image_path)
+        r, g, b = (int(info['dominant_color'][i:i + 2], 16) for i in (1, 3, 5))
+        assert b > 150 and r < 80
+
+        assert info['lqip'].startswith('data:image/webp;base64,')
+        data = base64.b64decode(info['lqip'].split(',', 1)[1])
+        assert len(data) < 1024
+        with Image.open(io.BytesIO(data)) as lqip:
+            assert lqip.size == (16, 12)
+
+    def test_uses_preview_instead_of_decoding_image(self, image_path, tmp_path):
+        """Test that only the header of the image is read when a preview is given"""
+        preview_path = str(tmp_path / 'preview.webp')
+        Image.new('RGB', (32, 24), (0, 200, 0)).save(preview_path, 'WEBP')
+        real_load = Image.Image.load
+        decoded = []
+
+        def load(img):
+            decoded.append(img.size)
+            return real_load(img)
+
+        with patch.object(Image.Image, 'load', autospec=True, side_effect=load):
+            info = read_image_info(image_path, preview_path)
+
+        assert (640, 480) not in decoded
+        assert info['width'] == 640
+        r, g, b = (int(info['dominant_color'][i:i + 2], 16) for i in (1, 3, 5))
+        assert g > 150 and r < 50
@@ -0,0 +1,179 @@
+import pytest
+import os
+import time
+import tempfile
+from unittest.mock import patch
+from utils.job_queue import JobQueue, JobWorkerPool, JobError
+
+
+class TestJobQueue:
+    """Test cases for JobQueue and JobWorkerPool"""
+
+    @pytest.fixture
+    def queue(self):
+        """Create a job queue in a temporary database"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            yield JobQueue(os.path.join(temp_dir, 'jobs.sqlite3'), lease_seconds=60, max_attempts=2)
+
+    def test_enqueue_and_claim(self, queue):
+        """Test that jobs are claimed in FIFO order with their payload"""
+        first_id = queue.enqueue('generate', {'prompt': 'first'})
+        second_id = queue.enqueue('generate', {'prompt': 'second'})
+
+        assert queue.get(first_id)['status'] == 'queued'
+        assert queue.get(second_id)['queue_position'] == 2
+
+        job = queue.claim('host:1')
+        assert job['job_id'] == first_id
+        assert job['status'] == 'running'
+        assert job['payload'] == {'prompt': 'first'}
+        assert job['attempts'] == 1
+        assert 'queue_wait' in job['timings']
+        assert queue.get(second_id)['queue_position'] == 1
+
+    def test_stage_averages_over_jobs_with_the_stage(self, queue):
+        """Test that a stage skipped by some jobs is averaged over the jobs that ran it"""
+        job_ids = [queue.enqueue('generate', {}) for _ in range(2)]
+        for job_id in job_ids:
+            queue.claim('host:1')
+            queue.record_stage(job_id, 'generate', 2.0)
+        queue.record_stage(job_ids[0], 'translate', 0.5)
+        for job_id in job_ids:
+            queue.complete(job_id, {})
+
+        averages = queue.get_stats()['avg_stage_seconds']
+        assert averages['translate'] == 0.5
+        assert averages['generate'] == 2.0
+
+    def test_claim_empty_queue(self, queue):
+        """Test that claiming from an empty queue returns None"""
+        assert queue.claim('host:1') is None
+
+    def test_complete_and_fail(self, queue):
+        """Test storing job results, errors and stage timings"""
+        ok_id = queue.enqueue('generate', {})
+        bad_id = queue.enqueue('generate', {})
+        queue.claim('host:1')
+        queue.claim('host:1')
+
+        queue.record_stage(ok_id, 'translate', 0.25)
+        queue.complete(ok_id, {'image_id': 'abc'})
+        queue.fail(bad_id, 'Boom')
+
+        ok_job = queue.get(ok_id)
+        assert ok_job['status'] == 'succeeded'
+        assert ok_job['result'] == {'image_id': 'abc'}
+        assert ok_job['timings']['translate'] == 0.25
+
+        bad_job = queue.get(bad_id)
+        assert bad_job['status'] == 'failed'
+        assert bad_job['error'] == 'Boom'
+
+        stats = queue.get_stats()
+        assert stats['queue_depth'] == 0
+        assert stats['succeeded'] == 1
+        assert stats['failed'] == 1
+        assert stats['avg_stage_seconds']['translate'] == 0.25
+
+    def test_batch_concurrency_cap(self, queue):
+        """Test that only batch_concurrency jobs of one batch run at once"""
+        queue.batch_concurrency = 2
+        batch_ids = queue.enqueue_many('generate', [{'n': i} for i in range(3)], batch_id='batch-1')
+        other_id = queue.enqueue('generate', {})
+
+        assert queue.claim('host:1')['job_id'] == batch_ids[0]
+        assert queue.claim('host:1')['job_id'] == batch_ids[1]
+        # Third job of the batch waits, the unrelated job overtakes it
+        assert queue.claim('host:1')['job_id'] == other_id
+        assert queue.claim('host:1') is None
+
+        queue.complete(batch_ids[0], {})
+        assert queue.claim('host:1')['job_id'] == batch_ids[2]
+        assert [job['job_id'] for job in queue.list_batch('batch-1')] == batch_ids
+
+    def test_expired_lease_is_reclaimed(self, queue):
+        """Test that a job abandoned by a dead worker is picked up again"""
+        job_id = queue.enqueue('generate', {})
+        queue.claim('host:1')
+        assert queue.claim('host:2') is None
+
+        with patch('utils.job_queue.time.time', return_value=time.time() + 120):
+            job = queue.claim('host:2')
+        assert job['job_id'] == job_id
+        assert job['attempts'] == 2
+
+        # Abandoned again, max_attempts is reached and the job fails
+        with patch('utils.job_queue.time.time', return_value=time.time() + 240):
+            assert queue.claim('host:3') is None
+        assert queue.get(job_id)['status'] == 'failed'
+
+    def test_requeue_orphaned(self, queue):
+        """Test that running jobs of dead processes on this host are requeued"""
+        job_id = queue.enqueue('generate', {})
+        queue.claim('myhost:999999999')
+
+        with patch('utils.job_queue._process_alive', return_value=False):
+            assert queue.requeue_orphaned('myhost') == 1
+        assert queue.get(job_id)['status'] == 'queued'
+
+    def test_worker_pool_runs_handlers(self, queue):
+        """Test that the pool routes jobs to handlers and stores outcomes"""
+        def handler(ctx):
+            with ctx.stage('work'):
+                if ctx.payload.get('fail'):
+                    raise JobError('Handler failed')
+            return {'echo': ctx.payload['value']}
+
+        pool = JobWorkerPool(queue, {'echo': handler}, workers=0)
+        ok_id = queue.enqueue('echo', {'value': 42})
+        bad_id = queue.enqueue('echo', {'fail': True})
+        unknown_id = queue.enqueue('unknown', {})
+
+        assert pool.run_once()
+        assert pool.run_once()
+        assert pool.run_once()
+        assert not pool.run_once()
+
+        assert queue.get(ok_id)['result'] == {'echo': 42}
+        assert 'work' in queue.get(ok_id)['timings']
+        assert queue.get(bad_id)['error'] == 'Handler failed'
+        assert 'Unknown job type' in queue.get(unknown_id)['error']
+
+    def test_worker_pool_hides_unexpected_errors(self, queue):
+        """Test that unexpected exceptions are not exposed to users"""
+        def handler(ctx):
+            raise RuntimeError('secret internal detail')
+
+        pool = JobWorkerPool(queue, {'boom': handler}, workers=0)
+        job_id = queue.enqueue('boom', {})
+        pool.run_once()
+
+        assert queue.get(job_id)['error'] == 'Unexpected error processing job'
+
+    def test_delivery_queues_waiting_job(self, queue):
+        """Test that a delivered event queues the waiting job with the event attached"""
+        job_id = queue.enqueue('generate', {})
+        queue.claim('host:1')
+        queue.suspend(job_id, 'pred-1', 300, {'prediction_id': 'pred-1'})
+
+        assert not queue.deliver(job_id, 'pred-2', {'id': 'pred-2'})
+        assert queue.deliver(job_id, 'pred-1', {'id': 'pred-1', 'status': 'succeeded'})
+        assert not queue.deliver(job_id, 'pred-1', {'id': 'pred-1', 'status': 'succeeded'})
+
+        job = queue.claim('host:2')
+        assert job['job_id'] == job_id
+        assert job['attempts'] == 1
+        assert job['payload'] == {'prediction_id': 'pred-1'}
+        assert job['delivery']['external_id'] == 'pred-1'
+        assert job['delivery']['data']['status'] == 'succeeded'
+
+    def test_delivery_before_suspend(self, queue):
+        """Test that an event arriving before the job is parked queues it instead of waiting"""
+        job_id = queue.enqueue('generate', {})
+        queue.claim('host:1')
+
+        assert queue.deliver(job_id, 'pred-1', {'id': 'pred-1'})
+        queue.suspend(job_id, 'pred-1', 300, {'prediction_id': 'pred-1'})
+
+        assert queue.get(job_id)['status'] == 'queued'
+        assert queue.claim('host:2')['delivery']['data'] == {'id': 'pred-1'}
@@ -2,6 +2,7 @@ import pytest
 import os
 from unittest.mock import patch, MagicMock
 from api.llm_client import LLMClient, AuthenticationError, RateLimitError
+from utils.cache import LRUCache, SQLiteCache, TieredCache
 
 
 @pytest.fixture
@@ -116,3 +117,117 @@ class TestLLMClient:
         for input_model, expected_model in test_cases:
             client = LLMClient("test_key", input_model)
             assert client.model == expected_model, f"Expected {expected_model}, got {client.model} for input {input_model}"
+
+
+class TestTranslationCache:
+    """Test cases for the translation cache of LLMClient"""
+
+    @pytest.fixture
+    def cached_client(self, tmp_path):
+        """Create a client with a two-tier translation cache"""
+        cache = TieredCache(LRUCache(16), SQLiteCache(str(tmp_path / 'cache.sqlite3'), 'translations'))
+        return LLMClient("test_key", "gpt-4", translation_cache=cache)
+
+    @patch('api.llm_client.litellm.completion')
+    def test_repeated_prompt_is_translated_once(self, mock_completion, cached_client):
+        """Test that prompts differing in case and whitespace share a cached translation"""
+        mock_completion.return_value.choices[0].message.content = "A red fox"
+
+        assert cached_client.translate_to_english("Červená liška") == "A red fox"
+        assert cached_client.translate_to_english("  červená   LIŠKA ") == "A red fox"
+
+        mock_completion.assert_called_once()
+        stats = cached_client.get_cache_stats()
+        assert stats['misses'] == 1
+        assert stats['local_hits'] == 1
+
+    @patch('api.llm_client.litellm.completion')
+    def test_shared_tier_is_used_by_other_processes(self, mock_completion, cached_client):
+        """Test that a translation cached by one worker is reused by another"""
+        mock_completion.return_value.choices[0].message.content = "A red fox"
+        cached_client.translate_to_english("Červená liška")
+
+        other_worker = LLMClient("test_key", "gpt-4", translation_cache=TieredCache(
+            LRUCache(16), cached_client.translation_cache.shared
+        ))
+        assert other_worker.translate_to_english("Červená liška") == "A red fox"
+        mock_completion.assert_called_once()
+        assert other_worker.get_cache_stats()['shared_hits'] == 1
+
+    @patch('api.llm_client.litellm.completion')
+    def test_cache_key_includes_model(self, mock_completion, cached_client):
+        """Test that another LLM model does not reuse the translation"""
+        mock_completion.return_value.choices[0].message.content = "A red fox"
+        cached_client.translate_to_english("Červená liška")
+
+        other_model = LLMClient("test_key", "gpt-4o", translation_cache=cached_client.translation_cache)
+        other_model.translate_to_english("Červená liška")
+        assert mock_completion.call_count == 2
+
+    @patch('api.llm_client.litellm.completion')
+    def test_errors_are_not_cached(self, mock_completion, cached_client):
+        """Test that a failed translation is retried on the next call"""
+        mock_completion.side_effect = Exception("Rate limit exceeded")
+        with pytest.raises(RateLimitError):
+            cached_client.translate_to_english("Červená liška")
+        assert cached_client.get_cache_stats()['misses'] == 1
+
+
+class TestLanguageDetection:
+    """Test cases for skipping translation of English prompts"""
+
+    @pytest.mark.parametrize("prompt", [
+        "A red fox in the snow",
+        "Portrait of an astronaut, oil painting, dramatic lighting",
+        "cinematic shot of a castle at sunset, 8k",
+    ])
+    @patch('api.llm_client.litellm.completion')
+    def test_english_prompt_is_not_translated(self, mock_completion, prompt, llm_client):
+        """Test that confidently English prompts are returned unchanged"""
+        assert llm_client.is_english(prompt)
+        assert llm_client.translate_to_english(prompt) == prompt
+        mock_completion.assert_not_called()
+
+    @pytest.mark.parametrize("prompt", [
+        "Kočka na střeše",
+        "kocka na strese",
+        "Der Hund auf dem Dach",
+        "Un chat sur le toit",
+        "Liška",
+    ])
+    def test_other_languages_are_detected(self, prompt, llm_client):
+        """Test that prompts in other languages are sent for translation"""
+        assert not llm_client.is_english(prompt)
+
+    @patch('api.llm_client.litellm.completion')
+    def test_threshold_above_one_always_translates(self, mock_completion):
+        """Test that the threshold makes detection configurable"""
+        mock_completion.return_value.choices[0].message.content = "A red fox"
+        client = LLMClient("test_key", "gpt-4", english_threshold=1.1)
+
+        assert client.translate_to_english("A red fox") == "A red fox"
+        mock_completion.assert_called_once()
+
+
+class TestImprovePromptStream:
+    """Test cases for streaming prompt improvement"""
+
+    @patch('api.llm_client.litellm.completion')
+    def test_yields_content_deltas(self, mock_completion, llm_client):
+        """Test that text pieces are yielded as they arrive and empty deltas skipped"""
+        chunks = []
+        for content in ["A fluffy", None, " cat"]:
+            chunk = MagicMock()
+            chunk.choices[0].delta.content = content
+            chunks.append(chunk)
+        mock_completion.return_value = iter(chunks)
+
+        assert list(llm_client.improve_prompt_stream("cat")) == ["A fluffy", " cat"]
+        assert mock_completion.call_args[1]['stream'] is True
+
+    @patch('api.llm_client.litellm.completion')
+    def test_errors_are_mapped(self, mock_completion, llm_client):
+        """Test that authentication errors surface when the stream starts"""
+        mock_completion.side_effect = Exception("Invalid API key")
+        with pytest.raises(ValueError):
+            next(llm_client.improve_prompt_stream("cat"))
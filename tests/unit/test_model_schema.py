@@ -0,0 +1,150 @@
+import pytest
+from utils.model_schema import (
+    get_input_schema, slim_input_schema, compile_input_validator, InputValidators, InputValidationError
+)
+
+# Shape of a real Replicate OpenAPI document, shortened
+OPENAPI_DOCUMENT = {
+    "openapi": "3.0.2",
+    "paths": {"/predictions": {"post": {"summary": "Create prediction"}}},
+    "components": {
+        "schemas": {
+            "Input": {
+                "type": "object",
+                "title": "Input",
+                "required": ["prompt"],
+                "properties": {
+                    "prompt": {"type": "string", "title": "Prompt", "x-order": 0, "description": "Text prompt"},
+                    "aspect_ratio": {
+                        "allOf": [{"$ref": "#/components/schemas/aspect_ratio"}],
+                        "default": "1:1",
+                        "x-order": 1,
+                        "description": "Aspect ratio"
+                    },
+                    "steps": {"type": "integer", "minimum": 1, "maximum": 50, "default": 25, "x-order": 2,
+                              "examples": [25], "nullable": True},
+                }
+            },
+            "Output": {"type": "string", "format": "uri"},
+            "aspect_ratio": {"enum": ["1:1", "16:9"], "type": "string", "title": "aspect_ratio",
+                             "description": "An enumeration."}
+        }
+    }
+}
+
+
+def test_get_input_schema_handles_wrapped_documents():
+    """Test that the Input schema is found with or without the openapi_schema wrapper"""
+    assert get_input_schema(OPENAPI_DOCUMENT)['title'] == 'Input'
+    assert get_input_schema({'openapi_schema': OPENAPI_DOCUMENT})['title'] == 'Input'
+    assert get_input_schema({'openapi_schema': {}}) is None
+    assert get_input_schema(None) is None
+
+
+def test_slim_input_schema_keeps_only_form_keywords():
+    """Test that unused keywords and components are dropped"""
+    slim = slim_input_schema(OPENAPI_DOCUMENT)
+
+    assert set(slim) == {'type', 'properties', 'required'}
+    assert slim['required'] == ['prompt']
+    assert slim['properties']['steps'] == {
+        'type': 'integer', 'minimum': 1, 'maximum': 50, 'default': 25, 'x-order': 2
+    }
+
+
+def test_slim_input_schema_inlines_references():
+    """Test that enums referenced through allOf become part of the property"""
+    aspect_ratio = slim_input_schema(OPENAPI_DOCUMENT)['properties']['aspect_ratio']
+
+    assert aspect_ratio['enum'] == ['1:1', '16:9']
+    assert aspect_ratio['type'] == 'string'
+    # The property's own keywords win over the referenced schema
+    assert aspect_ratio['description'] == 'Aspect ratio'
+    assert aspect_ratio['default'] == '1:1'
+
+
+def test_input_validator_coerces_form_values():
+    """Test that strings sent by forms are coerced to the declared types"""
+    validate = compile_input_validator(OPENAPI_DOCUMENT)
+
+    assert validate({'steps': '30', 'aspect_ratio': '16:9', 'seed': 'kept', 'skip': None}) == {
+        'steps': 30, 'aspect_ratio': '16:9', 'seed': 'kept'
+    }
+    assert validate({'steps': 30.0}) == {'steps': 30}
+
+
+def test_input_validator_reports_every_invalid_parameter():
+    """Test that all errors are collected with the parameter they belong to"""
+    validate = compile_input_validator(OPENAPI_DOCUMENT)
+
+    with pytest.raises(InputValidationError) as exc_info:
+        validate({'steps': 500, 'aspect_ratio': '4:3'})
+
+    assert exc_info.value.errors == [
+        {'parameter': 'steps', 'message': 'must be at most 50'},
+        {'parameter': 'aspect_ratio', 'message': 'must be one of 1:1, 16:9'},
+    ]
+    with pytest.raises(InputValidationError, match='steps: must be an integer'):
+        validate({'steps': 'many'})
+    with pytest.raises(InputValidationError, match='must be an object'):
+        validate(['steps'])
+
+
+def test_input_validator_checks_required_inputs():
+    """Test that required inputs are enforced except those the application supplies"""
+    document = {'components': {'schemas': {'Input': {
+        'required': ['prompt', 'image'],
+        'properties': {'prompt': {'type': 'string'}, 'image': {'type': 'string'}}
+    }}}}
+
+    with pytest.raises(InputValidationError) as exc_info:
+        compile_input_validator(document)({})
+
+    assert exc_info.value.errors == [{'parameter': 'image', 'message': 'is required'}]
+    assert compile_input_validator({'openapi_schema': {}}) is None
+
+
+def test_input_validators_recompile_on_new_schema():
+    """Test that a validator is reused for the same schema and rebuilt for a refreshed one"""
+    validators = InputValidators()
+    first = validators.get('owner/model:v1', OPENAPI_DOCUMENT)
+
+    assert validators.get('owner/model:v1', OPENAPI_DOCUMENT) is first
+    refreshed = dict(OPENAPI_DOCUMENT)
+    assert validators.get('owner/model:v1', refreshed) is not first
+    assert validators.get_stats() == {'validators': 1, 'compiled': 2}
+
+def test_input_validator_reports_values_of_the_wrong_type():
+    """Test that values the checks cannot compare are reported instead of raising TypeError"""
+    document = {'components': {'schemas': {'Input': {'properties': {
+        'style': {'enum': ['a', 'b']},
+        'strength': {'minimum': 0, 'maximum': 1}
+    }}}}}
+    validate = compile_input_validator(document)
+
+    with pytest.raises(InputValidationError) as exc_info:
+        validate({'style': ['a'], 'strength': 'high'})
+
+    assert exc_info.value.errors == [
+        {'parameter': 'style', 'message': 'must be one of a, b'},
+        {'parameter': 'strength', 'message': 'must be a number'},
+    ]
+
+def test_input_validator_reports_huge_integers():
+    """Test that integers too large for float arithmetic are reported instead of raising OverflowError"""
+    document = {'components': {'schemas': {'Input': {'properties': {
+        'scale': {'type': 'number'},
+        'steps': {'type': 'integer', 'multipleOf': 2},
+        'ratio': {'type': 'number', 'multipleOf': 0.5}
+    }}}}}
+    validate = compile_input_validator(document)
+
+    with pytest.raises(InputValidationError) as exc_info:
+        validate({'scale': 10 ** 400, 'steps': 10 ** 400 + 1, 'ratio': 10 ** 400})
+
+    assert exc_info.value.errors == [
+        {'parameter': 'scale', 'message': 'is out of range'},
+        {'parameter': 'steps', 'message': 'must be a multiple of 2'},
+        {'parameter': 'ratio', 'message': 'is out of range'},
+    ]
+    assert validate({'steps': 10 ** 400}) == {'steps': 10 ** 400}
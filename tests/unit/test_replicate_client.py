@@ -1,4 +1,9 @@
 import pytest
+import base64
+import hashlib
+import hmac
+import os
+import time
 from unittest.mock import patch, MagicMock
 from api.replicate_client import ReplicateClient
 import replicate # Import replicate for mocking
@@ -160,3 +165,90 @@ def test_get_model_details_unexpected_error(mock_replicate_models, replicate_cli
     assert details_schema is None
 
 
+# --- Tests for webhook-driven predictions ---
+
+WEBHOOK_SECRET = "whsec_" + base64.b64encode(b"test-webhook-secret").decode()
+
+def _sign_webhook(body, webhook_id="msg_1", timestamp=None, secret=WEBHOOK_SECRET):
+    """Build webhook headers signed the way Replicate signs them."""
+    timestamp = str(int(time.time())) if timestamp is None else str(timestamp)
+    key = base64.b64decode(secret.split('_', 1)[1])
+    digest = hmac.new(key, f"{webhook_id}.{timestamp}.".encode() + body, hashlib.sha256).digest()
+    return {
+        "webhook-id": webhook_id,
+        "webhook-timestamp": timestamp,
+        "webhook-signature": f"v1,{base64.b64encode(digest).decode()}",
+    }
+
+def test_verify_webhook_valid_signature():
+    """Tests that a correctly signed webhook is accepted."""
+    client = ReplicateClient(api_token="dummy", webhook_secret=WEBHOOK_SECRET)
+    body = b'{"id": "pred-1", "status": "succeeded"}'
+    assert client.verify_webhook(_sign_webhook(body), body) is True
+
+def test_verify_webhook_rejects_tampered_body():
+    """Tests that a webhook whose body was changed after signing is rejected."""
+    client = ReplicateClient(api_token="dummy", webhook_secret=WEBHOOK_SECRET)
+    headers = _sign_webhook(b'{"id": "pred-1"}')
+    assert client.verify_webhook(headers, b'{"id": "pred-2"}') is False
+
+def test_verify_webhook_rejects_stale_and_unsigned():
+    """Tests that old or unsigned webhooks are rejected."""
+    client = ReplicateClient(api_token="dummy", webhook_secret=WEBHOOK_SECRET)
+    body = b'{}'
+    assert client.verify_webhook(_sign_webhook(body, timestamp=1), body) is False
+    assert client.verify_webhook({}, body) is False
+
+@patch('api.replicate_client.replicate.predictions')
+def test_create_prediction_with_webhook(mock_predictions, replicate_client_instance):
+    """Tests that predictions are created with the webhook and the pinned version."""
+    mock_predictions.create.return_value = MagicMock(id="pred-1", status="starting")
+
+    result = replicate_client_instance.create_prediction(
+        prompt="A cat", model_id="owner/model:abc123", input_params={"seed": 7},
+        webhook_url="https://example.com/api/webhooks/replicate?job_id=1"
+    )
+
+    assert result == {'prediction_id': 'pred-1', 'status': 'starting'}
+    kwargs = mock_predictions.create.call_args.kwargs
+    assert kwargs['version'] == 'abc123'
+    assert kwargs['input'] == {'prompt': 'A cat', 'seed': 7}
+    assert kwargs['webhook'] == "https://example.com/api/webhooks/replicate?job_id=1"
+    assert kwargs['webhook_events_filter'] == ['completed']
+
+def test_download_image_uses_download_client(tmp_path):
+    """Tests that outputs are downloaded with the pooled client into the configured directory."""
+    download_client = MagicMock()
+    download_client.download_to_file.return_value = str(tmp_path / 'incoming' / 'out.webp')
+    client = ReplicateClient(api_token="dummy_test_token", download_dir=str(tmp_path / 'incoming'),
+                             download_client=download_client)
+
+    path = client.download_image("https://example.com/out.webp")
+
+    assert path == str(tmp_path / 'incoming' / 'out.webp')
+    assert os.path.isdir(tmp_path / 'incoming')
+    download_client.download_to_file.assert_called_once_with(
+        "https://example.com/out.webp", str(tmp_path / 'incoming'), suffix='.webp'
+    )
+
+@patch('api.replicate_client.replicate.models')
+def test_resolve_version(mock_replicate_models, replicate_client_instance):
+    """Tests that the latest version id is resolved and failures return None."""
+    mock_replicate_models.get.return_value = MagicMock(latest_version=MagicMock(id="abc123"))
+    assert replicate_client_instance.resolve_version("owner/model") == "abc123"
+
+    mock_replicate_models.get.side_effect = ReplicateError("Simulated API Error")
+    assert replicate_client_instance.resolve_version("owner/model") is None
+
+@patch('api.replicate_client.Versions')
+@patch('api.replicate_client.replicate.models')
+def test_get_model_details_pinned_version(mock_replicate_models, mock_versions, replicate_client_instance):
+    """Tests that a versioned model id fetches the schema of that version, not the latest one."""
+    mock_versions.return_value.get.return_value = MagicMock(openapi_schema={"openapi": "3.0"})
+
+    details_schema = replicate_client_instance.get_model_details("owner/model:abc123")
+
+    assert details_schema == {"openapi": "3.0"}
+    assert mock_versions.call_args[0][1] == "owner/model"
+    mock_versions.return_value.get.assert_called_once_with("abc123")
+    mock_replicate_models.get.assert_not_called()
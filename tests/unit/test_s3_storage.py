@@ -0,0 +1,217 @@
+import pytest
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from utils.storage import ImageManager
+from utils.s3_storage import S3ImageManager
+
+
+class FakeS3:
+    """In-process stand-in for an S3-compatible service (path-style requests, no authentication)"""
+
+    def __init__(self):
+        self.objects = {}
+        self.headers = {}
+        self.uploads = {}
+        self.parts_uploaded = 0
+        self.lock = threading.Lock()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _target(self):
+                url = urlsplit(self.path)
+                return url.path.lstrip('/'), parse_qs(url.query, keep_blank_values=True)
+
+            def _send(self, status, body=b'', headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            def do_PUT(self):
+                key, query = self._target()
+                body = self._body()
+                with fake.lock:
+                    if 'uploadId' in query:
+                        fake.uploads[query['uploadId'][0]][int(query['partNumber'][0])] = body
+                        fake.parts_uploaded += 1
+                    else:
+                        fake.objects[key] = body
+                        fake.headers[key] = dict(self.headers)
+                self._send(200, headers={'ETag': '"etag"'})
+
+            def do_POST(self):
+                key, query = self._target()
+                self._body()
+                with fake.lock:
+                    if 'uploads' in query:
+                        upload_id = f"upload-{len(fake.uploads)}"
+                        fake.uploads[upload_id] = {}
+                        fake.headers[key] = dict(self.headers)
+                        body = (f"<InitiateMultipartUploadResult><Bucket>{key.split('/')[0]}</Bucket>"
+                                f"<Key>{key}</Key><UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>")
+                    else:
+                        parts = fake.uploads.pop(query['uploadId'][0])
+                        fake.objects[key] = b''.join(parts[number] for number in sorted(parts))
+                        body = '<CompleteMultipartUploadResult><ETag>"etag"</ETag></CompleteMultipartUploadResult>'
+                self._send(200, body.encode())
+
+            def do_GET(self):
+                key, _ = self._target()
+                with fake.lock:
+                    data = fake.objects.get(key)
+                if data is None:
+                    self._send(404, b'<Error><Code>NoSuchKey</Code></Error>')
+                    return
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                if match:
+                    start, end = int(match.group(1)), int(match.group(2) or len(data) - 1)
+                    self._send(206, data[start:end + 1], {
+                        'Content-Range': f"bytes {start}-{end}/{len(data)}", 'ETag': '"etag"'
+                    })
+                else:
+                    self._send(200, data, {'ETag': '"etag"'})
+
+            def do_HEAD(self):
+                key, _ = self._target()
+                with fake.lock:
+                    data = fake.objects.get(key)
+                if data is None:
+                    self._send(404)
+                else:
+                    self.send_response(200)
+                    self.send_header('Content-Length', str(len(data)))
+                    self.send_header('ETag', '"etag"')
+                    self.end_headers()
+
+            def do_DELETE(self):
+                key, _ = self._target()
+                with fake.lock:
+                    fake.objects.pop(key, None)
+                self._send(204)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestS3ImageManager:
+    """Test cases for S3ImageManager against a local S3 stand-in"""
+
+    @pytest.fixture
+    def s3(self, monkeypatch):
+        """Start the stand-in with credentials for the client"""
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+        # Plain request bodies, without the optional trailing checksums
+        monkeypatch.setenv('AWS_REQUEST_CHECKSUM_CALCULATION', 'when_required')
+        fake = FakeS3()
+        yield fake
+        fake.stop()
+
+    @pytest.fixture
+    def manager(self, s3, tmp_path):
+        """Create an S3 image manager using the stand-in"""
+        return S3ImageManager(str(tmp_path / 'images'), 'gallery', prefix='images/', endpoint_url=s3.endpoint,
+                              region='us-east-1', multipart_chunk_size=5 * 1024 * 1024)
+
+    def _download(self, manager, data):
+        path = os.path.join(manager.incoming_path, 'download.webp')
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_save_uploads_and_removes_download(self, manager, s3):
+        """Test that a saved image is uploaded as an immutable object and the download removed"""
+        source_path = self._download(manager, b'image data')
+
+        key = manager.save_image_from_file(source_path)
+
+        filename = os.path.basename(key)
+        assert key == f"images/{filename}"
+        assert s3.objects[f"gallery/{key}"] == b'image data'
+        assert s3.headers[f"gallery/{key}"]['Content-Type'] == 'image/webp'
+        assert 'immutable' in s3.headers[f"gallery/{key}"]['Cache-Control']
+        assert not os.path.exists(source_path)
+
+    def test_large_image_uploaded_in_parts(self, manager, s3):
+        """Test that files above the part size use a streaming multipart upload"""
+        data = os.urandom(11 * 1024 * 1024)
+
+        key = manager.save_image_from_file(self._download(manager, data))
+
+        assert s3.parts_uploaded == 3
+        assert s3.objects[f"gallery/{key}"] == data
+
+    def test_presigned_and_public_urls(self, manager, s3, tmp_path):
+        """Test that image URLs point at the storage and presigned URLs are reused"""
+        url = manager.get_image_url('a.webp')
+
+        assert url.startswith(f"{s3.endpoint}/gallery/images/a.webp?")
+        assert 'Signature' in url
+        assert manager.get_image_url('a.webp') == url
+
+        public = S3ImageManager(str(tmp_path / 'public'), 'gallery', prefix='images/', endpoint_url=s3.endpoint,
+                                public_url='https://cdn.example.com/')
+        assert public.get_image_url('a.webp') == 'https://cdn.example.com/images/a.webp'
+
+    def test_open_and_delete_image(self, manager, s3):
+        """Test that images are downloaded for reading and the local copy removed afterwards"""
+        filename = os.path.basename(manager.save_image_from_file(self._download(manager, b'image data')))
+
+        with manager.open_image(filename) as path:
+            with open(path, 'rb') as f:
+                assert f.read() == b'image data'
+        assert not os.path.exists(path)
+        assert os.listdir(manager.incoming_path) == []
+
+        manager.delete_image(filename)
+        assert s3.objects == {}
+        with manager.open_image(filename) as path:
+            assert path is None
+
+    def test_variants_uploaded_and_deleted_with_image(self, manager, s3):
+        """Test that thumbnails are stored next to the image and deleted with it"""
+        filename = os.path.basename(manager.save_image_from_file(self._download(manager, b'image data')))
+        thumbnail = os.path.join(manager.incoming_path, 'thumb.webp')
+        with open(thumbnail, 'wb') as f:
+            f.write(b'thumbnail')
+
+        variants = manager.save_variants(filename, {'256': thumbnail})
+
+        assert s3.objects[f"gallery/images/{variants['256']}"] == b'thumbnail'
+        assert not os.path.exists(thumbnail)
+        manager.delete_image(filename, variants.values())
+        assert s3.objects == {}
+
+    def test_upload_local_images(self, manager, s3, tmp_path):
+        """Test that local images are copied once and the upload can run again"""
+        local = ImageManager(str(tmp_path / 'local'), shard_depth=1)
+        names = ['3fa2c1d0-0000-4000-8000-000000000000.webp', 'legacy.webp']
+        for name in names:
+            path = local._get_full_path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(name.encode())
+
+        assert manager.upload_local_images(local, workers=2) == {'uploaded': 2, 'skipped': 0, 'failed': 0}
+        assert manager.upload_local_images(local, workers=2) == {'uploaded': 0, 'skipped': 2, 'failed': 0}
+        assert s3.objects == {f"gallery/images/{name}": name.encode() for name in names}
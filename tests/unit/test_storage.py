@@ -0,0 +1,432 @@
+import pytest
+import os
+import errno
+import json
+import time
+import hashlib
+import sqlite3
+from unittest.mock import patch
+from utils.storage import FileManager, ImageManager, MetadataManager, decode_cursor
+from utils.metadata_index import MetadataIndex
+from utils.content_store import ContentStore
+from api.download_client import DownloadedFile
+
+
+class TestImageManager:
+    """Test cases for ImageManager"""
+
+    @pytest.fixture
+    def manager(self, tmp_path):
+        """Create an image manager in a temporary directory"""
+        return ImageManager(str(tmp_path / 'images'))
+
+    def test_save_image_renames_download(self, manager):
+        """Test that a download from the incoming directory is moved, not copied"""
+        source_path = os.path.join(manager.incoming_path, 'download.webp')
+        with open(source_path, 'wb') as f:
+            f.write(b'image data')
+        inode = os.stat(source_path).st_ino
+
+        dest_path = manager.save_image_from_file(source_path)
+
+        assert os.path.dirname(dest_path) == manager.storage_path
+        assert os.stat(dest_path).st_ino == inode
+        assert not os.path.exists(source_path)
+
+    def test_save_image_across_filesystems(self, manager, tmp_path):
+        """Test the chunked copy used when a rename is not possible"""
+        source_path = str(tmp_path / 'elsewhere.webp')
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        with open(source_path, 'wb') as f:
+            f.write(data)
+
+        real_replace = os.replace
+        def replace(src, dst):
+            if src == source_path:
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            return real_replace(src, dst)
+
+        with patch('utils.storage.os.replace', side_effect=replace):
+            dest_path = manager.save_image_from_file(source_path)
+
+        with open(dest_path, 'rb') as f:
+            assert f.read() == data
+        assert not os.path.exists(source_path)
+        assert os.listdir(manager.incoming_path) == []
+
+    def test_purge_incoming(self, manager):
+        """Test that only abandoned downloads are removed"""
+        old_path = os.path.join(manager.incoming_path, 'old.webp')
+        new_path = os.path.join(manager.incoming_path, 'new.webp')
+        for path in (old_path, new_path):
+            open(path, 'wb').close()
+        old_time = time.time() - 7200
+        os.utime(old_path, (old_time, old_time))
+
+        assert manager.purge_incoming(max_age=3600) == 1
+        assert not os.path.exists(old_path)
+        assert os.path.exists(new_path)
+
+
+class TestShardedLayout:
+    """Test cases for the fan-out directory layout of FileManager"""
+
+    NAME = '3fa2c1d0-0000-4000-8000-000000000000.webp'
+
+    @pytest.fixture
+    def manager(self, tmp_path):
+        """Create an image manager writing one subdirectory level"""
+        return ImageManager(str(tmp_path / 'images'), shard_depth=1)
+
+    def _write(self, path, data=b'image data'):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def test_paths_use_leading_hex_characters(self, tmp_path):
+        """Test that files are placed by the first characters of their name, others stay in the root"""
+        manager = FileManager(str(tmp_path), shard_depth=2)
+
+        assert manager._get_full_path(self.NAME) == os.path.join(str(tmp_path), '3f', 'a2', self.NAME)
+        assert manager._get_full_path('..') == os.path.join(str(tmp_path), '..')
+        assert manager._get_full_path('notes.txt') == os.path.join(str(tmp_path), 'notes.txt')
+        with pytest.raises(ValueError):
+            FileManager(str(tmp_path), shard_depth=3)
+
+    def test_save_and_resolve_sharded_image(self, manager):
+        """Test that new images are written into their shard and resolved by name"""
+        source_path = os.path.join(manager.incoming_path, 'download.webp')
+        self._write(source_path)
+
+        dest_path = manager.save_image_from_file(source_path)
+
+        filename = os.path.basename(dest_path)
+        assert os.path.dirname(dest_path) == os.path.join(manager.storage_path, filename[:2])
+        assert manager.resolve_path(filename) == dest_path
+        assert manager.resolve_path('missing.webp') is None
+
+    def test_variants_saved_and_deleted_with_image(self, manager):
+        """Test that thumbnails are stored next to their image and deleted with it"""
+        image_path = manager._get_full_path(self.NAME)
+        self._write(image_path)
+        thumbnail = os.path.join(manager.incoming_path, 'thumb.webp')
+        self._write(thumbnail, b'thumbnail')
+
+        variants = manager.save_variants(self.NAME, {'256': thumbnail})
+
+        image_id = self.NAME[:-len('.webp')]
+        assert variants == {'256': f"{image_id}_256.webp"}
+        assert manager.resolve_path(variants['256']) == os.path.join(os.path.dirname(image_path), variants['256'])
+        assert not os.path.exists(thumbnail)
+
+        manager.delete_image(self.NAME, variants.values())
+        assert manager.resolve_path(self.NAME) is None
+        assert manager.resolve_path(variants['256']) is None
+
+    def test_resolve_and_delete_legacy_flat_files(self, manager):
+        """Test that files from the flat layout keep working before they are migrated"""
+        flat_path = os.path.join(manager.storage_path, self.NAME)
+        self._write(flat_path)
+
+        assert manager.resolve_path(self.NAME) == flat_path
+        manager.delete_image(self.NAME)
+        assert not os.path.exists(flat_path)
+
+    def test_migrate_layout(self, manager):
+        """Test that migration moves flat files, drops stale copies and can run again"""
+        moved = '0a000000-0000-4000-8000-000000000000.webp'
+        self._write(os.path.join(manager.storage_path, moved))
+        self._write(os.path.join(manager.storage_path, self.NAME), b'old')
+        self._write(manager._get_full_path(self.NAME), b'new')
+        self._write(os.path.join(manager.incoming_path, 'download.webp'))
+
+        assert manager.migrate_layout(workers=2) == {'moved': 1, 'stale': 1, 'failed': 0}
+        assert manager.migrate_layout(workers=2) == {'moved': 0, 'stale': 0, 'failed': 0}
+
+        assert os.path.exists(os.path.join(manager.storage_path, '0a', moved))
+        with open(manager.resolve_path(self.NAME), 'rb') as f:
+            assert f.read() == b'new'
+        assert os.listdir(manager.incoming_path) == ['download.webp']
+        assert sorted(name for name, _ in manager.iter_files()) == sorted([moved, self.NAME])
+
+
+class TestContentAddressedStorage:
+    """Test cases for ImageManager with a content store"""
+
+    @pytest.fixture
+    def manager(self, tmp_path):
+        """Create an image manager storing images by content"""
+        images = str(tmp_path / 'images')
+        store = ContentStore(str(tmp_path / 'content.sqlite3'), os.path.join(images, '.blobs'), extension='.webp')
+        return ImageManager(images, shard_depth=1, content_store=store)
+
+    def _download(self, manager, name, data):
+        path = os.path.join(manager.incoming_path, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return DownloadedFile(path, hashlib.sha256(data).hexdigest())
+
+    def test_identical_images_share_one_blob(self, manager):
+        """Test that the second copy of an image is linked to the stored blob"""
+        first = manager.save_image_from_file(self._download(manager, 'a.webp', b'same image'))
+        second = manager.save_image_from_file(self._download(manager, 'b.webp', b'same image'))
+        other = manager.save_image_from_file(self._download(manager, 'c.webp', b'other image'))
+
+        assert first != second
+        assert os.path.samefile(first, second)
+        assert not os.path.samefile(first, other)
+        assert os.listdir(manager.incoming_path) == []
+        stats = manager.content_store.get_stats()
+        assert stats['blobs'] == 2
+        assert stats['references'] == 3
+        assert stats['bytes_saved'] == len(b'same image')
+        assert stats['dedup_ratio'] == round(31 / 21, 3)
+        assert stats['deduplicated'] == 1
+        # Blobs are not part of the gallery listing
+        assert len(list(manager.iter_files('.webp'))) == 3
+
+    def test_delete_removes_blob_with_last_reference(self, manager):
+        """Test that a blob is kept while referenced and removed with its last reference"""
+        first = manager.save_image_from_file(self._download(manager, 'a.webp', b'same image'))
+        second = manager.save_image_from_file(self._download(manager, 'b.webp', b'same image'))
+        blob = manager.content_store.get_blob_path(hashlib.sha256(b'same image').hexdigest())
+
+        manager.delete_image(os.path.basename(first))
+        assert not os.path.exists(first)
+        assert os.path.exists(blob)
+        with open(second, 'rb') as f:
+            assert f.read() == b'same image'
+
+        manager.delete_image(os.path.basename(second))
+        assert not os.path.exists(second)
+        assert not os.path.exists(blob)
+        assert manager.content_store.get_stats()['blobs'] == 0
+
+    def test_failed_add_leaves_no_blob(self, manager):
+        """Test that a blob moved in by a failed add is moved back and its link removed"""
+        store = manager.content_store
+        digest = hashlib.sha256(b'new image').hexdigest()
+        existing = manager.save_image_from_file(self._download(manager, 'a.webp', b'same image'))
+        source = self._download(manager, 'b.webp', b'new image')
+        link = os.path.join(str(manager.storage_path), 'b.webp')
+
+        # A reference of the same name already exists, so its insert fails
+        with pytest.raises(sqlite3.IntegrityError):
+            store.add(os.path.basename(existing), source, digest, link)
+
+        assert os.path.exists(source)
+        assert not os.path.exists(link)
+        assert not os.path.exists(store.get_blob_path(digest))
+        assert store.get_stats()['blobs'] == 1
+
+    def test_lost_blob_keeps_references(self, manager):
+        """Test that storing the content of a lost blob again keeps the count of its references"""
+        first = manager.save_image_from_file(self._download(manager, 'a.webp', b'same image'))
+        blob = manager.content_store.get_blob_path(hashlib.sha256(b'same image').hexdigest())
+        os.remove(first)
+        os.remove(blob)
+
+        second = manager.save_image_from_file(self._download(manager, 'b.webp', b'same image'))
+        manager.delete_image(os.path.basename(second))
+
+        # a.webp still references the blob
+        assert os.path.exists(blob)
+        assert manager.content_store.get_stats()['references'] == 1
+
+    def test_hash_computed_without_download_digest(self, manager, tmp_path):
+        """Test that files without a known hash, also from another filesystem, are hashed once"""
+        plain = os.path.join(manager.incoming_path, 'plain.webp')
+        with open(plain, 'wb') as f:
+            f.write(b'same image')
+        elsewhere = str(tmp_path / 'elsewhere.webp')
+        with open(elsewhere, 'wb') as f:
+            f.write(b'same image')
+
+        real_replace = os.replace
+        def replace(src, dst):
+            if src == elsewhere:
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            return real_replace(src, dst)
+
+        first = manager.save_image_from_file(plain)
+        with patch('utils.storage.os.replace', side_effect=replace):
+            second = manager.save_image_from_file(elsewhere)
+
+        assert os.path.samefile(first, second)
+        assert not os.path.exists(elsewhere)
+
+    def test_images_saved_before_content_store_are_deleted(self, manager):
+        """Test that files without a reference are deleted as plain files"""
+        path = manager._get_full_path('3fa2c1d0-0000-4000-8000-000000000000.webp')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+
+        manager.delete_image(os.path.basename(path))
+        assert not os.path.exists(path)
+
+
+class TestMetadataManagerIndex:
+    """Test cases for MetadataManager with the SQLite index"""
+
+    @pytest.fixture
+    def manager(self, tmp_path):
+        """Create an indexed metadata manager in a temporary directory"""
+        index = MetadataIndex(str(tmp_path / 'metadata.sqlite3'))
+        return MetadataManager(str(tmp_path / 'metadata'), index=index, shard_depth=1)
+
+    def test_list_images_newest_first(self, manager):
+        """Test that saved metadata is listed from the index, newest first"""
+        for name in ('a', 'b', 'c'):
+            manager.save_metadata(f'{name}.webp', {'original_prompt': name})
+
+        with patch('utils.storage.os.listdir') as mock_listdir:
+            first = manager.list_images(page=1, per_page=2)
+            second = manager.list_images(page=2, per_page=2)
+
+        mock_listdir.assert_not_called()
+        assert [image['original_prompt'] for image in first['images']] == ['c', 'b']
+        assert [image['original_prompt'] for image in second['images']] == ['a']
+        assert first['total_pages'] == 2
+
+    def test_list_images_after_cursor(self, manager):
+        """Test that cursor pages continue where the previous one ended, even when images are added"""
+        for name in ('a', 'b', 'c'):
+            manager.save_metadata(f'{name}.webp', {'original_prompt': name})
+
+        first = manager.list_images_after(per_page=2)
+        manager.save_metadata('d.webp', {'original_prompt': 'd'})
+        second = manager.list_images_after(first['next_cursor'], per_page=2)
+
+        assert [image['original_prompt'] for image in first['images']] == ['c', 'b']
+        assert [image['original_prompt'] for image in second['images']] == ['a']
+        assert second['next_cursor'] is None
+
+    def test_list_images_after_same_timestamp(self, manager):
+        """Test that images with equal timestamps are ordered by id without gaps or repeats"""
+        entries = [(name, {'timestamp': '2024-01-01T00:00:00+00:00', 'image_filename': f'{name}.webp'})
+                   for name in ('a', 'b', 'c')]
+        manager.index.rebuild(entries)
+
+        first = manager.list_images_after(per_page=1)
+        second = manager.list_images_after(first['next_cursor'], per_page=2)
+
+        assert decode_cursor(first['next_cursor'], str, str) == ('2024-01-01T00:00:00+00:00', 'c')
+        assert [image['image_filename'] for image in first['images'] + second['images']] == ['c.webp', 'b.webp', 'a.webp']
+
+    def test_list_images_after_invalid_cursor(self, manager):
+        """Test that a malformed cursor raises ValueError"""
+        for cursor in ('not base64!', 'eyJhIjogMX0', 'W10'):
+            with pytest.raises(ValueError):
+                manager.list_images_after(cursor)
+
+    def test_search_images_ranked(self, manager):
+        """Test that search matches prompts and model ids by word prefix, ignoring diacritics"""
+        manager.save_metadata('a.webp', {'original_prompt': 'Kočka na střeše', 'translated_prompt': 'Cat on the roof',
+                                         'model_id': 'black-forest-labs/flux-1.1-pro'})
+        manager.save_metadata('b.webp', {'original_prompt': 'Pes', 'translated_prompt': 'A dog next to a cat',
+                                         'model_id': 'stability-ai/sdxl'})
+        manager.save_metadata('c.webp', {'original_prompt': 'Les', 'translated_prompt': 'A forest',
+                                         'model_id': 'stability-ai/sdxl'})
+
+        def found(query):
+            return [image['image_filename'] for image in manager.search_images(query)['images']]
+
+        assert found('kocka') == ['a.webp']
+        assert sorted(found('cat')) == ['a.webp', 'b.webp']
+        assert found('sdxl forest') == ['c.webp']
+        assert found('flux') == ['a.webp']
+        assert found('roof" *(') == ['a.webp']
+        assert found('?!') == []
+
+    def test_search_images_cursor_and_updates(self, manager):
+        """Test that search results page by cursor and follow updated and deleted metadata"""
+        for name in ('a', 'b', 'c'):
+            manager.save_metadata(f'{name}.webp', {'original_prompt': f'red fox {name}'})
+
+        first = manager.search_images('fox', per_page=2)
+        second = manager.search_images('fox', first['next_cursor'], per_page=2)
+        pages = [image['image_filename'] for image in first['images'] + second['images']]
+        assert sorted(pages) == ['a.webp', 'b.webp', 'c.webp']
+        assert second['next_cursor'] is None
+
+        manager.save_metadata('a.webp', {'original_prompt': 'blue whale'})
+        manager.delete_metadata('b.json')
+        assert [image['image_filename'] for image in manager.search_images('fox')['images']] == ['c.webp']
+        assert [image['image_filename'] for image in manager.search_images('whale')['images']] == ['a.webp']
+
+    def test_index_migrates_table_without_seq(self, tmp_path):
+        """Test that a database created before full-text search is upgraded with its rows"""
+        db_path = str(tmp_path / 'metadata.sqlite3')
+        conn = sqlite3.connect(db_path)
+        conn.executescript("""
+            CREATE TABLE images (
+                id TEXT PRIMARY KEY, timestamp TEXT NOT NULL, image_filename TEXT, model_id TEXT,
+                original_prompt TEXT, translated_prompt TEXT, metadata TEXT NOT NULL
+            );
+            CREATE INDEX idx_images_timestamp ON images (timestamp DESC, id DESC);
+        """)
+        conn.execute('INSERT INTO images VALUES (?, ?, ?, ?, ?, ?, ?)', (
+            'a', '2024-01-01T00:00:00', 'a.webp', 'stability-ai/sdxl', 'Liška', 'A fox',
+            json.dumps({'timestamp': '2024-01-01T00:00:00', 'image_filename': 'a.webp'})
+        ))
+        conn.commit()
+        conn.close()
+
+        manager = MetadataManager(str(tmp_path / 'metadata'), index=MetadataIndex(db_path), shard_depth=1)
+        manager.save_metadata('b.webp', {'original_prompt': 'Another fox'})
+        manager.save_metadata('b.webp', {'original_prompt': 'Another fox, updated'})
+
+        assert manager.index.count() == 2
+        assert [image['image_filename'] for image in manager.search_images('fox')['images']] in (
+            ['a.webp', 'b.webp'], ['b.webp', 'a.webp']
+        )
+        assert [image['image_filename'] for image in manager.search_images('liska')['images']] == ['a.webp']
+        # Opening the upgraded database again leaves it as is
+        assert MetadataIndex(db_path).count() == 2
+
+    def test_delete_metadata_removes_row_and_file(self, manager):
+        """Test that deleting metadata removes it from the index and the disk"""
+        manager.save_metadata('a.webp', {})
+
+        manager.delete_metadata('a.json')
+
+        assert manager.index.count() == 0
+        assert not os.path.exists(os.path.join(manager.storage_path, 'a.json'))
+
+    def test_failed_write_rolls_back_row(self, manager):
+        """Test that the row is not indexed when the metadata file cannot be written"""
+        with patch('utils.storage.json.dump', side_effect=OSError('disk full')):
+            with pytest.raises(OSError):
+                manager.save_metadata('a.webp', {})
+
+        assert manager.index.count() == 0
+
+    def test_update_metadata_keeps_timestamp(self, manager):
+        """Test that updating metadata changes the file and index row but not the gallery order"""
+        manager.save_metadata('a.webp', {'original_prompt': 'a'})
+        manager.save_metadata('b.webp', {'original_prompt': 'b'})
+        timestamp = manager.get_metadata('a.json')['timestamp']
+
+        updated = manager.update_metadata('a.webp', {'variants': {'256': 'a_256.webp'}})
+
+        assert updated['timestamp'] == timestamp
+        assert manager.get_metadata('a.json')['variants'] == {'256': 'a_256.webp'}
+        images = manager.list_images_after(None, 10)['images']
+        assert [image['image_filename'] for image in images] == ['b.webp', 'a.webp']
+        assert images[1]['variants'] == {'256': 'a_256.webp'}
+        assert manager.update_metadata('missing.webp', {}) is None
+
+    def test_rebuild_index_from_files(self, manager):
+        """Test that the index is repopulated from metadata files, including ones without a timestamp"""
+        manager.save_metadata('a.webp', {'original_prompt': 'a'})
+        with open(os.path.join(manager.storage_path, 'old.json'), 'w') as f:
+            json.dump({'image_filename': 'old.webp'}, f)
+        with open(os.path.join(manager.storage_path, 'broken.json'), 'w') as f:
+            f.write('{')
+        old_time = time.time() - 86400
+        os.utime(os.path.join(manager.storage_path, 'old.json'), (old_time, old_time))
+        manager.index.rebuild([])
+
+        assert manager.rebuild_index() == 2
+        images = manager.list_images()['images']
+        assert [image['image_filename'] for image in images] == ['a.webp', 'old.webp']
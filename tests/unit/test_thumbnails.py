@@ -0,0 +1,72 @@
+import pytest
+import os
+from unittest.mock import patch
+from PIL import Image
+from utils.thumbnails import ThumbnailGenerator
+
+
+class TestThumbnailGenerator:
+    """Test cases for ThumbnailGenerator"""
+
+    @pytest.fixture
+    def generator(self):
+        """Create a generator with the default widths"""
+        return ThumbnailGenerator((256, 512, 1024))
+
+    def _image(self, tmp_path, size, fmt='WEBP', mode='RGB'):
+        path = str(tmp_path / f"source.{fmt.lower()}")
+        Image.new(mode, size, color=(200, 30, 30, 128)[:len(mode)]).save(path, fmt)
+        return path
+
+    def test_generates_widths_and_placeholder(self, generator, tmp_path):
+        """Test that every width smaller than the image and the blurred placeholder are created"""
+        variants = generator.generate(self._image(tmp_path, (800, 600)), str(tmp_path))
+
+        assert sorted(variants) == ['256', '512', 'blur']
+        for name, width in (('256', 256), ('512', 512), ('blur', 32)):
+            with Image.open(variants[name]) as img:
+                assert img.format == 'WEBP'
+                assert img.size == (width, round(600 * width / 800))
+
+    def test_small_image_gets_only_placeholder(self, generator, tmp_path):
+        """Test that images are never upscaled"""
+        variants = generator.generate(self._image(tmp_path, (200, 100)), str(tmp_path))
+
+        assert list(variants) == ['blur']
+
+    def test_jpeg_decoded_in_draft_mode(self, generator, tmp_path):
+        """Test that JPEG sources are decoded at a reduced scale"""
+        source = self._image(tmp_path, (4096, 4096), fmt='JPEG')
+
+        with patch.object(Image.Image, 'resize', autospec=True, side_effect=Image.Image.resize) as resize:
+            variants = generator.generate(source, str(tmp_path))
+
+        # The largest thumbnail comes from the 1/4 scale draft, not the 4096px original
+        assert resize.call_args_list[0].args[0].size == (1024, 1024)
+        with Image.open(variants['1024']) as img:
+            assert img.size == (1024, 1024)
+
+    def test_keeps_transparency(self, generator, tmp_path):
+        """Test that transparent images keep their alpha channel"""
+        variants = generator.generate(self._image(tmp_path, (600, 600), mode='RGBA'), str(tmp_path))
+
+        with Image.open(variants['512']) as img:
+            assert img.mode == 'RGBA'
+
+    def test_failure_removes_created_files(self, generator, tmp_path):
+        """Test that no variant files are left behind when creating one fails"""
+        source = self._image(tmp_path, (800, 600))
+        dest_dir = tmp_path / 'variants'
+        dest_dir.mkdir()
+        real_save = Image.Image.save
+
+        def save(img, path, *args, **kwargs):
+            if img.width == 256:
+                raise OSError('disk full')
+            return real_save(img, path, *args, **kwargs)
+
+        with patch.object(Image.Image, 'save', autospec=True, side_effect=save):
+            with pytest.raises(OSError):
+                generator.generate(source, str(dest_dir))
+
+        assert os.listdir(dest_dir) == []
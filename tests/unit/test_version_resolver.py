@@ -0,0 +1,64 @@
+import threading
+from unittest.mock import MagicMock
+
+from api.version_resolver import ModelVersionResolver
+
+
+def test_pin_resolves_once_and_caches():
+    """Tests that a model is pinned to its resolved version and resolved only once."""
+    resolve = MagicMock(return_value="v1")
+    resolver = ModelVersionResolver(resolve)
+
+    assert resolver.pin("owner/model") == "owner/model:v1"
+    assert resolver.pin("owner/model") == "owner/model:v1"
+    assert resolver.get_version("owner/model") == "v1"
+    resolve.assert_called_once_with("owner/model")
+
+def test_pin_keeps_versioned_ids():
+    """Tests that models configured with a version are used as-is."""
+    resolve = MagicMock()
+    resolver = ModelVersionResolver(resolve)
+
+    assert resolver.pin("owner/model:fixed") == "owner/model:fixed"
+    resolve.assert_not_called()
+
+def test_unresolved_model_falls_back_to_model_id():
+    """Tests that a model whose version cannot be resolved is used without a version."""
+    resolver = ModelVersionResolver(MagicMock(side_effect=RuntimeError("offline")))
+
+    assert resolver.pin("owner/model") == "owner/model"
+    assert resolver.get_version("owner/model") is None
+
+def test_failed_refresh_keeps_pinned_version():
+    """Tests that a known version is kept when a refresh fails."""
+    resolve = MagicMock(side_effect=["v1", None])
+    resolver = ModelVersionResolver(resolve)
+
+    resolver.resolve_all(["owner/model"])
+    assert resolver.resolve_all(["owner/model"]) == {"owner/model": "owner/model:v1"}
+
+def test_new_version_calls_on_change():
+    """Tests that a refresh picking up a new version repins the model and notifies."""
+    on_change = MagicMock()
+    resolver = ModelVersionResolver(MagicMock(side_effect=["v1", "v2"]), on_change=on_change)
+
+    resolver.resolve_all(["owner/model", "other/model:fixed"])
+    pins = resolver.resolve_all(["owner/model", "other/model:fixed"])
+
+    assert pins == {"owner/model": "owner/model:v2", "other/model:fixed": "other/model:fixed"}
+    assert resolver.get_pins() == {"owner/model": "v2"}
+    on_change.assert_called_once_with("owner/model", "owner/model:v2")
+
+def test_background_refresh():
+    """Tests that started resolver refreshes pins on its interval until stopped."""
+    refreshed = threading.Event()
+    versions = iter(["v1", "v2"])
+    resolver = ModelVersionResolver(lambda model_id: next(versions, "v2"), refresh_interval=0.01,
+                                    on_change=lambda model_id, model_ref: refreshed.set())
+    resolver.resolve_all(["owner/model"])
+    resolver.start(["owner/model"])
+    try:
+        assert refreshed.wait(2)
+    finally:
+        resolver.stop()
+    assert resolver.pin("owner/model") == "owner/model:v2"
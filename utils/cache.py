@@ -0,0 +1,402 @@
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from utils.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with optional expiration"""
+
+    def __init__(self, max_entries: int = 1024, ttl: Optional[float] = None):
+        """
+        Initialize cache
+
+        Args:
+            max_entries (int): Maximum number of entries, the least recently used are evicted
+            ttl (Optional[float]): Seconds after which an entry expires, never when not set
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a value, None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, ttl overrides the default expiration"""
+        ttl = ttl if ttl is not None else self.ttl
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl if ttl is not None else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        """Remove a value"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all values"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class SQLiteCache(SQLiteStore):
+    """
+    Cache shared by all Gunicorn workers, stored in SQLite
+
+    Several caches can share one database, each under its own namespace.
+    Values must be JSON serializable.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cache_entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            expires_at REAL,
+            PRIMARY KEY (namespace, key)
+        );
+        CREATE INDEX IF NOT EXISTS idx_cache_entries_created ON cache_entries (namespace, created_at);
+    """
+
+    # Eviction runs once per this many writes instead of on every write
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, db_path: str, namespace: str, max_entries: int = 100000, ttl: Optional[float] = None):
+        """
+        Initialize cache
+
+        Args:
+            db_path (str): Path to the SQLite database file
+            namespace (str): Namespace separating this cache from others in the same database
+            max_entries (int): Maximum number of entries, the oldest are evicted
+            ttl (Optional[float]): Seconds after which an entry expires, never when not set
+        """
+        super().__init__(db_path)
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a value, None if it is missing or expired"""
+        row = self._connect().execute(
+            'SELECT value FROM cache_entries WHERE namespace = ? AND key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (self.namespace, key, time.time())
+        ).fetchone()
+        return json.loads(row['value']) if row else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, ttl overrides the default expiration"""
+        ttl = ttl if ttl is not None else self.ttl
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache_entries (namespace, key, value, created_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+                (self.namespace, key, json.dumps(value), now, now + ttl if ttl is not None else None)
+            )
+
+        self._writes += 1
+        if self._writes % self.PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def delete(self, key: str) -> None:
+        """Remove a value"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM cache_entries WHERE namespace = ? AND key = ?', (self.namespace, key))
+
+    def clear(self) -> None:
+        """Remove all values of the namespace"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM cache_entries WHERE namespace = ?', (self.namespace,))
+
+    def prune(self) -> int:
+        """
+        Remove expired entries and the oldest entries above max_entries
+
+        Returns:
+            int: Number of removed entries
+        """
+        with self._transaction() as conn:
+            removed = conn.execute(
+                'DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?', (self.namespace, time.time())
+            ).rowcount
+            count = conn.execute(
+                'SELECT COUNT(*) FROM cache_entries WHERE namespace = ?', (self.namespace,)
+            ).fetchone()[0]
+            if count > self.max_entries:
+                removed += conn.execute("""
+                    DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                        SELECT key FROM cache_entries WHERE namespace = ? ORDER BY created_at, rowid LIMIT ?
+                    )
+                """, (self.namespace, self.namespace, count - self.max_entries)).rowcount
+        if removed:
+            logger.info(f"Evicted {removed} entries from cache '{self.namespace}'")
+        return removed
+
+    def __len__(self) -> int:
+        return self._connect().execute(
+            'SELECT COUNT(*) FROM cache_entries WHERE namespace = ?', (self.namespace,)
+        ).fetchone()[0]
+
+class TieredCache:
+    """
+    Two-tier cache: a fast in-process LRU in front of a cache shared by all workers
+
+    Values found only in the shared tier are copied into the local one.
+    """
+
+    def __init__(self, local: LRUCache, shared: Optional[SQLiteCache] = None):
+        """
+        Initialize cache
+
+        Args:
+            local (LRUCache): In-process tier
+            shared (Optional[SQLiteCache]): Tier shared between processes
+        """
+        self.local = local
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        """Get a value from the nearest tier that has it, None on miss"""
+        value = self.local.get(key)
+        if value is not None:
+            self._count('local_hits')
+            return value
+
+        if self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                # The shared tier is an optimization, never fail the caller because of it
+                logger.warning(f"Shared cache read failed: {str(e)}")
+                value = None
+            if value is not None:
+                self.local.set(key, value)
+                self._count('shared_hits')
+                return value
+
+        self._count('misses')
+        return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value in all tiers"""
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, ttl)
+            except Exception as e:
+                logger.warning(f"Shared cache write failed: {str(e)}")
+
+    def delete(self, key: str) -> None:
+        """Remove a value from all tiers"""
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self) -> None:
+        """Remove all values from all tiers"""
+        self.local.clear()
+        if self.shared is not None:
+            self.shared.clear()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+
+    def get_stats(self) -> Dict:
+        """
+        Get hit and miss counters of this process
+
+        Returns:
+            Dict: local_hits, shared_hits, misses, hit_ratio and local_entries
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = round((lookups - stats['misses']) / lookups, 3) if lookups else None
+        stats['local_entries'] = len(self.local)
+        return stats
+
+class RefreshingCache:
+    """
+    Cache of values produced by a loader, with stale-while-revalidate refreshing
+
+    Values younger than ttl are fresh. Older values are still returned while a
+    background refresh replaces them, until they are older than max_stale and
+    expire. Concurrent loads of the same missing key are coalesced into one.
+    A loader returning None means failure: nothing is cached and a stale value
+    is kept until it expires.
+    """
+
+    def __init__(self, loader: Callable[[str], Optional[Any]], cache: TieredCache, ttl: float,
+                 max_stale: float, max_workers: int = 4):
+        """
+        Initialize cache
+
+        Args:
+            loader (Callable[[str], Optional[Any]]): Function loading the value of a key
+            cache (TieredCache): Storage of the loaded values, its tiers should expire entries after max_stale
+            ttl (float): Seconds a value is fresh
+            max_stale (float): Seconds after which a stale value is no longer served
+            max_workers (int): Threads for background refreshes and prewarming
+        """
+        self.loader = loader
+        self.cache = cache
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cache-refresh')
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._refreshing = set()
+        self._stats = {'stale_served': 0, 'loads': 0, 'load_failures': 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a value, loading it when missing and refreshing it in the background when stale
+
+        Args:
+            key (str): Key of the value
+
+        Returns:
+            Optional[Any]: The value, None if it could not be loaded
+        """
+        entry = self._get_entry(key)
+        if entry is not None:
+            if time.time() - entry['fetched_at'] > self.ttl:
+                self._count('stale_served')
+                self._schedule_refresh(key)
+            return entry['value']
+
+        # Only one thread loads a missing key, the others wait for its result
+        with self._key_lock(key):
+            entry = self._get_entry(key)
+            if entry is not None:
+                return entry['value']
+            return self._load(key)
+
+    def refresh(self, key: str) -> Optional[Any]:
+        """
+        Replace a value with a freshly loaded one
+
+        A value refreshed meanwhile by another worker is taken from the shared tier.
+
+        Args:
+            key (str): Key of the value
+
+        Returns:
+            Optional[Any]: The new value, None if loading failed
+        """
+        shared = self.cache.shared
+        if shared is not None:
+            entry = shared.get(key)
+            if entry is not None and time.time() - entry['fetched_at'] <= self.ttl:
+                self.cache.local.set(key, entry)
+                return entry['value']
+        return self._load(key)
+
+    def prewarm(self, keys: Iterable[str]) -> int:
+        """
+        Load all keys concurrently, skipping fresh ones
+
+        Args:
+            keys (Iterable[str]): Keys to load
+
+        Returns:
+            int: Number of keys available in the cache afterwards
+        """
+        futures = [self._executor.submit(self.refresh, key) for key in keys]
+        loaded = 0
+        for future in as_completed(futures):
+            try:
+                if future.result() is not None:
+                    loaded += 1
+            except Exception as e:
+                logger.error(f"Error prewarming cache: {str(e)}", exc_info=True)
+        logger.info(f"Prewarmed {loaded} of {len(futures)} cache entries")
+        return loaded
+
+    def clear(self) -> None:
+        """Remove all values"""
+        self.cache.clear()
+
+    def _get_entry(self, key: str) -> Optional[Dict]:
+        """Get the stored entry of a key unless it is older than max_stale"""
+        entry = self.cache.get(key)
+        if entry is None or time.time() - entry['fetched_at'] > self.max_stale:
+            return None
+        return entry
+
+    def _load(self, key: str) -> Optional[Any]:
+        """Load a value with the loader and store it"""
+        self._count('loads')
+        try:
+            value = self.loader(key)
+        except Exception as e:
+            logger.error(f"Error loading cache entry {key}: {str(e)}", exc_info=True)
+            value = None
+        if value is None:
+            self._count('load_failures')
+            return None
+        self.cache.set(key, {'value': value, 'fetched_at': time.time()})
+        return value
+
+    def _schedule_refresh(self, key: str) -> None:
+        """Refresh a key in the background unless a refresh is already running"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self.refresh(key)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+
+    def get_stats(self) -> Dict:
+        """
+        Get counters of this process
+
+        Returns:
+            Dict: Hit and miss counters of the tiers plus stale_served, loads and load_failures
+        """
+        stats = self.cache.get_stats()
+        with self._lock:
+            stats.update(self._stats)
+        return stats
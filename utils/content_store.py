@@ -0,0 +1,166 @@
+import os
+import logging
+from typing import Dict, Optional
+
+from utils.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+class ContentStore(SQLiteStore):
+    """
+    Content-addressed blob store with reference counting
+
+    Every distinct content is stored once as a blob named by its SHA-256.
+    Gallery files are hard links to their blob, so serving, conversion and
+    the directory layout need no changes, while identical images take the
+    disk space (and backup volume) of one. References are counted in SQLite;
+    adding and removing them runs in one transaction together with the file
+    operations, so concurrent workers never delete a blob still in use.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS blobs (
+            hash TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            refs INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS refs (
+            name TEXT PRIMARY KEY,
+            hash TEXT NOT NULL REFERENCES blobs (hash)
+        );
+        CREATE TABLE IF NOT EXISTS stats (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str, blob_path: str, extension: str = ''):
+        """
+        Initialize store
+
+        Args:
+            db_path (str): Path to the SQLite database file
+            blob_path (str): Directory of the blobs, must be on the filesystem of the linked files
+            extension (str): Extension of the blob files (e.g. ".webp")
+        """
+        super().__init__(db_path)
+        self.blob_path = blob_path
+        self.extension = extension
+        os.makedirs(blob_path, exist_ok=True)
+
+    def get_blob_path(self, digest: str) -> str:
+        """Get path of the blob of a content hash"""
+        return os.path.join(self.blob_path, digest[:2], f"{digest}{self.extension}")
+
+    def add(self, name: str, source_path: str, digest: str, link_path: str) -> bool:
+        """
+        Store a file by its content and link it into place
+
+        Args:
+            name (str): Name of the referencing file (its filename)
+            source_path (str): File to store, moved into the blob store or removed when the content exists,
+                left in place when adding fails
+            digest (str): SHA-256 of the file content
+            link_path (str): Path the content is linked to
+
+        Returns:
+            bool: True if the content was already stored (deduplicated)
+        """
+        blob = self.get_blob_path(digest)
+        moved = linked = False
+        try:
+            with self._transaction() as conn:
+                row = conn.execute('SELECT size FROM blobs WHERE hash = ?', (digest,)).fetchone()
+                deduplicated = row is not None and os.path.exists(blob)
+                if deduplicated:
+                    size = row['size']
+                else:
+                    size = os.path.getsize(source_path)
+                    os.makedirs(os.path.dirname(blob), exist_ok=True)
+                    os.replace(source_path, blob)
+                    moved = True
+                    if row is None:
+                        conn.execute('INSERT INTO blobs (hash, size, refs) VALUES (?, ?, 0)', (digest, size))
+                    else:
+                        # The blob file was lost, its existing references are linked to it again
+                        conn.execute('UPDATE blobs SET size = ? WHERE hash = ?', (size, digest))
+
+                os.makedirs(os.path.dirname(link_path), exist_ok=True)
+                os.link(blob, link_path)
+                linked = True
+                conn.execute('INSERT INTO refs (name, hash) VALUES (?, ?)', (name, digest))
+                conn.execute('UPDATE blobs SET refs = refs + 1 WHERE hash = ?', (digest,))
+                conn.execute(
+                    """
+                    INSERT INTO stats (key, value) VALUES ('ingested', 1), ('deduplicated', ?)
+                    ON CONFLICT (key) DO UPDATE SET value = value + excluded.value
+                    """,
+                    (int(deduplicated),)
+                )
+        except BaseException:
+            # The rows were rolled back, put the files back where they were
+            if linked:
+                os.remove(link_path)
+            if moved:
+                os.replace(blob, source_path)
+            raise
+
+        if deduplicated:
+            os.unlink(source_path)
+            logger.info(f"Deduplicated {name}: content {digest[:12]} already stored ({size} bytes saved)")
+        return deduplicated
+
+    def remove(self, name: str, link_path: Optional[str]) -> bool:
+        """
+        Remove a reference and the blob once nothing references it
+
+        Args:
+            name (str): Name of the referencing file
+            link_path (Optional[str]): Path of the link to remove
+
+        Returns:
+            bool: False if the name is not stored in the content store
+        """
+        with self._transaction() as conn:
+            row = conn.execute('SELECT hash FROM refs WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return False
+            digest = row['hash']
+
+            if link_path and os.path.exists(link_path):
+                os.remove(link_path)
+            conn.execute('DELETE FROM refs WHERE name = ?', (name,))
+            conn.execute('UPDATE blobs SET refs = refs - 1 WHERE hash = ?', (digest,))
+            refs = conn.execute('SELECT refs FROM blobs WHERE hash = ?', (digest,)).fetchone()['refs']
+            if refs <= 0:
+                conn.execute('DELETE FROM blobs WHERE hash = ?', (digest,))
+                blob = self.get_blob_path(digest)
+                if os.path.exists(blob):
+                    os.remove(blob)
+                logger.info(f"Removed blob {digest[:12]}, no longer referenced")
+        return True
+
+    def get_stats(self) -> Dict:
+        """
+        Get deduplication statistics
+
+        Returns:
+            Dict: Stored blobs and references, logical and physical bytes, bytes saved,
+                dedup ratio (logical / physical bytes) and ingest counters
+        """
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT COUNT(*) AS blobs, COALESCE(SUM(refs), 0) AS refs, COALESCE(SUM(size), 0) AS physical, '
+            'COALESCE(SUM(size * refs), 0) AS logical FROM blobs'
+        ).fetchone()
+        counters = {r['key']: r['value'] for r in conn.execute('SELECT key, value FROM stats')}
+        return {
+            'blobs': row['blobs'],
+            'references': row['refs'],
+            'logical_bytes': row['logical'],
+            'physical_bytes': row['physical'],
+            'bytes_saved': row['logical'] - row['physical'],
+            'dedup_ratio': round(row['logical'] / row['physical'], 3) if row['physical'] else None,
+            'ingested': counters.get('ingested', 0),
+            'deduplicated': counters.get('deduplicated', 0)
+        }
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from utils.sqlite_store import SQLiteStore
+
+try:
+    import fcntl
+except ImportError:  # Windows, conversions are then coalesced within a process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class ConversionCache(SQLiteStore):
+    """
+    Disk cache of converted images shared by all Gunicorn workers
+
+    Conversions are stored as files named by a hash of (image id, format,
+    options), so a repeated download is a plain file send. Entries are
+    tracked in SQLite and the least recently used are evicted when the
+    cache grows over its size limit. Concurrent requests for the same
+    conversion, in any worker, wait for the first one instead of converting
+    again.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS conversions (
+            key TEXT PRIMARY KEY,
+            image_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_conversions_image ON conversions (image_id);
+        CREATE INDEX IF NOT EXISTS idx_conversions_access ON conversions (last_access);
+        CREATE TABLE IF NOT EXISTS invalidations (
+            image_id TEXT PRIMARY KEY,
+            invalidated_at REAL NOT NULL
+        );
+    """
+
+    # Conversions are coalesced through this many lock files, keys share them by hash
+    LOCK_STRIPES = 64
+    # Seconds between updates of an entry's access time, saves a write on most hits
+    TOUCH_INTERVAL = 60
+    # Age in seconds after which a partial file was left by a crashed worker,
+    # also how long invalidations are remembered for conversions still running
+    PARTIAL_MAX_AGE = 3600
+
+    def __init__(self, db_path: str, cache_dir: str, max_bytes: int = 1024 ** 3):
+        """
+        Initialize cache
+
+        Args:
+            db_path (str): Path to the SQLite database file
+            cache_dir (str): Directory of the converted files
+            max_bytes (int): Total size of the files above which the least recently used are evicted
+        """
+        super().__init__(db_path)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock_dir = os.path.join(cache_dir, '.locks')
+        self._thread_locks = [threading.Lock() for _ in range(self.LOCK_STRIPES)]
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0}
+        os.makedirs(self._lock_dir, exist_ok=True)
+        self._purge_partial()
+
+    def get(self, image_id: str, format: str, options: Dict, convert: Callable[[str], None]) -> Optional[str]:
+        """
+        Get the path of a converted image, converting it on a miss
+
+        Args:
+            image_id (str): Id of the source image
+            format (str): Target format, used as the file extension
+            options (Dict): Conversion options (quality, ...), part of the key
+            convert (Callable[[str], None]): Writes the conversion to the given path
+
+        Returns:
+            Optional[str]: Path of the converted file, None if the image was invalidated while it was converted
+        """
+        key = self._key(image_id, format, options)
+        filename = f"{key}.{format}"
+        path = os.path.join(self.cache_dir, filename)
+
+        if self._lookup(key, path):
+            self._count('hits')
+            return path
+
+        with self._key_lock(key):
+            # Another request may have converted it while this one waited
+            if self._lookup(key, path):
+                self._count('coalesced')
+                return path
+
+            self._count('misses')
+            started = time.time()
+            partial_path = f"{path}.{uuid.uuid4().hex}.partial"
+            try:
+                convert(partial_path)
+                os.replace(partial_path, path)
+            finally:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+
+            with self._transaction() as conn:
+                # The image was deleted during the conversion, its invalidation found nothing to remove
+                invalidated = conn.execute(
+                    'SELECT 1 FROM invalidations WHERE image_id = ? AND invalidated_at >= ?', (image_id, started)
+                ).fetchone()
+                if invalidated:
+                    self._remove_file(filename)
+                    return None
+                conn.execute(
+                    'INSERT OR REPLACE INTO conversions (key, image_id, filename, size, last_access) VALUES (?, ?, ?, ?, ?)',
+                    (key, image_id, filename, os.path.getsize(path), time.time())
+                )
+                self._evict(conn, keep=key)
+        return path
+
+    def invalidate(self, image_id: str) -> int:
+        """
+        Remove all conversions of an image
+
+        Args:
+            image_id (str): Id of the source image
+
+        Returns:
+            int: Number of removed conversions
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            rows = conn.execute('SELECT filename FROM conversions WHERE image_id = ?', (image_id,)).fetchall()
+            conn.execute('DELETE FROM conversions WHERE image_id = ?', (image_id,))
+            # Conversions still running keep their result out of the cache
+            conn.execute('INSERT OR REPLACE INTO invalidations (image_id, invalidated_at) VALUES (?, ?)',
+                         (image_id, now))
+            conn.execute('DELETE FROM invalidations WHERE invalidated_at < ?', (now - self.PARTIAL_MAX_AGE,))
+            for row in rows:
+                self._remove_file(row['filename'])
+        if rows:
+            logger.info(f"Removed {len(rows)} cached conversions of {image_id}")
+        return len(rows)
+
+    def get_stats(self) -> Dict:
+        """Get hit counters of this process and the size of the shared cache"""
+        row = self._connect().execute(
+            'SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS size FROM conversions'
+        ).fetchone()
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(entries=row['entries'], size_bytes=row['size'], max_bytes=self.max_bytes)
+        return stats
+
+    def _lookup(self, key: str, path: str) -> bool:
+        """Check that a conversion is cached and record the access"""
+        conn = self._connect()
+        row = conn.execute('SELECT last_access FROM conversions WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return False
+        if not os.path.exists(path):
+            # Removed behind the cache's back, converted again
+            conn.execute('DELETE FROM conversions WHERE key = ?', (key,))
+            return False
+        now = time.time()
+        if now - row['last_access'] > self.TOUCH_INTERVAL:
+            conn.execute('UPDATE conversions SET last_access = ? WHERE key = ?', (now, key))
+        return True
+
+    def _evict(self, conn, keep: str) -> None:
+        """Remove the least recently used conversions until the cache fits its size limit"""
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM conversions').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for row in conn.execute(
+            'SELECT key, filename, size FROM conversions WHERE key != ? ORDER BY last_access', (keep,)
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM conversions WHERE key = ?', (row['key'],))
+            self._remove_file(row['filename'])
+            total -= row['size']
+            self._count('evictions')
+
+    def _remove_file(self, filename: str) -> None:
+        try:
+            os.remove(os.path.join(self.cache_dir, filename))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _key_lock(self, key: str) -> Iterator[None]:
+        """Hold the lock of a key against other threads and, through a lock file, other processes"""
+        stripe = int(key[:8], 16) % self.LOCK_STRIPES
+        with self._thread_locks[stripe]:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self._lock_dir, f"{stripe}.lock"), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _purge_partial(self) -> None:
+        """Remove files of conversions interrupted by a crash"""
+        cutoff = time.time() - self.PARTIAL_MAX_AGE
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if entry.name.endswith('.partial') and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+    def _count(self, counter: str) -> None:
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+    @staticmethod
+    def _key(image_id: str, format: str, options: Dict) -> str:
+        data = json.dumps([image_id, format, options], sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()[:32]
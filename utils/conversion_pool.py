@@ -0,0 +1,245 @@
+import os
+import time
+import signal
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import resource
+except ImportError:  # Windows, conversions then run without a memory limit
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+class ConversionPoolError(Exception):
+    """Base class of errors of the pool rather than of the converted image"""
+
+class ConversionPoolFull(ConversionPoolError):
+    """Raised when every worker is busy and the queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Conversion queue is full, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+class ConversionTimeout(ConversionPoolError):
+    """Raised when a conversion runs longer than the job timeout"""
+
+class ConversionWorkerLost(ConversionPoolError):
+    """Raised when the worker process of a job died (out of memory, killed)"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Conversion worker exited unexpectedly, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+class ConversionPool:
+    """
+    Runs CPU-heavy image conversions in worker processes
+
+    Decoding and encoding large images holds a core for seconds; running them
+    in the request thread stalls every other request of the Gunicorn worker.
+    Jobs are admitted up to the number of workers plus a bounded queue, the
+    rest are rejected right away so the client can retry later instead of
+    piling up. Every job runs under a timeout and the worker processes under
+    a memory limit, and time spent waiting for a worker is reported apart
+    from the conversion itself.
+    """
+
+    # Extra seconds the caller waits for a job past its own timeout, covers process startup
+    TIMEOUT_GRACE = 5
+
+    def __init__(self, workers: int, queue_size: int = 8, timeout: float = 30.0,
+                 memory_limit: int = 0, max_tasks_per_child: Optional[int] = 200):
+        """
+        Initialize pool, worker processes start with the first job
+
+        Args:
+            workers (int): Number of worker processes
+            queue_size (int): Jobs waiting for a worker before new ones are rejected
+            timeout (float): Seconds a job may run
+            memory_limit (int): Bytes a worker may allocate on top of its idle size (0 for no limit)
+            max_tasks_per_child (Optional[int]): Jobs after which a worker is replaced, returns fragmented memory
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.max_tasks_per_child = max_tasks_per_child
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._in_flight = 0
+        self._stats = {
+            'completed': 0, 'failed': 0, 'rejected': 0, 'timeouts': 0,
+            'queue_wait_seconds': 0.0, 'queue_wait_max_seconds': 0.0,
+            'encode_seconds': 0.0, 'encode_max_seconds': 0.0
+        }
+
+    def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a function in a worker process and wait for its result
+
+        Args:
+            fn (Callable): Module-level function, it is pickled to the worker
+            *args: Positional arguments of the function
+            **kwargs: Keyword arguments of the function
+
+        Returns:
+            Any: Return value of the function
+
+        Raises:
+            ConversionPoolFull: If all workers are busy and the queue is full
+            ConversionTimeout: If the job ran longer than the timeout
+            ConversionWorkerLost: If the worker process died during the job
+        """
+        if not self._slots.acquire(blocking=False):
+            self._count('rejected')
+            raise ConversionPoolFull(self._retry_after())
+
+        with self._stats_lock:
+            self._in_flight += 1
+        submitted = time.time()
+        try:
+            future = self._get_executor().submit(_run_job, fn, args, kwargs, self.timeout)
+        except BaseException as e:
+            self._release_slot()
+            if isinstance(e, BrokenProcessPool):
+                self._count('failed')
+                self._reset_executor()
+                raise ConversionWorkerLost(self._retry_after()) from e
+            raise
+        # The slot is held until the job ends, also when the caller stops waiting for it,
+        # so jobs stuck in a worker count against the queue. Whichever of the caller and
+        # the executor sees the end first releases it
+        released = threading.Lock()
+        def release(_future=None):
+            if released.acquire(blocking=False):
+                self._release_slot()
+        future.add_done_callback(release)
+
+        # Jobs ahead of this one may each run up to the timeout
+        wait = self.timeout * (self.queue_size // max(self.workers, 1) + 1) + self.TIMEOUT_GRACE
+        try:
+            try:
+                result, started, finished = future.result(timeout=wait)
+            finally:
+                if future.done():
+                    release()
+        except TimeoutError:
+            # The job is stuck in native code where the alarm in the worker cannot stop it
+            self._count('timeouts')
+            raise ConversionTimeout(f"Conversion did not finish in {wait:.0f} seconds")
+        except ConversionTimeout:
+            self._count('timeouts')
+            raise
+        except BrokenProcessPool as e:
+            # A worker was killed (out of memory, signal), later jobs get a new pool
+            self._count('failed')
+            self._reset_executor()
+            raise ConversionWorkerLost(self._retry_after()) from e
+        except Exception:
+            self._count('failed')
+            raise
+
+        queue_wait = max(0.0, started - submitted)
+        encode = finished - started
+        with self._stats_lock:
+            self._stats['completed'] += 1
+            self._stats['queue_wait_seconds'] += queue_wait
+            self._stats['queue_wait_max_seconds'] = max(self._stats['queue_wait_max_seconds'], queue_wait)
+            self._stats['encode_seconds'] += encode
+            self._stats['encode_max_seconds'] = max(self._stats['encode_max_seconds'], encode)
+        return result
+
+    def get_stats(self) -> Dict:
+        """
+        Get job counters and timings of this process
+
+        Returns:
+            Dict: Job counts, jobs in flight, and total, average and maximum seconds waiting and converting
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = self._in_flight
+        completed = stats['completed']
+        stats.update(
+            workers=self.workers,
+            queue_size=self.queue_size,
+            queue_wait_avg_seconds=stats['queue_wait_seconds'] / completed if completed else 0.0,
+            encode_avg_seconds=stats['encode_seconds'] / completed if completed else 0.0
+        )
+        return stats
+
+    def shutdown(self) -> None:
+        """Stop the worker processes"""
+        self._reset_executor()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # Forked workers would inherit the locks of the request threads, forkserver
+                # starts them from a clean process
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context(method),
+                    initializer=_init_worker, initargs=(self.memory_limit,),
+                    max_tasks_per_child=self.max_tasks_per_child
+                )
+                logger.info(f"Started conversion pool with {self.workers} workers")
+            return self._executor
+
+    def _reset_executor(self) -> None:
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release_slot(self) -> None:
+        with self._stats_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _retry_after(self) -> int:
+        """Estimate the seconds until a slot frees up from the average conversion time"""
+        with self._stats_lock:
+            completed = self._stats['completed']
+            average = self._stats['encode_seconds'] / completed if completed else 1.0
+        return max(1, round(average * (self.queue_size + self.workers) / max(self.workers, 1)))
+
+    def _count(self, counter: str) -> None:
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+def _init_worker(memory_limit: int) -> None:
+    """Limit the address space of a worker process to its idle size plus the memory limit"""
+    if not memory_limit or resource is None:
+        return
+    try:
+        with open('/proc/self/statm') as f:
+            idle_size = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        idle_size = 0
+    limit = idle_size + memory_limit
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _on_timeout(signum, frame):
+    raise ConversionTimeout("Conversion timed out")
+
+def _run_job(fn: Callable, args: tuple, kwargs: dict, timeout: float):
+    """Run a job in the worker, returns its result with the start and end time"""
+    started = time.time()
+    timeout = timeout if hasattr(signal, 'SIGALRM') else 0
+    if timeout:
+        # Pillow decodes and encodes in chunks, the alarm interrupts it between them
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return result, started, time.time()
@@ -1,20 +1,139 @@
 import os
 import tempfile
 import logging
-from typing import Optional, Tuple
+from typing import BinaryIO, Optional, Tuple
 from PIL import Image
 import time
 import threading
 from datetime import datetime, timedelta
 
+from utils.conversion_pool import ConversionPool, ConversionPoolError
+
+try:
+    import pillow_avif  # noqa: F401  Registers AVIF with Pillow versions without native support
+except ImportError:
+    pass
+
 logger = logging.getLogger(__name__)
 
+def _flatten(img: Image.Image) -> Image.Image:
+    """Convert to RGB, compositing transparent images onto white"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # Create white background for transparent images
+        rgb_img = Image.new('RGB', img.size, (255, 255, 255))
+        if img.mode == 'P':
+            img = img.convert('RGBA')
+        rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
+        return rgb_img
+    elif img.mode != 'RGB':
+        return img.convert('RGB')
+    return img
+
+def encode_file(source_path: str, dest_path, format: str, **save_options) -> None:
+    """
+    Convert an image file, flattening transparency onto white
+
+    Module-level so it can run in a worker process of the conversion pool.
+
+    Args:
+        source_path: Path to source image file
+        dest_path: Path or file object the converted image is written to
+        format: Pillow format name ('JPEG', 'PNG')
+        **save_options: Encoder options passed to Image.save
+    """
+    with Image.open(source_path) as img:
+        # Convert to RGB if necessary (removes transparency)
+        _flatten(img).save(dest_path, format, **save_options)
+
+def transform_file(source_path: str, dest_path, format: str, width: Optional[int] = None,
+                   height: Optional[int] = None, fit: str = 'contain', **save_options) -> None:
+    """
+    Resize and convert an image file
+
+    JPEG sources are decoded at a reduced scale (draft mode) and the resize
+    starts with an integer box reduction, so downscaling costs little more
+    than decoding the small result. Images are never upscaled, except by
+    fit='fill' which stretches to the exact size.
+
+    Args:
+        source_path: Path to source image file
+        dest_path: Path or file object the result is written to
+        format: Pillow format name ('JPEG', 'PNG', 'WEBP', 'AVIF')
+        width: Maximum width (None to follow the height)
+        height: Maximum height (None to follow the width)
+        fit: 'contain' fits inside the box, 'cover' fills it and crops the overflow, 'fill' stretches
+        **save_options: Encoder options passed to Image.save
+    """
+    with Image.open(source_path) as img:
+        size, crop = _fit_size(img.size, width, height, fit)
+        has_alpha = 'A' in img.getbands() or 'transparency' in img.info
+        if format == 'JPEG' or not has_alpha:
+            img.draft('RGB', size)
+            current = _flatten(img)
+        else:
+            current = img.convert('RGBA')
+
+        if current.size != size:
+            current = current.resize(size, Image.LANCZOS, reducing_gap=2.0)
+        if crop is not None:
+            current = current.crop(crop)
+        current.save(dest_path, format, **save_options)
+
+def _fit_size(size: Tuple[int, int], width: Optional[int], height: Optional[int],
+              fit: str) -> Tuple[Tuple[int, int], Optional[Tuple[int, int, int, int]]]:
+    """Size to resize an image to and the box to crop from the result"""
+    source_width, source_height = size
+    if fit == 'fill':
+        return (width or source_width, height or source_height), None
+
+    scales = [scale for scale in (width and width / source_width, height and height / source_height) if scale]
+    if not scales:
+        return size, None
+    scale = min(max(scales) if fit == 'cover' else min(scales), 1.0)
+    resized = (max(1, round(source_width * scale)), max(1, round(source_height * scale)))
+    if fit != 'cover' or not (width and height):
+        return resized, None
+
+    crop_width, crop_height = min(width, resized[0]), min(height, resized[1])
+    left, top = (resized[0] - crop_width) // 2, (resized[1] - crop_height) // 2
+    return resized, (left, top, left + crop_width, top + crop_height)
+
+class _WriteOnlyFile:
+    """
+    Wrapper hiding fileno() of a spooled file
+
+    Pillow writes straight to the file descriptor when a file has one, and
+    asking a SpooledTemporaryFile for it moves the data to disk.
+    """
+
+    def __init__(self, file):
+        self.write = file.write
+        self.tell = file.tell
+        self.seek = file.seek
+        self.flush = file.flush
+
 class ImageConverter:
     """
     Handles image format conversion with temporary file management
     """
+
+    # Pillow format and encoder options of the target formats
+    FORMATS = {
+        'jpg': ('JPEG', {'optimize': True}),
+        'png': ('PNG', {'optimize': True})
+    }
+    # Name prefix of the files pool workers convert into, stale ones are removed by cleanup_old_files
+    PARTIAL_PREFIX = 'conversion-'
+    # Pillow format and media type of the transform formats
+    TRANSFORM_FORMATS = {
+        'jpg': ('JPEG', 'image/jpeg'),
+        'png': ('PNG', 'image/png'),
+        'webp': ('WEBP', 'image/webp'),
+        'avif': ('AVIF', 'image/avif')
+    }
     
-    def __init__(self, temp_dir: Optional[str] = None, cleanup_interval: int = 3600, max_age: int = 7200):
+    def __init__(self, temp_dir: Optional[str] = None, cleanup_interval: int = 3600, max_age: int = 7200,
+                 pool: Optional[ConversionPool] = None, spool_max_size: int = 8 * 1024 * 1024):
         """
         Initialize image converter
         
@@ -22,8 +141,12 @@ class ImageConverter:
             temp_dir: Directory for temporary files (None for system temp)
             cleanup_interval: Cleanup interval in seconds (default: 1 hour)
             max_age: Maximum age of temp files in seconds (default: 2 hours)
+            pool: Worker processes for decoding and encoding (None to convert in the calling thread)
+            spool_max_size: Bytes of a buffered conversion kept in memory before it moves to an unnamed file
         """
         self.temp_dir = temp_dir or tempfile.gettempdir()
+        self.pool = pool
+        self.spool_max_size = spool_max_size
         self.cleanup_interval = cleanup_interval
         self.max_age = max_age
         self.temp_files = {}  # Track temporary files with timestamps
@@ -37,7 +160,7 @@ class ImageConverter:
         
         logger.info(f"ImageConverter initialized with temp_dir: {self.temp_dir}")
     
-    def convert_to_jpg(self, source_path: str, quality: int = 90) -> str:
+    def convert_to_jpg(self, source_path: str, quality: int = 90, dest_path: Optional[str] = None) -> str:
         """
         Convert image to JPEG format
         
@@ -50,34 +173,26 @@ class ImageConverter:
             
         Raises:
             ValueError: If source file doesn't exist or conversion fails
+            ConversionPoolError: If the pool could not run the conversion (queue full, timeout, worker died)
             OSError: If file operations fail
         """
         if not os.path.exists(source_path):
             raise ValueError(f"Source file does not exist: {source_path}")
         
         try:
-            # Generate temporary filename
-            temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg', dir=self.temp_dir)
-            os.close(temp_fd)  # Close file descriptor, we'll use PIL to write
-            
-            # Open and convert image
-            with Image.open(source_path) as img:
-                # Convert to RGB if necessary (removes transparency)
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    # Create white background for transparent images
-                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                    img = rgb_img
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Save as JPEG with specified quality
-                img.save(temp_path, 'JPEG', quality=quality, optimize=True)
-            
-            # Track temporary file
-            self._track_temp_file(temp_path)
+            if dest_path is not None:
+                temp_path = dest_path
+            else:
+                # Generate temporary filename
+                temp_fd, temp_path = tempfile.mkstemp(suffix='.jpg', dir=self.temp_dir)
+                os.close(temp_fd)  # Close file descriptor, we'll use PIL to write
+            
+            # Decode and encode in a worker process when a pool is configured
+            self._encode(source_path, temp_path, 'JPEG', quality=quality, optimize=True)
+            
+            # Track temporary file, files written to dest_path belong to the caller
+            if dest_path is None:
+                self._track_temp_file(temp_path)
             
             logger.info(f"Converted {source_path} to JPEG: {temp_path}")
             return temp_path
@@ -89,49 +204,44 @@ class ImageConverter:
                     os.unlink(temp_path)
                 except OSError:
                     pass
+            if isinstance(e, ConversionPoolError):
+                raise e
             logger.error(f"Failed to convert {source_path} to JPEG: {str(e)}")
             raise ValueError(f"Image conversion to JPEG failed: {str(e)}")
     
-    def convert_to_png(self, source_path: str) -> str:
+    def convert_to_png(self, source_path: str, dest_path: Optional[str] = None) -> str:
         """
         Convert image to PNG format without transparency
         
         Args:
             source_path: Path to source image file
+            dest_path: Path to write the converted file to (None for a tracked temporary file)
             
         Returns:
-            Path to converted temporary file
+            Path to converted file
             
         Raises:
             ValueError: If source file doesn't exist or conversion fails
+            ConversionPoolError: If the pool could not run the conversion (queue full, timeout, worker died)
             OSError: If file operations fail
         """
         if not os.path.exists(source_path):
             raise ValueError(f"Source file does not exist: {source_path}")
         
         try:
-            # Generate temporary filename
-            temp_fd, temp_path = tempfile.mkstemp(suffix='.png', dir=self.temp_dir)
-            os.close(temp_fd)  # Close file descriptor, we'll use PIL to write
-            
-            # Open and convert image
-            with Image.open(source_path) as img:
-                # Convert to RGB (removes transparency)
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    # Create white background for transparent images
-                    rgb_img = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    rgb_img.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                    img = rgb_img
-                elif img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Save as PNG
-                img.save(temp_path, 'PNG', optimize=True)
-            
-            # Track temporary file
-            self._track_temp_file(temp_path)
+            if dest_path is not None:
+                temp_path = dest_path
+            else:
+                # Generate temporary filename
+                temp_fd, temp_path = tempfile.mkstemp(suffix='.png', dir=self.temp_dir)
+                os.close(temp_fd)  # Close file descriptor, we'll use PIL to write
+            
+            # Decode and encode in a worker process when a pool is configured
+            self._encode(source_path, temp_path, 'PNG', optimize=True)
+            
+            # Track temporary file, files written to dest_path belong to the caller
+            if dest_path is None:
+                self._track_temp_file(temp_path)
             
             logger.info(f"Converted {source_path} to PNG: {temp_path}")
             return temp_path
@@ -143,9 +253,132 @@ class ImageConverter:
                     os.unlink(temp_path)
                 except OSError:
                     pass
+            if isinstance(e, ConversionPoolError):
+                raise e
             logger.error(f"Failed to convert {source_path} to PNG: {str(e)}")
             raise ValueError(f"Image conversion to PNG failed: {str(e)}")
     
+    def convert_to_buffer(self, source_path: str, format: str, quality: int = 90) -> BinaryIO:
+        """
+        Convert image into a buffer that is never left on disk
+        
+        The buffer stays in memory up to spool_max_size; larger conversions
+        move to an unnamed temporary file, removed by the system when the
+        buffer is closed, even if the process dies. Conversions in the pool
+        are always returned as an unlinked temporary file.
+        
+        Args:
+            source_path: Path to source image file
+            format: Target format ('jpg' or 'png')
+            quality: JPEG quality (1-100, default: 90)
+            
+        Returns:
+            Buffer positioned at the start of the converted image, the caller closes it
+            
+        Raises:
+            ValueError: If source file doesn't exist, the format is unknown or conversion fails
+            ConversionPoolError: If the pool could not run the conversion (queue full, timeout, worker died)
+        """
+        if not os.path.exists(source_path):
+            raise ValueError(f"Source file does not exist: {source_path}")
+        if format not in self.FORMATS:
+            raise ValueError(f"Unsupported format: {format}")
+        
+        pil_format, save_options = self.FORMATS[format]
+        if pil_format == 'JPEG':
+            save_options = dict(save_options, quality=quality)
+        
+        return self._to_buffer(encode_file, source_path, pil_format, **save_options)
+    
+    def supports_transform_format(self, format: str) -> bool:
+        """Check that Pillow can write a transform format, AVIF needs Pillow 11.3 or pillow-avif-plugin"""
+        if format not in self.TRANSFORM_FORMATS:
+            return False
+        Image.init()
+        return self.TRANSFORM_FORMATS[format][0] in Image.SAVE
+    
+    def transform(self, source_path: str, format: str, width: Optional[int] = None, height: Optional[int] = None,
+                  fit: str = 'contain', quality: int = 85, dest_path: Optional[str] = None):
+        """
+        Resize and convert image
+        
+        Args:
+            source_path: Path to source image file
+            format: Target format ('jpg', 'png', 'webp' or 'avif')
+            width: Maximum width (None to follow the height)
+            height: Maximum height (None to follow the width)
+            fit: 'contain', 'cover' or 'fill'
+            quality: Encoder quality (1-100, ignored for PNG)
+            dest_path: Path to write the result to (None for a spooled buffer, see convert_to_buffer)
+            
+        Returns:
+            dest_path, or a buffer positioned at the start of the result that the caller closes
+            
+        Raises:
+            ValueError: If source file doesn't exist, the format is not supported or the transform fails
+            ConversionPoolError: If the pool could not run the transform (queue full, timeout, worker died)
+        """
+        if not os.path.exists(source_path):
+            raise ValueError(f"Source file does not exist: {source_path}")
+        if not self.supports_transform_format(format):
+            raise ValueError(f"Unsupported format: {format}")
+        
+        pil_format = self.TRANSFORM_FORMATS[format][0]
+        options = {'width': width, 'height': height, 'fit': fit}
+        if pil_format == 'PNG':
+            options['optimize'] = True
+        else:
+            options['quality'] = quality
+        if pil_format == 'WEBP':
+            options['method'] = 4
+        
+        if dest_path is None:
+            return self._to_buffer(transform_file, source_path, pil_format, **options)
+        try:
+            self._encode(source_path, dest_path, pil_format, encode=transform_file, **options)
+            logger.info(f"Transformed {source_path} to {pil_format}: {dest_path}")
+            return dest_path
+        except Exception as e:
+            if isinstance(e, ConversionPoolError):
+                raise e
+            logger.error(f"Failed to transform {source_path} to {pil_format}: {str(e)}")
+            raise ValueError(f"Image transform to {pil_format} failed: {str(e)}")
+    
+    def _to_buffer(self, encode, source_path: str, pil_format: str, **options) -> BinaryIO:
+        """Run encode_file or transform_file into a spooled buffer, or into an unlinked file in the pool"""
+        if self.pool is not None:
+            # The worker writes to a file that is unlinked once it is done, and the open
+            # file is the buffer; the image is written once and never held in memory
+            fd, path = tempfile.mkstemp(prefix=self.PARTIAL_PREFIX, suffix='.partial', dir=self.temp_dir)
+            buffer = os.fdopen(fd, 'rb')
+        else:
+            buffer = tempfile.SpooledTemporaryFile(max_size=self.spool_max_size, dir=self.temp_dir)
+        try:
+            if self.pool is not None:
+                try:
+                    self.pool.run(encode, source_path, path, pil_format, **options)
+                finally:
+                    os.unlink(path)
+            else:
+                encode(source_path, _WriteOnlyFile(buffer), pil_format, **options)
+            buffer.seek(0)
+            logger.info(f"Converted {source_path} to {pil_format} in a buffer")
+            return buffer
+            
+        except Exception as e:
+            buffer.close()
+            if isinstance(e, ConversionPoolError):
+                raise e
+            logger.error(f"Failed to convert {source_path} to {pil_format}: {str(e)}")
+            raise ValueError(f"Image conversion to {pil_format} failed: {str(e)}")
+    
+    def _encode(self, source_path: str, dest_path: str, format: str, encode=encode_file, **options) -> None:
+        """Run the conversion in the pool, or inline without one"""
+        if self.pool is not None:
+            self.pool.run(encode, source_path, dest_path, format, **options)
+        else:
+            encode(source_path, dest_path, format, **options)
+    
     def _track_temp_file(self, file_path: str) -> None:
         """Track temporary file with timestamp"""
         with self._cleanup_lock:
@@ -193,6 +426,16 @@ class ImageConverter:
             # Remove from tracking
             for file_path in files_to_remove:
                 del self.temp_files[file_path]
+            
+            # Files of pool conversions whose request process was killed before unlinking them
+            for entry in os.scandir(self.temp_dir):
+                try:
+                    if (entry.name.startswith(self.PARTIAL_PREFIX) and entry.name.endswith('.partial')
+                            and current_time - entry.stat().st_mtime > self.max_age):
+                        os.unlink(entry.path)
+                        cleaned_count += 1
+                except OSError:
+                    pass
         
         if cleaned_count > 0:
             logger.info(f"Cleaned up {cleaned_count} old temporary files")
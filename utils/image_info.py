@@ -0,0 +1,64 @@
+import os
+import io
+import base64
+import logging
+from typing import Dict, Optional
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Width of the inline placeholder, a few hundred bytes as WebP
+LQIP_WIDTH = 16
+LQIP_QUALITY = 30
+# Colors the preview is reduced to when looking for the dominant one
+DOMINANT_COLORS = 8
+
+def read_image_info(image_path: str, preview_path: Optional[str] = None) -> Dict:
+    """
+    Describe an image for the gallery without sending it to the browser
+
+    Dimensions are read from the file header only. The dominant color and the
+    inline placeholder come from a small preview (the blurred thumbnail); the
+    image itself is decoded at a reduced scale only when there is none.
+
+    Args:
+        image_path (str): Path to the image
+        preview_path (Optional[str]): Path to a small variant of the image
+
+    Returns:
+        Dict: width, height, file_size (bytes), dominant_color ("#rrggbb") and lqip (data URI of a tiny WebP)
+    """
+    with Image.open(image_path) as img:
+        # Opening reads only the header, pixels are decoded on first access
+        width, height = img.size
+        info = {'width': width, 'height': height, 'file_size': os.path.getsize(image_path)}
+        if preview_path is None:
+            preview = _load_preview(img)
+
+    if preview_path is not None:
+        with Image.open(preview_path) as img:
+            preview = _load_preview(img)
+
+    info['dominant_color'] = _dominant_color(preview)
+    info['lqip'] = _lqip(preview)
+    return info
+
+def _load_preview(img: Image.Image) -> Image.Image:
+    """Decode an image at the size of the inline placeholder"""
+    img.draft('RGB', (LQIP_WIDTH * 4, LQIP_WIDTH * 4))
+    preview = img.convert('RGB')
+    height = max(1, round(preview.height * LQIP_WIDTH / preview.width))
+    return preview.resize((LQIP_WIDTH, height), Image.BILINEAR, reducing_gap=2.0)
+
+def _dominant_color(preview: Image.Image) -> str:
+    """Most frequent color of the preview reduced to a small palette"""
+    quantized = preview.quantize(colors=DOMINANT_COLORS)
+    _, index = max(quantized.getcolors())
+    r, g, b = quantized.getpalette()[index * 3:index * 3 + 3]
+    return f"#{r:02x}{g:02x}{b:02x}"
+
+def _lqip(preview: Image.Image) -> str:
+    """Encode the preview as an inline image, shown blurred until the thumbnail loads"""
+    buffer = io.BytesIO()
+    preview.save(buffer, 'WEBP', quality=LQIP_QUALITY)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
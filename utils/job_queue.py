@@ -0,0 +1,545 @@
+import json
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+class JobError(Exception):
+    """Job failure with a message that is safe to show to the user"""
+    pass
+
+class JobQueue(SQLiteStore):
+    """
+    Persistent queue of background jobs stored in SQLite
+
+    Jobs survive process restarts: queued jobs simply wait in the database and
+    running jobs hold a lease that is taken over by another worker once it expires.
+    Waiting jobs are parked until an external event (a webhook) is delivered,
+    which queues them again with the event attached; if it never arrives their
+    lease expires and a worker picks them up again.
+    """
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    WAITING = 'waiting'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            timings TEXT NOT NULL DEFAULT '{}',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker_id TEXT,
+            external_id TEXT,
+            delivery TEXT,
+            batch_id TEXT,
+            lease_expires_at REAL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON jobs (status, created_at);
+    """
+
+    # Indexes on migrated columns, created after the migrations ran
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_jobs_batch ON jobs (batch_id, status);
+    """
+
+    # Columns added after the first release, created on databases that predate them
+    MIGRATIONS = {
+        'external_id': "ALTER TABLE jobs ADD COLUMN external_id TEXT",
+        'batch_id': "ALTER TABLE jobs ADD COLUMN batch_id TEXT",
+        'delivery': "ALTER TABLE jobs ADD COLUMN delivery TEXT",
+    }
+
+    def __init__(self, db_path: str, lease_seconds: int = 900, max_attempts: int = 3,
+                 batch_concurrency: int = 4):
+        """
+        Initialize job queue
+
+        Args:
+            db_path (str): Path to the SQLite database file
+            lease_seconds (int): How long a running job is reserved for its worker
+            max_attempts (int): How many times an abandoned job is retried before it fails
+            batch_concurrency (int): Maximum number of jobs of one batch in flight at once
+        """
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.batch_concurrency = batch_concurrency
+        super().__init__(db_path)
+
+        with self._transaction() as conn:
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+            for column, statement in self.MIGRATIONS.items():
+                if column not in columns:
+                    conn.execute(statement)
+        self._connect().executescript(self.INDEXES)
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], batch_id: Optional[str] = None) -> str:
+        """
+        Add a new job to the queue
+
+        Args:
+            kind (str): Job type used to pick the handler
+            payload (Dict[str, Any]): JSON-serializable job input
+            batch_id (str, optional): Batch the job belongs to
+
+        Returns:
+            str: ID of the new job
+        """
+        return self.enqueue_many(kind, [payload], batch_id)[0]
+
+    def enqueue_many(self, kind: str, payloads: List[Dict[str, Any]], batch_id: Optional[str] = None) -> List[str]:
+        """
+        Add several jobs to the queue in one transaction
+
+        Args:
+            kind (str): Job type used to pick the handler
+            payloads (List[Dict[str, Any]]): JSON-serializable input of each job
+            batch_id (str, optional): Batch the jobs belong to
+
+        Returns:
+            List[str]: IDs of the new jobs in payload order
+        """
+        job_ids = [str(uuid.uuid4()) for _ in payloads]
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO jobs (id, kind, status, payload, batch_id, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, kind, self.QUEUED, json.dumps(payload), batch_id, now)
+                 for job_id, payload in zip(job_ids, payloads)]
+            )
+        logger.info(f"Enqueued {len(job_ids)} {kind} jobs" + (f" in batch {batch_id}" if batch_id else ""))
+        return job_ids
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Reserve the oldest available job for a worker
+
+        Available jobs are queued ones, running ones whose lease has expired
+        because their worker died and waiting ones whose external event is overdue.
+        Queued jobs of a batch are skipped while the batch already has
+        batch_concurrency jobs in flight.
+
+        Args:
+            worker_id (str): Identifier of the claiming worker
+
+        Returns:
+            Optional[Dict[str, Any]]: Claimed job or None if the queue is empty
+        """
+        while True:
+            now = time.time()
+            with self._transaction() as conn:
+                row = conn.execute(
+                    """SELECT * FROM jobs AS job
+                       WHERE (status = ? AND (batch_id IS NULL OR (
+                                  SELECT COUNT(*) FROM jobs AS sibling
+                                  WHERE sibling.batch_id = job.batch_id AND sibling.status IN (?, ?)
+                              ) < ?))
+                          OR (status IN (?, ?) AND lease_expires_at < ?)
+                       ORDER BY created_at, rowid LIMIT 1""",
+                    (self.QUEUED, self.RUNNING, self.WAITING, self.batch_concurrency,
+                     self.RUNNING, self.WAITING, now)
+                ).fetchone()
+                if row is None:
+                    return None
+
+                if row['attempts'] >= self.max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL WHERE id = ?",
+                        (self.FAILED, 'Job was abandoned too many times', now, row['id'])
+                    )
+                    logger.error(f"Job {row['id']} failed after {row['attempts']} abandoned attempts")
+                    continue
+
+                if row['status'] == self.RUNNING:
+                    logger.warning(f"Reclaiming job {row['id']} abandoned by worker {row['worker_id']}")
+                elif row['status'] == self.WAITING:
+                    logger.warning(f"Reclaiming job {row['id']} still waiting for {row['external_id']}")
+
+                conn.execute(
+                    """UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1,
+                           lease_expires_at = ?, started_at = COALESCE(started_at, ?),
+                           timings = json_set(timings, '$.queue_wait',
+                                              COALESCE(json_extract(timings, '$.queue_wait'), ?))
+                       WHERE id = ?""",
+                    (self.RUNNING, worker_id, now + self.lease_seconds, now,
+                     round(now - row['created_at'], 3), row['id'])
+                )
+                return self.get(row['id'])
+
+    def heartbeat(self, job_id: str) -> None:
+        """Extend the lease of a running job"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = ?",
+                (time.time() + self.lease_seconds, job_id, self.RUNNING)
+            )
+
+    def suspend(self, job_id: str, external_id: str, timeout: float, payload: Dict[str, Any]) -> None:
+        """
+        Park a running job until an external event is delivered
+
+        Args:
+            job_id (str): ID of the running job
+            external_id (str): ID of the external operation the job waits for
+            timeout (float): Seconds to wait before a worker takes the job over
+            payload (Dict[str, Any]): Updated job payload needed to finish the job
+        """
+        with self._transaction() as conn:
+            row = conn.execute("SELECT delivery FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            delivery = json.loads(row['delivery']) if row and row['delivery'] else None
+            if delivery is not None and delivery['external_id'] == external_id:
+                # The event arrived before the job was parked, queue it right away
+                conn.execute(
+                    """UPDATE jobs SET status = ?, external_id = ?, payload = ?, worker_id = NULL,
+                           lease_expires_at = NULL, attempts = MAX(attempts - 1, 0) WHERE id = ?""",
+                    (self.QUEUED, external_id, json.dumps(payload), job_id)
+                )
+                logger.info(f"Job {job_id} received {external_id} before waiting, queued again")
+                return
+            conn.execute(
+                """UPDATE jobs SET status = ?, external_id = ?, payload = ?, worker_id = NULL,
+                       lease_expires_at = ? WHERE id = ?""",
+                (self.WAITING, external_id, json.dumps(payload), time.time() + timeout, job_id)
+            )
+        logger.info(f"Job {job_id} is waiting for {external_id}")
+
+    def deliver(self, job_id: str, external_id: str, data: Dict[str, Any]) -> bool:
+        """
+        Attach an external event to the job waiting for it and queue the job again
+
+        The caller only records the event, a worker finishes the job. An event
+        arriving before the job is parked is kept for suspend(). Duplicate
+        deliveries are ignored.
+
+        Args:
+            job_id (str): ID of the job
+            external_id (str): ID of the external operation the event belongs to
+            data (Dict[str, Any]): JSON-serializable event, available to the handler as job['delivery']['data']
+
+        Returns:
+            bool: True if the event was recorded, False if the job is not waiting for it
+        """
+        delivery = json.dumps({'external_id': external_id, 'data': data, 'received_at': time.time()})
+        with self._transaction() as conn:
+            # The waiting attempt continues, a worker taking it over does not count as a retry
+            cursor = conn.execute(
+                """UPDATE jobs SET status = ?, delivery = ?, worker_id = NULL, lease_expires_at = NULL,
+                       attempts = MAX(attempts - 1, 0)
+                   WHERE id = ? AND status = ? AND external_id = ?""",
+                (self.QUEUED, delivery, job_id, self.WAITING, external_id)
+            )
+            if cursor.rowcount == 0:
+                cursor = conn.execute(
+                    "UPDATE jobs SET delivery = ? WHERE id = ? AND status = ? AND external_id IS NULL AND delivery IS NULL",
+                    (delivery, job_id, self.RUNNING)
+                )
+            return cursor.rowcount > 0
+
+    def record_stage(self, job_id: str, stage: str, seconds: float) -> None:
+        """Store the duration of one processing stage of a job"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET timings = json_set(timings, ?, ?) WHERE id = ?",
+                (f'$.{stage}', round(seconds, 3), job_id)
+            )
+
+    def complete(self, job_id: str, result: Dict[str, Any]) -> None:
+        """Mark a job as succeeded"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, finished_at = ?, lease_expires_at = NULL WHERE id = ?",
+                (self.SUCCEEDED, json.dumps(result), time.time(), job_id)
+            )
+        logger.info(f"Job succeeded: {job_id}")
+
+    def fail(self, job_id: str, error: str) -> None:
+        """Mark a job as failed"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ?, lease_expires_at = NULL WHERE id = ?",
+                (self.FAILED, error, time.time(), job_id)
+            )
+        logger.warning(f"Job failed: {job_id} ({error})")
+
+    def requeue_orphaned(self, hostname: str) -> int:
+        """
+        Return running jobs of dead worker processes on this host to the queue
+
+        This makes jobs interrupted by a worker restart resume immediately
+        instead of waiting for their lease to expire.
+
+        Args:
+            hostname (str): Host name part of the worker IDs to check
+
+        Returns:
+            int: Number of requeued jobs
+        """
+        requeued = 0
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, worker_id FROM jobs WHERE status = ? AND worker_id LIKE ?",
+                (self.RUNNING, f"{hostname}:%")
+            ).fetchall()
+            for row in rows:
+                try:
+                    pid = int(row['worker_id'].split(':')[1])
+                except (IndexError, ValueError):
+                    continue
+                if _process_alive(pid):
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_id = NULL, lease_expires_at = NULL WHERE id = ?",
+                    (self.QUEUED, row['id'])
+                )
+                requeued += 1
+
+        if requeued:
+            logger.warning(f"Requeued {requeued} jobs orphaned by a worker restart")
+        return requeued
+
+    def list_batch(self, batch_id: str) -> List[Dict[str, Any]]:
+        """Get all jobs of a batch in creation order"""
+        rows = self._connect().execute(
+            "SELECT id FROM jobs WHERE batch_id = ? ORDER BY created_at, rowid", (batch_id,)
+        ).fetchall()
+        return [self.get(row['id']) for row in rows]
+
+    def purge_finished(self, max_age: float) -> int:
+        """Delete finished jobs older than max_age seconds"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (self.SUCCEEDED, self.FAILED, time.time() - max_age)
+            )
+        return cursor.rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job by ID
+
+        Returns:
+            Optional[Dict[str, Any]]: Job data or None if the job does not exist
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = {
+            'job_id': row['id'],
+            'kind': row['kind'],
+            'status': row['status'],
+            'payload': json.loads(row['payload']),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error'],
+            'timings': json.loads(row['timings']),
+            'attempts': row['attempts'],
+            'external_id': row['external_id'],
+            'delivery': json.loads(row['delivery']) if row['delivery'] else None,
+            'batch_id': row['batch_id'],
+            'created_at': row['created_at'],
+            'started_at': row['started_at'],
+            'finished_at': row['finished_at'],
+        }
+        if row['status'] == self.QUEUED:
+            job['queue_position'] = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < ?",
+                (self.QUEUED, row['created_at'])
+            ).fetchone()[0] + 1
+        return job
+
+    def get_stats(self, sample_size: int = 100) -> Dict[str, Any]:
+        """
+        Get queue depth and average stage timings
+
+        Args:
+            sample_size (int): Number of recent successful jobs to average timings over
+
+        Returns:
+            Dictionary with queue statistics
+        """
+        conn = self._connect()
+        counts = {row['status']: row['count'] for row in conn.execute(
+            "SELECT status, COUNT(*) AS count FROM jobs GROUP BY status"
+        )}
+        oldest_queued = conn.execute(
+            "SELECT MIN(created_at) FROM jobs WHERE status = ?", (self.QUEUED,)
+        ).fetchone()[0]
+
+        # Stages are averaged over the jobs that ran them, English prompts skip translate
+        totals: Dict[str, float] = {}
+        stage_counts: Dict[str, int] = {}
+        samples = conn.execute(
+            "SELECT timings FROM jobs WHERE status = ? ORDER BY finished_at DESC LIMIT ?",
+            (self.SUCCEEDED, sample_size)
+        ).fetchall()
+        for row in samples:
+            for stage, seconds in json.loads(row['timings']).items():
+                totals[stage] = totals.get(stage, 0.0) + seconds
+                stage_counts[stage] = stage_counts.get(stage, 0) + 1
+
+        return {
+            'queue_depth': counts.get(self.QUEUED, 0),
+            'running': counts.get(self.RUNNING, 0),
+            'waiting': counts.get(self.WAITING, 0),
+            'succeeded': counts.get(self.SUCCEEDED, 0),
+            'failed': counts.get(self.FAILED, 0),
+            'oldest_queued_age_seconds': round(time.time() - oldest_queued, 3) if oldest_queued else 0,
+            'avg_stage_seconds': {stage: round(total / stage_counts[stage], 3) for stage, total in totals.items()},
+        }
+
+class JobContext:
+    """Handle given to job handlers for timing stages of the job"""
+
+    def __init__(self, queue: JobQueue, job: Dict[str, Any]):
+        """Initialize context for a claimed job"""
+        self.queue = queue
+        self.job = job
+        self.job_id = job['job_id']
+        self.payload = job['payload']
+        self.suspended = False
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time a processing stage and renew the job lease before it starts"""
+        self.queue.heartbeat(self.job_id)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.queue.record_stage(self.job_id, name, time.monotonic() - start)
+
+    def suspend(self, external_id: str, timeout: float, payload: Dict[str, Any]) -> None:
+        """Release the worker and leave the job waiting for an external event"""
+        self.queue.suspend(self.job_id, external_id, timeout, payload)
+        self.suspended = True
+
+class JobWorkerPool:
+    """Bounded pool of threads processing jobs from a JobQueue"""
+
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Callable[[JobContext], Optional[Dict[str, Any]]]],
+                 workers: int = 2, poll_interval: float = 1.0, retention: float = 7 * 24 * 3600):
+        """
+        Initialize worker pool
+
+        Args:
+            queue: Queue to take jobs from
+            handlers: Mapping of job kind to handler returning the job result
+            workers: Number of worker threads
+            poll_interval: Seconds between queue polls when idle
+            retention: Seconds to keep finished jobs before purging them
+        """
+        self.queue = queue
+        self.handlers = handlers
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.hostname = socket.gethostname()
+        self.worker_id = f"{self.hostname}:{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._last_purge = 0.0
+
+    def start(self) -> None:
+        """Requeue jobs orphaned by a previous restart and start worker threads"""
+        self.queue.requeue_orphaned(self.hostname)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} job workers ({self.worker_id})")
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop worker threads after their current job"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self) -> None:
+        """Wake idle workers because a job was just enqueued"""
+        self._wakeup.set()
+
+    def run_once(self) -> bool:
+        """
+        Claim and process a single job
+
+        Returns:
+            bool: True if a job was processed, False if the queue was empty
+        """
+        job = self.queue.claim(self.worker_id)
+        if job is None:
+            return False
+        self._process(job)
+        return True
+
+    def _worker_loop(self) -> None:
+        """Process jobs until the pool is stopped"""
+        while not self._stopping.is_set():
+            try:
+                if self.run_once():
+                    continue
+                self._purge_if_due()
+            except Exception as e:
+                logger.error(f"Error in job worker: {str(e)}", exc_info=True)
+
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _process(self, job: Dict[str, Any]) -> None:
+        """Run the handler of a claimed job and store its outcome"""
+        job_id = job['job_id']
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            self.queue.fail(job_id, f"Unknown job type: {job['kind']}")
+            return
+
+        try:
+            ctx = JobContext(self.queue, job)
+            result = handler(ctx)
+            if not ctx.suspended:
+                self.queue.complete(job_id, result)
+        except JobError as e:
+            self.queue.fail(job_id, str(e))
+        except Exception as e:
+            logger.error(f"Unexpected error processing job {job_id}: {str(e)}", exc_info=True)
+            self.queue.fail(job_id, 'Unexpected error processing job')
+
+    def _purge_if_due(self) -> None:
+        """Delete old finished jobs at most once an hour"""
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return
+        self._last_purge = now
+        purged = self.queue.purge_finished(self.retention)
+        if purged:
+            logger.info(f"Purged {purged} finished jobs")
+
+def _process_alive(pid: int) -> bool:
+    """Check whether a process with the given PID exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
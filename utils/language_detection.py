@@ -0,0 +1,87 @@
+import re
+import unicodedata
+
+# Frequent English function words and prompt vocabulary. A prompt made mostly
+# of these words is English, whatever the remaining subject nouns are.
+ENGLISH_WORDS = frozenset("""
+a an the and or but of in on at to for from with without by over under above below between behind
+into onto through across near next far beside around inside outside up down off out is are was were
+be been being has have had it its this that these those there here who which what where when while
+as than then very more most less so too not no only just also same other some any all each every
+my your his her our their him them he she they we you i me us one two three four five six seven eight
+nine ten many few several little big large small tiny huge tall short long wide old new young
+style photo photograph photography portrait picture image painting drawing illustration render
+rendering sketch artwork art concept cinematic realistic photorealistic hyperrealistic detailed
+highly ultra high resolution quality sharp focus soft light lighting lit shadow shadows dramatic
+moody atmosphere atmospheric background foreground scene view shot close closeup wide angle lens
+camera depth field bokeh blur blurry golden hour sunset sunrise night day morning evening sky cloud
+clouds sun moon star stars rain snow fog mist storm water sea ocean river lake beach mountain
+mountains forest tree trees flower flowers garden field city street road house building castle
+tower bridge room window door wall floor table chair bed car ship boat train plane man woman
+girl boy child children people person face eyes hair hand hands wearing dress shirt hat standing
+sitting walking running flying holding looking smiling cat dog bird horse fish dragon lion wolf
+fox bear robot warrior knight king queen princess wizard witch monster alien astronaut world earth
+planet space galaxy universe nature landscape fire ice light life love hello island desert village
+red orange yellow green blue purple pink brown black white gray grey gold golden silver colorful
+vibrant dark bright beautiful cute epic fantasy magical futuristic vintage retro modern ancient
+medieval cyberpunk steampunk anime cartoon comic oil watercolor digital 3d 4k 8k hd octane unreal
+engine trending artstation masterpiece minimalist abstract surreal elegant glowing neon
+""".split())
+
+# Frequent function words of other languages (mainly Czech, Slovak, German,
+# French, Spanish, Italian, Polish, Portuguese and Dutch) that are not English words
+FOREIGN_STOP_WORDS = frozenset("""
+na se je ve ze do od po pro jak ale nebo jsou byl byla bylo jeho jej ktery ktera ktere tento tato
+toto pod nad mezi pri bez uz jen velmi velky mala maly cerny bily modry
+der die das und ist nicht mit von auf den dem des ein eine einer eines im zu sich auch wie aber
+oder mit einem unter neben vor hinter zwischen schwarz weiss blau
+le la les et est une des du dans pour sur avec pas sont qui que au aux ce cette ces entre sous noir
+blanc bleu
+el los las y es un una del con por para sobre entre bajo muy negro blanco azul
+il lo gli di da con per tra fra sono nel nella della sulla molto nero bianco
+w z i nie jest sie jak ale lub pod nad przy czarny
+em um uma com para os dos das muito preto branco
+het een van en ik je niet met op aan voor onder zwart wit
+""".split()) - ENGLISH_WORDS
+
+# Letter combinations typical for English words missing from ENGLISH_WORDS
+ENGLISH_PATTERNS = re.compile(r'th|wh|ck|ght|ing$|tion$|ly$|ous$|ness$|ful$|ee|oo|ea')
+
+WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def english_confidence(text: str) -> float:
+    """
+    Estimate how confident we are that a text is English, without any network call
+
+    Known English words count fully, words with typical English letter patterns
+    partially and function words of other languages against. Letters outside
+    ASCII (diacritics, other scripts) lower the score as English uses none.
+
+    Args:
+        text (str): Text to classify
+
+    Returns:
+        float: Confidence between 0.0 and 1.0
+    """
+    words = [word.casefold() for word in WORD_RE.findall(text)]
+    if not words:
+        return 0.0
+
+    letters = [char for word in words for char in word]
+    non_ascii = sum(1 for char in letters if ord(char) > 127)
+
+    score = 0.0
+    for word in words:
+        # Compare without diacritics so foreign words typed without them still match
+        plain = unicodedata.normalize('NFKD', word).encode('ascii', 'ignore').decode()
+        if word in ENGLISH_WORDS:
+            score += 1.0
+        elif plain in FOREIGN_STOP_WORDS:
+            score -= 1.0
+        elif ENGLISH_PATTERNS.search(word):
+            score += 0.5
+
+    confidence = max(0.0, score) / len(words)
+    confidence *= max(0.0, 1.0 - 4 * non_ascii / len(letters))
+    return round(min(confidence, 1.0), 3)
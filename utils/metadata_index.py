@@ -0,0 +1,262 @@
+import re
+import json
+import sqlite3
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'\w+')
+
+class MetadataIndex(SQLiteStore):
+    """
+    SQLite index of image metadata for the gallery
+
+    Rows are ordered by the metadata timestamp, so a gallery page is a single
+    indexed query instead of listing and stat-ing every metadata file. Prompts
+    and model ids are also kept in an FTS5 full-text index, updated by triggers
+    in the same transaction. The JSON files stay the source of truth; the
+    index can be rebuilt from them.
+    """
+
+    # seq is an explicit rowid, so the full-text index can refer to rows
+    # without the rowids changing on VACUUM
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS images (
+            seq INTEGER PRIMARY KEY,
+            id TEXT NOT NULL UNIQUE,
+            timestamp TEXT NOT NULL,
+            image_filename TEXT,
+            model_id TEXT,
+            original_prompt TEXT,
+            translated_prompt TEXT,
+            metadata TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_images_timestamp ON images (timestamp DESC, id DESC);
+
+        CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+            original_prompt, translated_prompt, model_id,
+            content='images', content_rowid='seq',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+            INSERT INTO images_fts (rowid, original_prompt, translated_prompt, model_id)
+            VALUES (new.seq, new.original_prompt, new.translated_prompt, new.model_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, original_prompt, translated_prompt, model_id)
+            VALUES ('delete', old.seq, old.original_prompt, old.translated_prompt, old.model_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE ON images BEGIN
+            INSERT INTO images_fts (images_fts, rowid, original_prompt, translated_prompt, model_id)
+            VALUES ('delete', old.seq, old.original_prompt, old.translated_prompt, old.model_id);
+            INSERT INTO images_fts (rowid, original_prompt, translated_prompt, model_id)
+            VALUES (new.seq, new.original_prompt, new.translated_prompt, new.model_id);
+        END;
+    """
+
+    # An update (not REPLACE) keeps the rowid and fires the full-text update trigger
+    UPSERT = """
+        INSERT INTO images
+            (id, timestamp, image_filename, model_id, original_prompt, translated_prompt, metadata)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET
+            timestamp = excluded.timestamp,
+            image_filename = excluded.image_filename,
+            model_id = excluded.model_id,
+            original_prompt = excluded.original_prompt,
+            translated_prompt = excluded.translated_prompt,
+            metadata = excluded.metadata
+    """
+
+    # Relative weight of a match in original_prompt, translated_prompt and model_id
+    SEARCH_WEIGHTS = (2.0, 2.0, 1.0)
+
+    COLUMNS = 'id, timestamp, image_filename, model_id, original_prompt, translated_prompt, metadata'
+
+    def __init__(self, db_path: str):
+        """
+        Initialize index, upgrading a database created before full-text search
+
+        Args:
+            db_path (str): Path to the SQLite database file
+        """
+        super().__init__(db_path)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        """Recreate an images table keyed by id (no seq) with the current layout, keeping its rows"""
+        with self._transaction() as conn:
+            columns = {row['name'] for row in conn.execute("PRAGMA table_info(images)")}
+            if 'seq' in columns:
+                return
+            # The triggers and index just created on the old table would move with the rename
+            for name in ('images_fts_insert', 'images_fts_delete', 'images_fts_update'):
+                conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+            conn.execute('DROP INDEX IF EXISTS idx_images_timestamp')
+            conn.execute('ALTER TABLE images RENAME TO images_legacy')
+            for statement in _statements(self.SCHEMA):
+                conn.execute(statement)
+            conn.execute(f'INSERT INTO images ({self.COLUMNS}) SELECT {self.COLUMNS} FROM images_legacy')
+            conn.execute('DROP TABLE images_legacy')
+            conn.execute("INSERT INTO images_fts (images_fts) VALUES ('rebuild')")
+            count = conn.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+        logger.info(f"Migrated metadata index with {count} images to the full-text layout")
+
+    def put(self, image_id: str, metadata: Dict, write: Optional[Callable[[], None]] = None) -> None:
+        """
+        Insert or replace the metadata of an image
+
+        Args:
+            image_id (str): Image id (filename without extension)
+            metadata (Dict): Metadata with a timestamp
+            write (Optional[Callable[[], None]]): Runs inside the transaction, the row is
+                rolled back when it fails (used to write the metadata file)
+        """
+        with self._transaction() as conn:
+            conn.execute(self.UPSERT, self._row(image_id, metadata))
+            if write is not None:
+                write()
+
+    def remove(self, image_id: str, write: Optional[Callable[[], None]] = None) -> None:
+        """
+        Remove an image from the index
+
+        Args:
+            image_id (str): Image id
+            write (Optional[Callable[[], None]]): Runs inside the transaction (used to delete the metadata file)
+        """
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM images WHERE id = ?', (image_id,))
+            if write is not None:
+                write()
+
+    def count(self) -> int:
+        """Get the number of indexed images"""
+        return self._connect().execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def list_page(self, offset: int, limit: int) -> List[Dict]:
+        """
+        Get metadata of a page of images, newest first
+
+        Args:
+            offset (int): Images to skip
+            limit (int): Images to return
+
+        Returns:
+            List[Dict]: Metadata of the images
+        """
+        rows = self._connect().execute(
+            'SELECT metadata FROM images ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?',
+            (limit, offset)
+        ).fetchall()
+        return [json.loads(row['metadata']) for row in rows]
+
+    def list_after(self, after: Optional[Tuple[str, str]], limit: int) -> List[Tuple[str, str, Dict]]:
+        """
+        Get metadata of the images following a position, newest first
+
+        Seeks with the (timestamp, id) index instead of skipping rows, so every
+        page costs the same and does not shift when new images are added.
+
+        Args:
+            after (Optional[Tuple[str, str]]): (timestamp, id) of the last image already seen, None for the newest
+            limit (int): Images to return
+
+        Returns:
+            List[Tuple[str, str, Dict]]: Timestamp, id and metadata of every image
+        """
+        if after is None:
+            rows = self._connect().execute(
+                'SELECT id, timestamp, metadata FROM images ORDER BY timestamp DESC, id DESC LIMIT ?',
+                (limit,)
+            ).fetchall()
+        else:
+            rows = self._connect().execute(
+                """
+                SELECT id, timestamp, metadata FROM images
+                WHERE (timestamp, id) < (?, ?)
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+                """,
+                (after[0], after[1], limit)
+            ).fetchall()
+        return [(row['timestamp'], row['id'], json.loads(row['metadata'])) for row in rows]
+
+    def search(self, text: str, after: Optional[Tuple[float, str]], limit: int) -> List[Tuple[float, str, Dict]]:
+        """
+        Find images whose prompts or model id contain all words of a text, best match first
+
+        Words match as prefixes, ignoring case and diacritics. Paging is best-effort:
+        BM25 ranks depend on the whole index, so images added or removed between
+        pages shift the ranks and a result may repeat or be skipped.
+
+        Args:
+            text (str): Search text
+            after (Optional[Tuple[float, str]]): (rank, id) of the last result already seen, None for the best
+            limit (int): Results to return
+
+        Returns:
+            List[Tuple[float, str, Dict]]: Rank (lower is better), id and metadata of every result
+        """
+        words = WORD_RE.findall(text)
+        if not words:
+            return []
+        # Every word is quoted, so no input is parsed as FTS5 query syntax
+        match = ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+        rank = 'bm25(images_fts, {}, {}, {})'.format(*self.SEARCH_WEIGHTS)
+
+        query = f"""
+            SELECT images.id, images.metadata, {rank} AS rank
+            FROM images_fts JOIN images ON images.seq = images_fts.rowid
+            WHERE images_fts MATCH ?
+        """
+        params = [match]
+        if after is not None:
+            query += f" AND ({rank} > ? OR ({rank} = ? AND images.id > ?))"
+            params += [after[0], after[0], after[1]]
+        query += " ORDER BY rank, images.id LIMIT ?"
+        params.append(limit)
+
+        rows = self._connect().execute(query, params).fetchall()
+        return [(row['rank'], row['id'], json.loads(row['metadata'])) for row in rows]
+
+    def rebuild(self, entries: Iterable[Tuple[str, Dict]]) -> int:
+        """
+        Replace the whole index in one transaction
+
+        Args:
+            entries (Iterable[Tuple[str, Dict]]): Image ids with their metadata
+
+        Returns:
+            int: Number of indexed images
+        """
+        rows = [self._row(image_id, metadata) for image_id, metadata in entries]
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM images')
+            conn.executemany(self.UPSERT, rows)
+        logger.info(f"Rebuilt metadata index with {len(rows)} images")
+        return len(rows)
+
+    @staticmethod
+    def _row(image_id: str, metadata: Dict) -> tuple:
+        return (
+            image_id,
+            metadata['timestamp'],
+            metadata.get('image_filename'),
+            metadata.get('model_id'),
+            metadata.get('original_prompt'),
+            metadata.get('translated_prompt'),
+            json.dumps(metadata)
+        )
+
+def _statements(script: str) -> List[str]:
+    """Split a SQL script into statements, keeping trigger bodies whole"""
+    statements, current = [], ''
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+    return statements
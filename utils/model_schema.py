@@ -0,0 +1,320 @@
+import math
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Keywords of a property the parameter form needs, everything else is dropped
+PROPERTY_KEYWORDS = (
+    'type', 'title', 'description', 'default', 'enum', 'minimum', 'maximum', 'multipleOf', 'format', 'x-order'
+)
+
+def get_input_schema(schema: Optional[Dict]) -> Optional[Dict]:
+    """
+    Find the Input schema in a model's OpenAPI document
+
+    Args:
+        schema (Optional[Dict]): OpenAPI document as returned by ReplicateClient.get_model_details,
+            optionally wrapped in an "openapi_schema" key
+
+    Returns:
+        Optional[Dict]: The components.schemas.Input schema, None if missing
+    """
+    if not isinstance(schema, dict):
+        return None
+    document = schema.get('openapi_schema', schema)
+    return document.get('components', {}).get('schemas', {}).get('Input')
+
+def slim_input_schema(schema: Optional[Dict]) -> Optional[Dict]:
+    """
+    Reduce a model's OpenAPI document to the Input schema used by the parameter form
+
+    References to other component schemas (Replicate uses them for enums such
+    as aspect_ratio) are inlined into the properties.
+
+    Args:
+        schema (Optional[Dict]): OpenAPI document as returned by ReplicateClient.get_model_details
+
+    Returns:
+        Optional[Dict]: Input schema with only properties and required, None if missing
+    """
+    input_schema = get_input_schema(schema)
+    if not input_schema:
+        return None
+
+    document = schema.get('openapi_schema', schema)
+    components = document.get('components', {}).get('schemas', {})
+
+    properties = {}
+    for name, prop in input_schema.get('properties', {}).items():
+        properties[name] = _slim_property(_resolve_refs(prop, components))
+
+    slim = {'type': 'object', 'properties': properties}
+    if input_schema.get('required'):
+        slim['required'] = input_schema['required']
+    return slim
+
+def _resolve_refs(prop: Dict[str, Any], components: Dict[str, Dict]) -> Dict[str, Any]:
+    """Merge schemas referenced by $ref or allOf into the property"""
+    resolved = {key: value for key, value in prop.items() if key not in ('$ref', 'allOf')}
+    referenced = ([prop] if '$ref' in prop else []) + prop.get('allOf', [])
+    for item in referenced:
+        ref = item.get('$ref', '')
+        target = components.get(ref.rsplit('/', 1)[-1]) if ref.startswith('#/components/schemas/') else item
+        if target:
+            # Keywords of the property itself win over the referenced schema
+            resolved = dict(_resolve_refs(target, components), **resolved)
+        else:
+            logger.warning(f"Unresolvable schema reference: {ref}")
+    return resolved
+
+def _slim_property(prop: Dict[str, Any]) -> Dict[str, Any]:
+    """Keep only the keywords the parameter form uses"""
+    return {key: prop[key] for key in PROPERTY_KEYWORDS if key in prop}
+
+
+class InputValidationError(ValueError):
+    """Raised when parameters do not match a model's Input schema"""
+
+    def __init__(self, errors: List[Dict[str, Any]]):
+        """
+        Args:
+            errors (List[Dict[str, Any]]): One {"parameter", "message"} entry per invalid parameter
+        """
+        self.errors = errors
+        super().__init__('; '.join(f"{error['parameter']}: {error['message']}" for error in errors))
+
+def compile_input_validator(schema: Optional[Dict], supplied: Iterable[str] = ('prompt',)) -> Optional[Callable[[Dict], Dict]]:
+    """
+    Compile a model's Input schema into a function validating and coercing parameters
+
+    The schema is walked once and every property turned into a chain of small
+    checks, so validating a request is a few dictionary lookups and
+    comparisons. Values sent as strings by forms are coerced to the declared
+    type ("1024" -> 1024, "true" -> True). Parameters missing from the schema
+    are passed through unchanged, Replicate decides about them.
+
+    Args:
+        schema (Optional[Dict]): OpenAPI document as returned by ReplicateClient.get_model_details
+        supplied (Iterable[str]): Inputs the application fills in itself, they are neither checked nor required
+
+    Returns:
+        Optional[Callable[[Dict], Dict]]: Function returning coerced parameters and raising
+            InputValidationError, None if the document has no Input schema
+    """
+    input_schema = slim_input_schema(schema)
+    if input_schema is None:
+        return None
+
+    supplied = set(supplied)
+    checks = {
+        name: _compile_property(prop)
+        for name, prop in input_schema['properties'].items() if name not in supplied
+    }
+    required = [name for name in input_schema.get('required', []) if name in checks]
+
+    def validate(parameters: Dict) -> Dict:
+        if not isinstance(parameters, dict):
+            raise InputValidationError([{'parameter': 'parameters', 'message': 'must be an object'}])
+
+        coerced = {}
+        errors = []
+        for name, value in parameters.items():
+            check = checks.get(name)
+            if value is None:
+                # Not set, the model uses its default
+                continue
+            if check is None:
+                coerced[name] = value
+                continue
+            try:
+                coerced[name] = check(value)
+            except ValueError as e:
+                errors.append({'parameter': name, 'message': str(e)})
+            except OverflowError:
+                # JSON integers have no size limit, float arithmetic on them does
+                errors.append({'parameter': name, 'message': 'is out of range'})
+
+        for name in required:
+            if name not in coerced and name not in parameters:
+                errors.append({'parameter': name, 'message': 'is required'})
+
+        if errors:
+            raise InputValidationError(errors)
+        return coerced
+
+    return validate
+
+class InputValidators:
+    """
+    Compiled validators of model Input schemas
+
+    A validator is compiled the first time a schema is seen and reused while
+    the schema cache returns the same document; a refreshed schema is a new
+    document, so its validator is compiled again on next use.
+    """
+
+    def __init__(self):
+        self._validators: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._compiled = 0
+
+    def get(self, key: str, schema: Optional[Dict]) -> Optional[Callable[[Dict], Dict]]:
+        """
+        Get the validator of a schema, compiling it when the schema changed
+
+        Args:
+            key (str): Key of the schema, e.g. the pinned model reference
+            schema (Optional[Dict]): Current OpenAPI document of the model
+
+        Returns:
+            Optional[Callable[[Dict], Dict]]: Validator, None if the schema has no Input schema
+        """
+        with self._lock:
+            cached = self._validators.get(key)
+        if cached is not None and cached[0] is schema:
+            return cached[1]
+
+        validator = compile_input_validator(schema)
+        with self._lock:
+            self._validators[key] = (schema, validator)
+            self._compiled += 1
+        return validator
+
+    def clear(self) -> None:
+        """Forget all compiled validators"""
+        with self._lock:
+            self._validators.clear()
+
+    def get_stats(self) -> Dict[str, int]:
+        """Get the number of cached and compiled validators"""
+        with self._lock:
+            return {'validators': len(self._validators), 'compiled': self._compiled}
+
+def _compile_property(prop: Dict[str, Any]) -> Callable[[Any], Any]:
+    """Build the chain of checks of one property"""
+    steps = []
+
+    coerce = _COERCERS.get(prop.get('type'))
+    if coerce is not None:
+        steps.append(coerce)
+
+    if 'enum' in prop:
+        allowed = prop['enum']
+        try:
+            allowed_set = frozenset(allowed)
+        except TypeError:
+            # Enum of arrays or objects, checked against the list
+            allowed_set = allowed
+        def check_enum(value):
+            try:
+                found = value in allowed_set
+            except TypeError:
+                # Unhashable value (array, object) sent for an enum of scalars
+                found = False
+            if not found:
+                raise ValueError(f"must be one of {', '.join(map(str, allowed))}")
+            return value
+        steps.append(check_enum)
+
+    if prop.get('minimum') is not None:
+        minimum = prop['minimum']
+        def check_minimum(value):
+            if not _is_number(value):
+                raise ValueError("must be a number")
+            if value < minimum:
+                raise ValueError(f"must be at least {minimum}")
+            return value
+        steps.append(check_minimum)
+
+    if prop.get('maximum') is not None:
+        maximum = prop['maximum']
+        def check_maximum(value):
+            if not _is_number(value):
+                raise ValueError("must be a number")
+            if value > maximum:
+                raise ValueError(f"must be at most {maximum}")
+            return value
+        steps.append(check_maximum)
+
+    if prop.get('multipleOf'):
+        multiple = prop['multipleOf']
+        def check_multiple(value):
+            if not _is_number(value):
+                raise ValueError("must be a number")
+            if isinstance(value, int) and isinstance(multiple, int):
+                if value % multiple:
+                    raise ValueError(f"must be a multiple of {multiple}")
+                return value
+            quotient = value / multiple
+            if not math.isclose(quotient, round(quotient), abs_tol=1e-9):
+                raise ValueError(f"must be a multiple of {multiple}")
+            return value
+        steps.append(check_multiple)
+
+    if len(steps) == 1:
+        return steps[0]
+
+    def check(value):
+        for step in steps:
+            value = step(value)
+        return value
+    return check
+
+def _coerce_integer(value: Any) -> int:
+    if isinstance(value, bool):
+        raise ValueError("must be an integer")
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return _coerce_integer(float(value.strip()))
+        except ValueError:
+            pass
+    raise ValueError("must be an integer")
+
+def _coerce_number(value: Any) -> float:
+    if isinstance(value, bool):
+        raise ValueError("must be a number")
+    if isinstance(value, str):
+        try:
+            value = float(value.strip())
+        except ValueError:
+            raise ValueError("must be a number") from None
+    if not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError("must be a number")
+    return value
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+_BOOLEAN_STRINGS = {'true': True, '1': True, 'yes': True, 'on': True,
+                    'false': False, '0': False, 'no': False, 'off': False}
+
+def _coerce_boolean(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in _BOOLEAN_STRINGS:
+        return _BOOLEAN_STRINGS[value.strip().lower()]
+    raise ValueError("must be a boolean")
+
+def _check_type(expected: type, name: str) -> Callable[[Any], Any]:
+    def check(value):
+        if not isinstance(value, expected):
+            raise ValueError(f"must be {name}")
+        return value
+    return check
+
+_COERCERS = {
+    'integer': _coerce_integer,
+    'number': _coerce_number,
+    'boolean': _coerce_boolean,
+    'string': _check_type(str, 'a string'),
+    'array': _check_type(list, 'an array'),
+    'object': _check_type(dict, 'an object'),
+}
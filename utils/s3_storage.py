@@ -0,0 +1,194 @@
+import os
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+from utils.storage import FileManager, ImageManager
+from utils.cache import LRUCache
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # Only needed with IMAGE_STORAGE_BACKEND=s3
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+class S3ImageManager(ImageManager):
+    """
+    Manager for images kept in S3-compatible object storage (AWS S3, MinIO, R2, ...)
+
+    Browsers load images straight from the bucket, through its public URL or
+    presigned URLs, so image bytes never pass through the application and any
+    number of nodes can share one gallery. The local storage path only holds
+    downloads until they are uploaded.
+    """
+
+    # Images get random names and never change
+    CACHE_CONTROL = 'public, max-age=31536000, immutable'
+    NOT_FOUND_CODES = ('404', 'NoSuchKey', 'NotFound')
+    direct_urls = True
+
+    def __init__(self, storage_path: str, bucket: str, prefix: str = '', client: Optional[Any] = None,
+                 endpoint_url: Optional[str] = None, region: Optional[str] = None, public_url: Optional[str] = None,
+                 presign_expires: int = 3600, multipart_chunk_size: int = 8 * 1024 * 1024, max_concurrency: int = 4):
+        """
+        Initialize S3 image manager
+
+        Args:
+            storage_path (str): Local directory for downloads in progress
+            bucket (str): Bucket of the images
+            prefix (str): Key prefix of the images, e.g. "images/"
+            client (Optional[Any]): boto3 S3 client, created from endpoint_url and region when not set
+            endpoint_url (Optional[str]): Endpoint of an S3-compatible service, AWS when not set
+            region (Optional[str]): Region of the bucket
+            public_url (Optional[str]): Public base URL of the bucket (bucket website, CDN), presigned URLs when not set
+            presign_expires (int): Seconds presigned URLs are valid
+            multipart_chunk_size (int): Part size of multipart uploads, larger files are uploaded in parts
+            max_concurrency (int): Parts of one file uploaded at once
+        """
+        if boto3 is None:
+            raise ImportError("The S3 image storage backend requires boto3 (pip install boto3)")
+        super().__init__(storage_path)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.presign_expires = presign_expires
+        self.client = client or boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        # Files are streamed from disk part by part, memory use is bounded by chunk size x concurrency
+        self.transfer_config = TransferConfig(multipart_threshold=multipart_chunk_size,
+                                              multipart_chunksize=multipart_chunk_size,
+                                              max_concurrency=max_concurrency)
+        # A presigned URL is reused for half its lifetime, so browsers can cache the image
+        self._urls = LRUCache(max_entries=10000, ttl=presign_expires / 2)
+
+    def _key(self, filename: str) -> str:
+        return f"{self.prefix}{filename}"
+
+    def save_image_from_file(self, source_path: str, content_hash: Optional[str] = None) -> str:
+        """
+        Upload image from a local file and remove the file
+
+        Args:
+            source_path (str): Path to the source image file
+            content_hash (Optional[str]): Unused, objects are stored under their own name
+
+        Returns:
+            str: Object key of the saved image
+        """
+        try:
+            filename = self._generate_filename('webp')
+            key = self._key(filename)
+            self._upload(source_path, key)
+            os.unlink(source_path)
+            logger.info(f"Uploaded image: {key}")
+            return key
+
+        except Exception as e:
+            logger.error(f"Error uploading image from file: {str(e)}", exc_info=True)
+            raise
+
+    def _store_variant(self, source_path: str, filename: str) -> None:
+        """Upload a variant file and remove it"""
+        self._upload(source_path, self._key(filename))
+        os.unlink(source_path)
+
+    def _upload(self, path: str, key: str) -> None:
+        self.client.upload_file(
+            path, self.bucket, key,
+            ExtraArgs={'ContentType': 'image/webp', 'CacheControl': self.CACHE_CONTROL},
+            Config=self.transfer_config
+        )
+
+    def delete_image(self, filename: str, variants: Iterable[str] = ()) -> None:
+        """
+        Delete image object
+
+        Args:
+            filename (str): Filename of the image
+            variants (Iterable[str]): Filenames of its variants, deleted with it
+        """
+        try:
+            for name in [*variants, filename]:
+                self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+                self._urls.delete(name)
+            logger.info(f"Deleted image: {filename}")
+
+        except Exception as e:
+            logger.error(f"Error deleting image: {str(e)}", exc_info=True)
+            raise
+
+    def get_image_url(self, filename: str) -> str:
+        """Get the public or presigned URL of an image"""
+        if self.public_url:
+            return f"{self.public_url}/{self._key(filename)}"
+
+        url = self._urls.get(filename)
+        if url is None:
+            # Signed locally, no request to the storage
+            url = self.client.generate_presigned_url(
+                'get_object', Params={'Bucket': self.bucket, 'Key': self._key(filename)},
+                ExpiresIn=self.presign_expires
+            )
+            self._urls.set(filename, url)
+        return url
+
+    @contextmanager
+    def open_image(self, filename: str) -> Iterator[Optional[str]]:
+        """Download an image to a temporary local file, None if it does not exist"""
+        # Unique name, the same image may be converted by several requests at once
+        local_path = os.path.join(self.incoming_path, f"{uuid.uuid4()}-{filename}")
+        try:
+            try:
+                self.client.download_file(self.bucket, self._key(filename), local_path, Config=self.transfer_config)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') in self.NOT_FOUND_CODES:
+                    yield None
+                    return
+                raise
+            yield local_path
+        finally:
+            if os.path.exists(local_path):
+                os.remove(local_path)
+
+    def upload_local_images(self, source: FileManager, workers: int = 8) -> Dict[str, int]:
+        """
+        Copy images of a local image directory into the bucket under the same names
+
+        Images already in the bucket are skipped, so the upload can be interrupted
+        and started again. Local files are kept.
+
+        Args:
+            source (FileManager): Manager of the local image directory
+            workers (int): Files uploaded concurrently
+
+        Returns:
+            Dict[str, int]: Number of uploaded, skipped and failed files
+        """
+        counts = {'uploaded': 0, 'skipped': 0, 'failed': 0}
+
+        def upload(item):
+            filename, path = item
+            key = self._key(filename)
+            try:
+                try:
+                    self.client.head_object(Bucket=self.bucket, Key=key)
+                    return 'skipped'
+                except ClientError as e:
+                    if e.response.get('Error', {}).get('Code') not in self.NOT_FOUND_CODES:
+                        raise
+                self._upload(path, key)
+                return 'uploaded'
+            except Exception as e:
+                logger.error(f"Error uploading {path}: {str(e)}")
+                return 'failed'
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for result in executor.map(upload, source.iter_files('.webp')):
+                counts[result] += 1
+
+        logger.info(f"Uploaded local images to {self.bucket}/{self.prefix}: {counts}")
+        return counts
@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import threading
+import logging
+from contextlib import contextmanager
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+class SQLiteStore:
+    """
+    Base class for small SQLite databases shared by all Gunicorn workers
+
+    Every thread gets its own connection. The database runs in WAL mode so
+    readers never block the single writer, and writes are wrapped in
+    BEGIN IMMEDIATE transactions to serialize them across processes.
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, db_path: str, busy_timeout: float = 30.0):
+        """
+        Initialize store and create its schema
+
+        Args:
+            db_path (str): Path to the SQLite database file
+            busy_timeout (float): Seconds to wait for a lock held by another process
+        """
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        if self.SCHEMA:
+            self._connect().executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Get the connection owned by the current thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None keeps the connection in autocommit mode,
+            # transactions are opened explicitly in _transaction()
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run the block inside a write transaction"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
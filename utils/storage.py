@@ -1,20 +1,75 @@
+import re
 import json
 import os
+import base64
+import threading
+import errno
+import time
 import uuid
+import hashlib
 import logging
-from typing import Dict, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import requests
 from datetime import datetime, timezone # Import timezone
 import shutil
+from contextlib import contextmanager
+from utils.metadata_index import MetadataIndex
+from utils.content_store import ContentStore
 
 logger = logging.getLogger(__name__)
 
+def encode_cursor(*position) -> str:
+    """Encode a position in a listing as an opaque URL-safe cursor"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor: str, *types) -> tuple:
+    """
+    Decode a cursor created by encode_cursor
+
+    Args:
+        cursor (str): Cursor
+        *types: Expected type (or tuple of types) of every item of the position
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not (isinstance(position, list) and len(position) == len(types)
+            and all(isinstance(item, expected) for item, expected in zip(position, types))):
+        raise ValueError("Invalid cursor")
+    return tuple(position)
+
 class FileManager:
-    """Base class for file management"""
+    """
+    Base class for file management
+
+    Files can be spread over a fan-out of subdirectories named by the leading
+    hex characters of their UUID names ("3f/3fa2...webp" with one level), so
+    no directory grows to hundreds of thousands of entries. Files are written
+    in the configured layout and found in any layout, so existing files keep
+    working while migrate_layout() moves them.
+    """
 
-    def __init__(self, storage_path: str):
-        """Initialize with storage path"""
+    # Deepest supported fan-out, each level is named by two hex characters
+    MAX_SHARD_DEPTH = 2
+    SHARD_DIR_RE = re.compile(r'^[0-9a-f]{2}$')
+
+    def __init__(self, storage_path: str, shard_depth: int = 0):
+        """
+        Initialize with storage path
+
+        Args:
+            storage_path (str): Root directory of the files
+            shard_depth (int): Subdirectory levels new files are written to, 0 for a flat directory
+        """
+        if not 0 <= shard_depth <= self.MAX_SHARD_DEPTH:
+            raise ValueError(f"Shard depth must be between 0 and {self.MAX_SHARD_DEPTH}")
         self.storage_path = storage_path
+        self.shard_depth = shard_depth
         os.makedirs(storage_path, exist_ok=True)
 
     def _generate_filename(self, extension: str) -> str:
@@ -22,22 +77,161 @@ class FileManager:
         return f"{uuid.uuid4()}.{extension}"
 
     def _get_full_path(self, filename: str) -> str:
-        """Get full path for a file"""
-        return os.path.join(self.storage_path, filename)
+        """Get full path for a file in the configured layout"""
+        return self._path_at_depth(filename, self.shard_depth)
+
+    def _path_at_depth(self, filename: str, depth: int) -> str:
+        """Get path of a file in a layout with the given number of subdirectory levels"""
+        shards = [filename[2 * level:2 * level + 2] for level in range(depth)]
+        # Names not starting with hex characters (and so never "..") stay in the root
+        if not all(self.SHARD_DIR_RE.match(shard) for shard in shards):
+            shards = []
+        return os.path.join(self.storage_path, *shards, filename)
+
+    def _candidate_paths(self, filename: str) -> List[str]:
+        """Paths of a file in the configured layout first, then in the others"""
+        depths = [self.shard_depth] + [depth for depth in range(self.MAX_SHARD_DEPTH + 1) if depth != self.shard_depth]
+        return list(dict.fromkeys(self._path_at_depth(filename, depth) for depth in depths))
+
+    def resolve_path(self, filename: str) -> Optional[str]:
+        """
+        Find an existing file in any layout
+
+        Args:
+            filename (str): Name of the file
+
+        Returns:
+            Optional[str]: Full path of the file, None if it does not exist
+        """
+        # A second pass catches a file moved by a running migration between the checks
+        for _ in range(2):
+            for path in self._candidate_paths(filename):
+                if os.path.isfile(path):
+                    return path
+        return None
+
+    def _remove_file(self, filename: str) -> bool:
+        """Remove a file from every layout, returns whether it existed"""
+        removed = False
+        for path in self._candidate_paths(filename):
+            try:
+                os.remove(path)
+                removed = True
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def iter_files(self, extension: str = '') -> Iterator[Tuple[str, str]]:
+        """
+        Iterate over all stored files in any layout
+
+        Args:
+            extension (str): Only files with names ending with it
+
+        Yields:
+            Tuple[str, str]: File name and full path
+        """
+        def walk(directory, depth):
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # Hidden directories (.incoming) and foreign ones are not part of the layout
+                        if depth < self.MAX_SHARD_DEPTH and self.SHARD_DIR_RE.match(entry.name):
+                            yield from walk(entry.path, depth + 1)
+                    elif entry.name.endswith(extension) and not entry.name.startswith('.'):
+                        yield entry.name, entry.path
+
+        yield from walk(self.storage_path, 0)
+
+    def migrate_layout(self, workers: int = 8) -> Dict[str, int]:
+        """
+        Move files stored in another layout to the configured one
+
+        Every move is an atomic rename, so the application keeps serving files
+        while this runs. It can be interrupted and run again at any time; a
+        file already present in the new layout was written later and wins.
+
+        Args:
+            workers (int): Files moved concurrently
+
+        Returns:
+            Dict[str, int]: Number of moved, stale (removed) and failed files
+        """
+        counts = {'moved': 0, 'stale': 0, 'failed': 0}
+        lock = threading.Lock()
+
+        def migrate(item):
+            filename, path = item
+            target = self._get_full_path(filename)
+            # Temporary files are renamed by their writer
+            if path == target or filename.endswith('.tmp'):
+                return
+            try:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                if os.path.exists(target):
+                    os.remove(path)
+                    result = 'stale'
+                else:
+                    os.replace(path, target)
+                    result = 'moved'
+            except OSError as e:
+                logger.warning(f"Could not migrate {path}: {str(e)}")
+                result = 'failed'
+            with lock:
+                counts[result] += 1
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Consume lazily so huge directories are never listed into memory at once
+            for _ in executor.map(migrate, self.iter_files()):
+                pass
+
+        logger.info(f"Migrated {self.storage_path} to shard depth {self.shard_depth}: {counts}")
+        return counts
 
 class ImageManager(FileManager):
-    """Manager for handling image files"""
+    """
+    Manager for handling image files
 
-    def __init__(self, storage_path: str):
-        """Initialize image manager"""
-        super().__init__(storage_path)
+    Keeps images on the local filesystem, served by the application. Other
+    storage backends (S3ImageManager) implement the same methods.
+    """
 
-    def save_image_from_file(self, source_path: str) -> str:
+    # Hidden subdirectory for downloads in progress. Being on the same
+    # filesystem as the images, finished downloads are moved in with a rename.
+    INCOMING_DIR = '.incoming'
+    COPY_CHUNK_SIZE = 1024 * 1024
+    # Whether browsers load images from get_image_url instead of the /images route
+    direct_urls = False
+
+    def __init__(self, storage_path: str, shard_depth: int = 0, content_store: Optional[ContentStore] = None):
+        """
+        Initialize image manager
+
+        Args:
+            storage_path (str): Directory of the images
+            shard_depth (int): Levels of hex-prefixed subdirectories new images are written to
+            content_store (Optional[ContentStore]): Store identical images once, as hard links to one blob
+        """
+        super().__init__(storage_path, shard_depth)
+        self.incoming_path = os.path.join(storage_path, self.INCOMING_DIR)
+        self.content_store = content_store
+        os.makedirs(self.incoming_path, exist_ok=True)
+
+    def save_image_from_file(self, source_path: str, content_hash: Optional[str] = None) -> str:
         """
         Save image from a local file
 
+        The file is moved into storage with an atomic rename. Files from another
+        filesystem are copied in bounded chunks next to the destination first,
+        so a partially written image is never visible.
+
+        With a content store, the image is stored by its SHA-256 and linked into
+        place. The hash computed while downloading is used when the source path
+        carries one (DownloadedFile), so the image is not read again.
+
         Args:
             source_path (str): Path to the source image file
+            content_hash (Optional[str]): SHA-256 of the file, taken from source_path.sha256 when not set
 
         Returns:
             str: Full path to the saved image
@@ -45,13 +239,20 @@ class ImageManager(FileManager):
         try:
             filename = self._generate_filename('webp')
             dest_path = self._get_full_path(filename)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
 
-            # Copy the file using binary mode
-            with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
-                dst.write(src.read())
+            if self.content_store is not None:
+                self._save_content_addressed(filename, source_path, dest_path,
+                                             content_hash or getattr(source_path, 'sha256', None))
+                logger.info(f"Saved image: {filename}")
+                return dest_path
 
-            # Remove the temporary file
-            os.unlink(source_path)
+            try:
+                os.replace(source_path, dest_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                self._copy_across_filesystems(source_path, dest_path)
 
             logger.info(f"Saved image: {filename}")
             return dest_path # Return the full path
@@ -60,12 +261,141 @@ class ImageManager(FileManager):
             logger.error(f"Error saving image from file: {str(e)}", exc_info=True)
             raise
 
-    def delete_image(self, filename: str) -> None:
-        """Delete image file"""
+    def _save_content_addressed(self, filename: str, source_path: str, dest_path: str,
+                                content_hash: Optional[str]) -> None:
+        """Stage a file in the incoming directory and hand it to the content store"""
+        staging_path = os.path.join(self.incoming_path, filename)
         try:
-            full_path = self._get_full_path(filename)
-            if os.path.exists(full_path):
-                os.remove(full_path)
+            try:
+                os.replace(source_path, staging_path)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                # The copy has to read the file anyway, hash it on the way
+                content_hash = self._copy_and_hash(source_path, staging_path)
+            if content_hash is None:
+                content_hash = self._hash_file(staging_path)
+            self.content_store.add(filename, staging_path, content_hash, dest_path)
+        except BaseException:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+
+    def _copy_and_hash(self, source_path: str, dest_path: str) -> str:
+        """Copy a file in bounded chunks, remove the source and return the SHA-256 of the content"""
+        hasher = hashlib.sha256()
+        with open(source_path, 'rb') as src, open(dest_path, 'wb') as dst:
+            for chunk in iter(lambda: src.read(self.COPY_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+                dst.write(chunk)
+        os.unlink(source_path)
+        return hasher.hexdigest()
+
+    def _hash_file(self, path: str) -> str:
+        """Get the SHA-256 of a file's content"""
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.COPY_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def _copy_across_filesystems(self, source_path: str, dest_path: str) -> None:
+        """Copy a file from another filesystem into storage and remove the source"""
+        staging_path = os.path.join(self.incoming_path, os.path.basename(dest_path))
+        try:
+            with open(source_path, 'rb') as src, open(staging_path, 'wb') as dst:
+                # Kernel-side copy where available, constant memory otherwise
+                try:
+                    offset, size = 0, os.fstat(src.fileno()).st_size
+                    while offset < size:
+                        sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+                        if sent == 0:
+                            break
+                        offset += sent
+                except (AttributeError, OSError):
+                    src.seek(0)
+                    dst.seek(0)
+                    dst.truncate()
+                    shutil.copyfileobj(src, dst, self.COPY_CHUNK_SIZE)
+            os.replace(staging_path, dest_path)
+        except BaseException:
+            if os.path.exists(staging_path):
+                os.remove(staging_path)
+            raise
+        os.unlink(source_path)
+
+    def purge_incoming(self, max_age: int = 3600) -> int:
+        """
+        Remove downloads abandoned by crashed workers
+
+        Args:
+            max_age (int): Age in seconds after which an unfinished download is abandoned
+
+        Returns:
+            int: Number of removed files
+        """
+        removed = 0
+        cutoff = time.time() - max_age
+        for entry in os.scandir(self.incoming_path):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError as e:
+                logger.warning(f"Could not remove abandoned download {entry.name}: {str(e)}")
+        if removed:
+            logger.info(f"Removed {removed} abandoned downloads")
+        return removed
+
+    def save_variants(self, image_filename: str, variants: Dict[str, str]) -> Dict[str, str]:
+        """
+        Move the variants of an image (thumbnails) into storage next to it
+
+        Args:
+            image_filename (str): Filename of the image
+            variants (Dict[str, str]): Path of every variant file by its name
+
+        Returns:
+            Dict[str, str]: Filename of every variant by its name ("<id>_<name>.webp")
+        """
+        image_id = os.path.splitext(image_filename)[0]
+        saved = {}
+        for name, path in variants.items():
+            filename = f"{image_id}_{name}.webp"
+            self._store_variant(path, filename)
+            saved[name] = filename
+        return saved
+
+    def _store_variant(self, source_path: str, filename: str) -> None:
+        """Move a variant file from the incoming directory into place"""
+        dest_path = self._get_full_path(filename)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        os.replace(source_path, dest_path)
+
+    def get_image_url(self, filename: str) -> str:
+        """Get the URL an image is loaded from"""
+        return f"/images/{filename}"
+
+    @contextmanager
+    def open_image(self, filename: str) -> Iterator[Optional[str]]:
+        """Get the local path of an image for reading, None if it does not exist"""
+        yield self.resolve_path(filename)
+
+    def delete_image(self, filename: str, variants: Iterable[str] = ()) -> None:
+        """
+        Delete image file
+
+        Args:
+            filename (str): Filename of the image
+            variants (Iterable[str]): Filenames of its variants, deleted with it
+        """
+        try:
+            for variant in variants:
+                self._remove_file(variant)
+            # Images stored by content drop their reference, the blob goes with the last one
+            if self.content_store is not None and self.content_store.remove(filename, self.resolve_path(filename)):
+                logger.info(f"Deleted image: {filename}")
+            elif self._remove_file(filename):
                 logger.info(f"Deleted image: {filename}")
             else:
                 logger.warning(f"Image not found: {filename}")
@@ -77,9 +407,18 @@ class ImageManager(FileManager):
 class MetadataManager(FileManager):
     """Manager for handling metadata files"""
 
-    def __init__(self, storage_path: str):
-        """Initialize metadata manager"""
-        super().__init__(storage_path)
+    def __init__(self, storage_path: str, index: Optional[MetadataIndex] = None, shard_depth: int = 0):
+        """
+        Initialize metadata manager
+
+        Args:
+            storage_path (str): Directory of the metadata files
+            index (Optional[MetadataIndex]): Index kept in sync with the files and used for listing,
+                without it the directory is scanned on every listing
+            shard_depth (int): Subdirectory levels new files are written to
+        """
+        super().__init__(storage_path, shard_depth)
+        self.index = index
 
     def save_metadata(self, image_filename: str, metadata: Dict) -> str:
         """
@@ -101,8 +440,12 @@ class MetadataManager(FileManager):
             metadata['timestamp'] = datetime.now(timezone.utc).isoformat()
             metadata['image_filename'] = image_filename
 
-            with open(full_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            if self.index is None:
+                self._write_json(full_path, metadata)
+            else:
+                # The row is rolled back if the file cannot be written
+                self.index.put(os.path.splitext(filename)[0], metadata,
+                               write=lambda: self._write_json(full_path, metadata))
 
             logger.info(f"Saved metadata: {filename}")
             return filename
@@ -111,11 +454,37 @@ class MetadataManager(FileManager):
             logger.error(f"Error saving metadata: {str(e)}", exc_info=True)
             raise
 
+    def update_metadata(self, image_filename: str, updates: Dict) -> Optional[Dict]:
+        """
+        Add or replace fields of an image's metadata, keeping its timestamp
+
+        Args:
+            image_filename (str): Filename of the associated image
+            updates (Dict): Fields to set
+
+        Returns:
+            Optional[Dict]: Updated metadata, None if the image has no metadata
+        """
+        filename = f"{os.path.splitext(image_filename)[0]}.json"
+        full_path = self.resolve_path(filename)
+        if full_path is None:
+            return None
+        with open(full_path, 'r') as f:
+            metadata = json.load(f)
+        metadata.update(updates)
+
+        if self.index is None:
+            self._write_json(full_path, metadata)
+        else:
+            self.index.put(os.path.splitext(filename)[0], metadata,
+                           write=lambda: self._write_json(full_path, metadata))
+        return metadata
+
     def get_metadata(self, filename: str) -> Optional[Dict]:
         """Get metadata for a file"""
         try:
-            full_path = self._get_full_path(filename)
-            if not os.path.exists(full_path):
+            full_path = self.resolve_path(filename)
+            if full_path is None:
                 return None
 
             with open(full_path, 'r') as f:
@@ -128,12 +497,16 @@ class MetadataManager(FileManager):
     def delete_metadata(self, filename: str) -> None:
         """Delete metadata file"""
         try:
-            full_path = self._get_full_path(filename)
-            if os.path.exists(full_path):
-                os.remove(full_path)
-                logger.info(f"Deleted metadata: {filename}")
+            def remove_file():
+                if self._remove_file(filename):
+                    logger.info(f"Deleted metadata: {filename}")
+                else:
+                    logger.warning(f"Metadata not found: {filename}")
+
+            if self.index is None:
+                remove_file()
             else:
-                logger.warning(f"Metadata not found: {filename}")
+                self.index.remove(os.path.splitext(filename)[0], write=remove_file)
 
         except Exception as e:
             logger.error(f"Error deleting metadata: {str(e)}", exc_info=True)
@@ -153,11 +526,17 @@ class MetadataManager(FileManager):
                 total_pages: Total number of pages
         """
         try:
+            if self.index is not None:
+                total_items = self.index.count()
+                return {
+                    'images': self.index.list_page((page - 1) * per_page, per_page),
+                    'total_pages': (total_items + per_page - 1) // per_page
+                }
+
             # Get all metadata files
-            metadata_files = [f for f in os.listdir(self.storage_path)
-                            if f.endswith('.json')]
-            metadata_files.sort(key=lambda x: os.path.getmtime(self._get_full_path(x)),
-                              reverse=True)
+            metadata_files = sorted(self.iter_files('.json'), key=lambda item: os.path.getmtime(item[1]),
+                                    reverse=True)
+            metadata_files = [filename for filename, _ in metadata_files]
 
             # Calculate pagination
             total_items = len(metadata_files)
@@ -181,4 +560,94 @@ class MetadataManager(FileManager):
 
         except Exception as e:
             logger.error(f"Error listing images: {str(e)}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
+
+    def list_images_after(self, cursor: Optional[str] = None, per_page: int = 12) -> Dict[str, any]:
+        """
+        List images with their metadata, newest first, continuing from a cursor
+
+        Args:
+            cursor (Optional[str]): next_cursor of the previous page, None for the first page
+            per_page (int): Number of items per page
+
+        Returns:
+            Dict containing:
+                images: List of image metadata
+                next_cursor: Opaque cursor of the next page, None on the last page
+
+        Raises:
+            ValueError: If the cursor is invalid or the manager has no index
+        """
+        if self.index is None:
+            raise ValueError("Cursor pagination requires the metadata index")
+
+        # One extra row tells whether there is a next page
+        rows = self.index.list_after(decode_cursor(cursor, str, str) if cursor else None, per_page + 1)
+        next_cursor = encode_cursor(rows[per_page - 1][0], rows[per_page - 1][1]) if len(rows) > per_page else None
+        return {
+            'images': [metadata for _, _, metadata in rows[:per_page]],
+            'next_cursor': next_cursor
+        }
+
+    def search_images(self, query: str, cursor: Optional[str] = None, per_page: int = 12) -> Dict[str, any]:
+        """
+        Search images by prompt and model id, best match first
+
+        Args:
+            query (str): Search text
+            cursor (Optional[str]): next_cursor of the previous page, None for the first page
+            per_page (int): Number of items per page
+
+        Returns:
+            Dict containing:
+                images: List of image metadata
+                next_cursor: Opaque cursor of the next page, None on the last page
+
+        Raises:
+            ValueError: If the cursor is invalid or the manager has no index
+        """
+        if self.index is None:
+            raise ValueError("Search requires the metadata index")
+
+        after = decode_cursor(cursor, (int, float), str) if cursor else None
+        rows = self.index.search(query, after, per_page + 1)
+        next_cursor = encode_cursor(rows[per_page - 1][0], rows[per_page - 1][1]) if len(rows) > per_page else None
+        return {
+            'images': [metadata for _, _, metadata in rows[:per_page]],
+            'next_cursor': next_cursor
+        }
+
+    def rebuild_index(self) -> int:
+        """
+        Repopulate the index from the metadata files
+
+        Files without a timestamp (written by old versions) are indexed by their modification time.
+
+        Returns:
+            int: Number of indexed images
+        """
+        if self.index is None:
+            raise ValueError("Metadata manager has no index")
+
+        def entries():
+            for filename, path in self.iter_files('.json'):
+                try:
+                    with open(path, 'r') as f:
+                        metadata = json.load(f)
+                    if not metadata.get('timestamp'):
+                        metadata['timestamp'] = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc).isoformat()
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Skipping unreadable metadata {filename}: {str(e)}")
+                    continue
+                yield os.path.splitext(filename)[0], metadata
+
+        return self.index.rebuild(entries())
+
+    @staticmethod
+    def _write_json(path: str, data: Dict) -> None:
+        """Write JSON through a temporary file, so readers never see a partial file"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import logging
+from typing import Dict, Iterable
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+class ThumbnailGenerator:
+    """
+    Creates the downscaled variants of an image shown by the gallery
+
+    The image is decoded once; JPEG sources are decoded at a reduced scale
+    right away (draft mode), and every width is resized from the previous,
+    larger one with a box reduction before the final resampling, so a set of
+    variants costs little more than decoding the original.
+    """
+
+    # Name of the tiny variant used as the blurred card background
+    PLACEHOLDER = 'blur'
+
+    def __init__(self, widths: Iterable[int] = (256, 512, 1024), quality: int = 80,
+                 placeholder_width: int = 32, placeholder_quality: int = 50):
+        """
+        Initialize generator
+
+        Args:
+            widths (Iterable[int]): Widths of the thumbnails, images are never upscaled
+            quality (int): WebP quality of the thumbnails
+            placeholder_width (int): Width of the blurred background variant
+            placeholder_quality (int): WebP quality of the blurred background variant
+        """
+        self.widths = sorted(set(widths), reverse=True)
+        self.quality = quality
+        self.placeholder_width = placeholder_width
+        self.placeholder_quality = placeholder_quality
+
+    def generate(self, source_path: str, dest_dir: str) -> Dict[str, str]:
+        """
+        Create the variants of an image
+
+        Args:
+            source_path (str): Path to the image
+            dest_dir (str): Directory for the variant files
+
+        Returns:
+            Dict[str, str]: Path of every variant by its name, the width ("512") or "blur"
+        """
+        variants = {}
+        try:
+            with Image.open(source_path) as img:
+                original_width = img.width
+                largest = self.widths[0] if self.widths else self.placeholder_width
+                img.draft('RGB', (largest, max(1, largest * img.height // img.width)))
+                current = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+
+            for width in self.widths:
+                if width >= original_width:
+                    continue
+                current = self._resize(current, width)
+                variants[str(width)] = self._save(current, dest_dir, self.quality)
+
+            current = self._resize(current, min(self.placeholder_width, current.width))
+            variants[self.PLACEHOLDER] = self._save(current, dest_dir, self.placeholder_quality)
+            return variants
+
+        except BaseException:
+            for path in variants.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+    @staticmethod
+    def _resize(img: Image.Image, width: int) -> Image.Image:
+        """Resize keeping the aspect ratio, with an integer box reduction first"""
+        height = max(1, round(img.height * width / img.width))
+        return img.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+
+    @staticmethod
+    def _save(img: Image.Image, dest_dir: str, quality: int) -> str:
+        temp_fd, temp_path = tempfile.mkstemp(suffix='.webp', dir=dest_dir)
+        os.close(temp_fd)
+        try:
+            img.save(temp_path, 'WEBP', quality=quality, method=4)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return temp_path